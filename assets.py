@@ -0,0 +1,122 @@
+"""
+Кэш file_id для статических файлов (картинка с инструкцией и т.п.).
+
+Файл загружается в Telegram один раз; полученный file_id сохраняется в
+хранилище вместе с SHA-256 содержимого, и дальше файл отправляется по id.
+Если файл на диске изменился (другой хэш) или Telegram перестал принимать
+file_id, файл загружается заново.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+
+log = logging.getLogger(__name__)
+
+STATE_PREFIX = "asset:"
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_stale_file_id(error: Exception) -> bool:
+    """Telegram отверг file_id (устарел или выдан другому боту)."""
+    if getattr(error, 'error_code', None) != 400:
+        return False
+    description = (getattr(error, 'description', None) or str(error)).lower()
+    return "file" in description
+
+
+class _Asset:
+    __slots__ = ('stat', 'digest', 'file_id', 'lock')
+
+    def __init__(self, digest: str = None, file_id: str = None):
+        # (mtime_ns, size) файла, для которого посчитан digest
+        self.stat = None
+        self.digest = digest
+        self.file_id = file_id
+        self.lock = threading.Lock()
+
+
+class AssetCache:
+    """
+    send(chat_id, content_type, content, caption) отправляет файл или file_id
+    и возвращает Message; file_id(message) достает id из ответа.
+    """
+
+    def __init__(self, backend, send, file_id):
+        self.backend = backend
+        self._send = send
+        self._file_id = file_id
+        self._assets = {}
+        self._lock = threading.Lock()
+        self.uploads = 0
+        self.cached_sends = 0
+
+    def _asset(self, path: str) -> _Asset:
+        with self._lock:
+            asset = self._assets.get(path)
+            if asset is None:
+                value = self.backend.load_state(STATE_PREFIX + path)
+                stored = json.loads(value) if value else {}
+                asset = self._assets[path] = _Asset(stored.get('sha256'), stored.get('file_id'))
+            return asset
+
+    def _refresh(self, path: str, asset: _Asset):
+        """Пересчитывает хэш, только если у файла изменились время или размер."""
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        if asset.stat == key:
+            return
+        digest = file_digest(path)
+        if digest != asset.digest:
+            if asset.file_id:
+                log.info("🔄 Файл %s изменился, будет загружен заново", path)
+            asset.digest = digest
+            asset.file_id = None
+        asset.stat = key
+
+    def send(self, chat_id: int, path: str, content_type: str = 'photo', caption: str = ""):
+        """Отправляет файл по сохраненному file_id, при необходимости загружая его."""
+        asset = self._asset(path)
+        # Блокировка на файл: при наплыве /start файл загружается один раз,
+        # остальные отправки ждут и используют полученный file_id
+        with asset.lock:
+            self._refresh(path, asset)
+            file_id = asset.file_id
+            if file_id is None:
+                return self._upload(chat_id, path, asset, content_type, caption)
+
+        try:
+            result = self._send(chat_id, content_type, file_id, caption)
+        except Exception as e:
+            if not is_stale_file_id(e):
+                raise
+            log.warning("⚠️ file_id для %s не принят (%s), загружаем файл заново", path, e)
+            with asset.lock:
+                if asset.file_id == file_id:
+                    asset.file_id = None
+                if asset.file_id is None:
+                    return self._upload(chat_id, path, asset, content_type, caption)
+                file_id = asset.file_id
+            result = self._send(chat_id, content_type, file_id, caption)
+        self.cached_sends += 1
+        return result
+
+    def _upload(self, chat_id: int, path: str, asset: _Asset, content_type: str, caption: str):
+        with open(path, "rb") as f:
+            result = self._send(chat_id, content_type, f, caption)
+        asset.file_id = self._file_id(result)
+        self.uploads += 1
+        self.backend.save_state(
+            STATE_PREFIX + path,
+            json.dumps({'sha256': asset.digest, 'file_id': asset.file_id})
+        )
+        log.info("📤 Файл %s загружен, дальше отправляется по file_id", path)
+        return result
@@ -0,0 +1,403 @@
+"""
+Асинхронный вариант бота на telebot.async_telebot.
+
+Использует те же хранилища, конфигурацию и форматирование уведомлений, что и
+main.py, но все запросы к API идут через один пул keep-alive соединений
+aiohttp, поэтому один процесс держит тысячи одновременных отправок.
+
+Запуск: python async_main.py
+"""
+import asyncio
+import logging
+import os
+
+import telebot
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+
+import main as core
+from broadcast import BroadcastJob
+from delivery import SendFailure, BAD_REQUEST, FLOOD, is_retryable
+from ratelimit import TokenBucket, get_retry_after
+
+log = logging.getLogger(__name__)
+
+# Размер пула соединений aiohttp и число одновременных отправок при рассылке
+ASYNC_POOL_SIZE = int(os.getenv("ASYNC_POOL_SIZE", "100"))
+ASYNC_BROADCAST_CONCURRENCY = int(os.getenv("ASYNC_BROADCAST_CONCURRENCY", "50"))
+
+# Один пул соединений на весь процесс и те же повторы сетевых ошибок, что в синхронной
+# сессии (без RETRY_ON_ERROR asyncio_helper игнорирует MAX_RETRIES)
+asyncio_helper.REQUEST_LIMIT = ASYNC_POOL_SIZE
+asyncio_helper.RETRY_ON_ERROR = True
+asyncio_helper.MAX_RETRIES = core.HTTP_RETRIES
+
+abot = AsyncTeleBot(core.TELEGRAM_TOKEN, parse_mode="HTML")
+
+# Функции отправки, заранее привязанные к асинхронному клиенту
+content_types = core.CONTENT_TYPES.for_client(abot)
+
+broadcast_state = {'job': None}
+owner_lookups = {}
+
+BUSINESS_CONTENT_TYPES = core.BUSINESS_CONTENT_TYPES
+
+
+async def send_once(chat_id: int, content_type: str, content, caption: str = "", **kwargs):
+    """
+    Одна попытка отправки. Возвращает Message или SendFailure; результат
+    учитывается в реестре недоступных чатов.
+    """
+    try:
+        result = await content_types.send(chat_id, content_type, content, caption, **kwargs)
+    except Exception as e:
+        await asyncio.to_thread(core.dead_chats.handle_result, chat_id, e)
+        return SendFailure.from_error(e)
+    # Живой чат отмечается без обращения к базе; запись нужна, только если он числился мертвым
+    if chat_id in core.dead_chats:
+        await asyncio.to_thread(core.dead_chats.handle_result, chat_id)
+    return result
+
+
+async def safe_send(chat_id: int, content_type: str, content, caption: str = "", **kwargs):
+    """
+    Асинхронный аналог main.safe_send с экспоненциальной задержкой и учетом retry_after.
+    Ошибки, которые повтор не исправит (бот заблокирован, чат удален), не повторяются.
+    """
+    content_config = core.CONTENT_TYPES.get(content_type)
+    if not content_config:
+        log.error("❌ Неизвестный тип контента: %s", content_type)
+        return SendFailure(BAD_REQUEST)
+
+    result = None
+    for attempt in range(core.HTTP_RETRIES):
+        result = await send_once(chat_id, content_type, content, caption, **kwargs)
+        if not isinstance(result, SendFailure):
+            log.debug("✅ %s отправлено в чат %s", content_config.name, chat_id)
+            return result
+        if not is_retryable(result.error):
+            log.warning("🚫 Отправка в чат %s отклонена (%s): %s", chat_id, result.kind, result.error)
+            return result
+        log.error("❌ Ошибка отправки в чат %s, попытка %s/%s: %s",
+                  chat_id, attempt + 1, core.HTTP_RETRIES, result.error)
+        if attempt < core.HTTP_RETRIES - 1:
+            retry_after = get_retry_after(result.error)
+            await asyncio.sleep(retry_after if retry_after is not None
+                                else core.HTTP_BACKOFF_FACTOR * 2 ** attempt)
+    return result
+
+
+async def validate_business_connection(business_connection_id: str) -> int:
+    """Асинхронный аналог main.validate_business_connection."""
+    if not business_connection_id:
+        log.warning("⚠️ Сообщение без бизнес-соединения")
+        return None
+
+    owner_id = core.owner_cache.get(business_connection_id)
+    if owner_id:
+        return owner_id
+    if core.owner_cache.is_failed(business_connection_id):
+        return None
+
+    # Одновременные сообщения одного соединения ждут один и тот же запрос
+    lookup = owner_lookups.get(business_connection_id)
+    if lookup is None:
+        lookup = owner_lookups[business_connection_id] = asyncio.ensure_future(
+            fetch_business_connection_owner(business_connection_id))
+        lookup.add_done_callback(lambda _: owner_lookups.pop(business_connection_id, None))
+    return await asyncio.shield(lookup)
+
+
+async def fetch_business_connection_owner(business_connection_id: str) -> int:
+    try:
+        business_connection_info = await abot.get_business_connection(business_connection_id)
+    except Exception as e:
+        log.error("❌ Ошибка получения бизнес-соединения %s: %s", business_connection_id, e)
+        core.owner_cache.mark_failed(business_connection_id)
+        return None
+
+    await asyncio.to_thread(core.remember_business_connection, business_connection_info)
+    log.info("✅ Зарегистрирован владелец: %s для соединения %s", business_connection_info.user.id, business_connection_id)
+    return core.owner_cache.get(business_connection_id)
+
+
+async def edit_status(chat_id: int, message_id: int, text: str, reply_markup=None):
+    try:
+        await abot.edit_message_text(
+            chat_id=chat_id,
+            message_id=message_id,
+            text=text,
+            reply_markup=reply_markup,
+            parse_mode='HTML'
+        )
+    except Exception as e:
+        log.error("❌ Ошибка редактирования сообщения: %s", e)
+
+
+async def run_broadcast(job: BroadcastJob, broadcast_type: str, content: str, caption: str,
+                        status_chat_id: int, status_message_id: int):
+    """
+    Рассылка пулом корутин с общим лимитером и учетом retry_after.
+    Заблокировавшие бота и удаленные чаты помечаются недоступными и не повторяются.
+    """
+    limiter = TokenBucket(core.SEND_RATE)
+    chats = iter(job.chat_ids)
+
+    async def worker():
+        for chat_id in chats:
+            attempt = 0
+            while attempt < 3:
+                wait = limiter.try_acquire()
+                while wait:
+                    await asyncio.sleep(wait)
+                    wait = limiter.try_acquire()
+                result = await send_once(chat_id, broadcast_type, content, caption)
+                if not isinstance(result, SendFailure):
+                    job.record(True)
+                    break
+                if result.kind == FLOOD:
+                    # Flood control: приостанавливаем всю рассылку, попытка не засчитывается
+                    limiter.pause(get_retry_after(result.error) or 1)
+                    continue
+                if not is_retryable(result.error):
+                    log.warning("🚫 Рассылка в чат %s отклонена (%s): %s", chat_id, result.kind, result.error)
+                    job.record(False)
+                    break
+                attempt += 1
+                if attempt < 3:
+                    await asyncio.sleep(2 ** (attempt - 1))
+            else:
+                job.record(False)
+
+    async def report_progress():
+        while True:
+            await asyncio.sleep(core.BROADCAST_PROGRESS_INTERVAL)
+            await edit_status(status_chat_id, status_message_id, core.broadcast_status_text(job))
+
+    reporter = asyncio.create_task(report_progress())
+    try:
+        await asyncio.gather(*(worker() for _ in range(min(ASYNC_BROADCAST_CONCURRENCY, job.total) or 1)))
+    finally:
+        reporter.cancel()
+
+    job.finish()
+    await edit_status(status_chat_id, status_message_id, core.broadcast_status_text(job, finished=True))
+
+
+# --- Хендлер для рассылки ---
+@abot.message_handler(func=lambda message: message.text == core.BROADCAST_COMMAND)
+async def handle_broadcast_command(message: telebot.types.Message):
+    if message.from_user.id not in core.ADMIN_IDS:
+        await abot.send_message(message.chat.id, "❌ У вас нет прав для использования этой команды.")
+        return
+
+    core.user_states[message.chat.id] = "broadcast_menu"
+    core.broadcast_data.pop(message.chat.id, None)
+    text, keyboard = core.broadcast_menu()
+    await safe_send(message.chat.id, 'text', text, reply_markup=keyboard)
+
+
+@abot.message_handler(commands=['stats'])
+async def handle_stats_command(message: telebot.types.Message):
+    if message.from_user.id not in core.ADMIN_IDS:
+        await abot.send_message(message.chat.id, "❌ У вас нет прав для использования этой команды.")
+        return
+
+    await safe_send(message.chat.id, 'text', core.stats_text(), reply_markup=core.stats_keyboard())
+
+
+@abot.message_handler(commands=['digest'])
+async def handle_digest_command(message: telebot.types.Message):
+    text, keyboard = await asyncio.to_thread(core.digest_menu, message.from_user.id)
+    await safe_send(message.chat.id, 'text', text, reply_markup=keyboard)
+
+
+@abot.callback_query_handler(func=lambda call: True)
+async def handle_callback(call):
+    chat_id = call.message.chat.id
+    message_id = call.message.message_id
+
+    if call.data == "stats_refresh":
+        if call.from_user.id not in core.ADMIN_IDS:
+            await abot.answer_callback_query(call.id, "❌ Недостаточно прав")
+            return
+        await edit_status(chat_id, message_id, core.stats_text(), reply_markup=core.stats_keyboard())
+        await abot.answer_callback_query(call.id)
+
+    elif call.data.startswith("digest:"):
+        answer = await asyncio.to_thread(core.set_digest_interval, call.from_user.id, call.data.split(":", 1)[1])
+        text, keyboard = await asyncio.to_thread(core.digest_menu, call.from_user.id)
+        await edit_status(chat_id, message_id, text, reply_markup=keyboard)
+        await abot.answer_callback_query(call.id, answer)
+
+    elif call.data == "segment_menu" or call.data.startswith("segment:"):
+        if call.from_user.id not in core.ADMIN_IDS:
+            await abot.answer_callback_query(call.id, "❌ Недостаточно прав")
+            return
+        if call.data == "segment_menu":
+            text, keyboard = core.segment_menu()
+        else:
+            segment = call.data.split(":", 1)[1]
+            if segment != core.SEGMENT_ALL and not core.audience.has_segment(segment):
+                await abot.answer_callback_query(call.id, "❌ Неизвестный сегмент")
+                return
+            core.broadcast_data.setdefault(chat_id, {})['segment'] = segment
+            text, keyboard = core.broadcast_menu(segment)
+        await edit_status(chat_id, message_id, text, reply_markup=keyboard)
+        await abot.answer_callback_query(call.id)
+
+    elif call.data.startswith("broadcast_"):
+        broadcast_type = call.data.replace("broadcast_", "")
+        core.user_states[chat_id] = f"waiting_broadcast_{broadcast_type}"
+        core.broadcast_data.setdefault(chat_id, {})['type'] = broadcast_type
+
+        instruction, keyboard = core.broadcast_instruction(broadcast_type)
+        await edit_status(chat_id, message_id, instruction, reply_markup=keyboard)
+
+    elif call.data == "cancel_broadcast":
+        core.user_states.pop(chat_id, None)
+        core.broadcast_data.pop(chat_id, None)
+        await edit_status(chat_id, message_id, "❌ Рассылка отменена.")
+
+    elif call.data == "confirm_broadcast":
+        data = core.broadcast_data.get(chat_id, {})
+        content = data.get('content')
+        if not content:
+            await abot.answer_callback_query(call.id, "❌ Контент для рассылки не найден")
+            return
+
+        job = broadcast_state['job']
+        if job is not None and not job.done.is_set():
+            await abot.answer_callback_query(call.id, "⏳ Предыдущая рассылка еще не завершена")
+            return
+
+        await edit_status(chat_id, message_id, "🔄 <b>Запуск рассылки...</b>\n\nПожалуйста, подождите.")
+
+        core.user_states.pop(chat_id, None)
+        core.broadcast_data.pop(chat_id, None)
+
+        segment = data.get('segment', core.SEGMENT_ALL)
+        job = BroadcastJob(await asyncio.to_thread(core.broadcast_audience, segment))
+        broadcast_state['job'] = job
+        log.info("🔄 Начало рассылки. Тип: %s, сегмент: %s", data.get('type'), segment)
+        asyncio.create_task(run_broadcast(
+            job, data.get('type'), content, data.get('caption', ""), chat_id, message_id
+        ))
+
+
+@abot.message_handler(content_types=core.BROADCAST_CONTENT_TYPES,
+                      func=lambda msg: core.user_states.get(msg.chat.id, "").startswith("waiting_broadcast_"))
+async def handle_broadcast_content(message: telebot.types.Message):
+    preview = core.store_broadcast_content(message.chat.id, message)
+    if not preview:
+        return
+
+    text, keyboard = preview
+    await safe_send(message.chat.id, 'text', text, reply_markup=keyboard)
+
+
+# --- Хендлеры для «Business Mode» ---
+@abot.business_connection_handler()
+async def handle_business_connection(connection: telebot.types.BusinessConnection):
+    log.info("🔌 Получено бизнес-соединение: %s", connection.id)
+    if await asyncio.to_thread(core.remember_business_connection, connection):
+        log.info("✅ Владелец %s добавлен в активные чаты", connection.user.id)
+
+
+@abot.business_message_handler(content_types=BUSINESS_CONTENT_TYPES)
+async def handle_business_message(message: telebot.types.Message):
+    owner_id = await validate_business_connection(message.business_connection_id)
+    if not owner_id:
+        return
+
+    # Запись в базу блокирует, пока очередь записи заполнена, — не в цикле событий
+    await asyncio.to_thread(core.audience.touch, owner_id)
+    await asyncio.to_thread(core.log_business_message, message)
+
+
+@abot.edited_business_message_handler(content_types=BUSINESS_CONTENT_TYPES)
+async def handle_edited_business_message(message: telebot.types.Message):
+    owner_id = await validate_business_connection(message.business_connection_id)
+    if not owner_id:
+        return
+
+    # Чтение оригинала и запись правки обращаются к базе — не в цикле событий
+    event = await asyncio.to_thread(core.record_edit, message, owner_id)
+    if not event:
+        return
+
+    interval = await asyncio.to_thread(core.digest_settings.get, owner_id)
+    if interval:
+        # Дайджест общий с синхронной версией и отправляется через ее outbox
+        core.digest_buffer.add(owner_id, message.chat.id, ('edit', *event), interval)
+        return
+
+    await safe_send(owner_id, 'text', core.format_edit_notification(*event),
+                    reply_markup=core.chat_keyboard(message.chat.id))
+
+
+@abot.deleted_business_messages_handler()
+async def handle_deleted_business_messages(deleted: telebot.types.BusinessMessagesDeleted):
+    owner_id = await validate_business_connection(deleted.business_connection_id)
+    if not owner_id:
+        return
+
+    chat_id = deleted.chat.id
+    if chat_id == owner_id:
+        return
+
+    items = await asyncio.to_thread(core.pop_deleted_messages, chat_id, owner_id, deleted.message_ids)
+    interval = await asyncio.to_thread(core.digest_settings.get, owner_id)
+    if interval:
+        for item in items:
+            core.digest_buffer.add(owner_id, chat_id, ('delete', *item), interval)
+        return
+
+    keyboard = core.chat_keyboard(chat_id)
+    bot_username = core.bot_identity.username
+
+    for msg_id, data, sender_info in items:
+        try:
+            for content_type, content, caption in core.deleted_message_payload(
+                    msg_id, data, sender_info, bot_username):
+                if content_type == 'sticker':
+                    await abot.send_sticker(owner_id, content)
+                else:
+                    await safe_send(owner_id, content_type, content, caption=caption, reply_markup=keyboard)
+        except Exception as e:
+            await safe_send(owner_id, 'text', core.restore_error_text(data.type if data else 'text', e),
+                            reply_markup=keyboard)
+
+
+# --- Обычные команды ---
+@abot.message_handler(commands=['start', 'help'])
+async def handle_start_help(message: telebot.types.Message):
+    await asyncio.to_thread(core.register_start, message.chat.id)
+
+    await safe_send(message.chat.id, 'text', core.START_TEXT, reply_markup=core.start_keyboard())
+
+    try:
+        # Кэш file_id общий с синхронной версией: файл загружается один раз,
+        # отправка выполняется в отдельном потоке, чтобы не блокировать цикл событий
+        await asyncio.to_thread(core.asset_cache.send, message.chat.id, core.INSTRUCTION_PHOTO,
+                                'photo', "Инструкция по подключению")
+    except FileNotFoundError:
+        log.error("❌ Файл с инструкцией не найден")
+    except Exception as e:
+        log.error("❌ Ошибка при отправке фото: %s", e)
+
+
+async def main():
+    bot_info = await abot.get_me()
+    core.bot_identity.set(bot_info)
+    log.info("✅ Бот авторизован: @%s", bot_info.username)
+
+    try:
+        await abot.infinity_polling(timeout=60, allowed_updates=core.ALLOWED_UPDATES)
+    finally:
+        await abot.close_session()
+
+
+if __name__ == "__main__":
+    log.info("🚀 Асинхронный бот запущен и ждёт сообщений...")
+    asyncio.run(main())
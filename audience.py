@@ -0,0 +1,200 @@
+"""
+Сегменты аудитории для рассылок.
+
+Каждый сегмент — заранее построенное множество chat_id, которое обновляется
+в обработчиках по мере событий (подключение бизнес-аккаунта, /start,
+активность), поэтому размер сегмента известен за O(1), а рассылка идет только
+по его участникам. Сегменты «активные за N дней» хранят чаты в порядке
+последней активности и вытесняют устаревшие с начала.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+SEGMENT_ALL = "all"
+SEGMENT_OWNERS = "owners"
+SEGMENT_CONNECTED = "connected"
+SEGMENT_STARTED = "started"
+CONNECTION_PREFIX = "connection:"
+
+
+def active_segment(days: int) -> str:
+    return f"active_{days}d"
+
+
+class _Recency:
+    """Чаты, активные за последние window секунд, в порядке последней активности."""
+
+    __slots__ = ('window', 'chats')
+
+    def __init__(self, window: float):
+        self.window = window
+        self.chats = OrderedDict()
+
+    def touch(self, chat_id: int, seen_at: float):
+        self.chats[chat_id] = seen_at
+        self.chats.move_to_end(chat_id)
+
+    def expire(self, now: float):
+        deadline = now - self.window
+        chats = self.chats
+        while chats:
+            chat_id, seen_at = next(iter(chats.items()))
+            if seen_at > deadline:
+                break
+            del chats[chat_id]
+
+
+class AudienceIndex:
+    """
+    Индекс сегментов (кроме all — это само множество active_chats в main).
+    Сегменты сохраняются в backend в той же таблице, что и active_chats.
+    persist_interval — как часто (сек) сохранять время последней активности чата.
+    """
+
+    def __init__(self, backend, active_days=(7, 30), persist_interval: float = 3600):
+        self.backend = backend
+        self.persist_interval = persist_interval
+        self._owners = set()
+        self._started = set()
+        # Подключенные бизнес-соединения: соединение -> владелец и число соединений владельца
+        self._connections = {}
+        self._connected = {}
+        self._last_seen = {}
+        self._saved_seen = {}
+        # Владельцы, у которых флаг уже сохранен в backend
+        self._saved_owners = set()
+        self._recent = {active_segment(days): _Recency(days * 24 * 3600) for days in active_days}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Дочитывает сегменты из backend (только добавляет, ничего не удаляет)."""
+        rows = sorted(self.backend.load_audience(), key=lambda row: row[3] or 0)
+        owners = self.backend.load_owners()
+        with self._lock:
+            for chat_id, is_owner, started, last_seen in rows:
+                if is_owner:
+                    self._owners.add(chat_id)
+                    self._saved_owners.add(chat_id)
+                if started:
+                    self._started.add(chat_id)
+                if last_seen and last_seen > self._last_seen.get(chat_id, 0):
+                    self._last_seen[chat_id] = self._saved_seen[chat_id] = last_seen
+                    for recency in self._recent.values():
+                        recency.touch(chat_id, last_seen)
+            for connection_id, owner_id in owners.items():
+                self._connect(connection_id, owner_id)
+
+    def _save(self, chat_id: int):
+        self.backend.save_audience(
+            chat_id, chat_id in self._owners, chat_id in self._started, self._last_seen.get(chat_id)
+        )
+
+    def _connect(self, connection_id: str, owner_id: int):
+        if connection_id in self._connections:
+            return
+        self._connections[connection_id] = owner_id
+        self._connected[owner_id] = self._connected.get(owner_id, 0) + 1
+        self._owners.add(owner_id)
+
+    # --- События ---
+
+    def mark_owner(self, chat_id: int, connection_id: str):
+        """Владелец подключил бизнес-аккаунт."""
+        with self._lock:
+            self._connect(connection_id, chat_id)
+            if chat_id not in self._saved_owners:
+                self._saved_owners.add(chat_id)
+                self._save(chat_id)
+
+    def disconnect(self, connection_id: str):
+        """Соединение отключено; владелец остается в сегменте owners."""
+        with self._lock:
+            owner_id = self._connections.pop(connection_id, None)
+            if owner_id is None:
+                return
+            left = self._connected[owner_id] - 1
+            if left:
+                self._connected[owner_id] = left
+            else:
+                del self._connected[owner_id]
+
+    def mark_started(self, chat_id: int):
+        """Пользователь отправил /start."""
+        with self._lock:
+            if chat_id in self._started:
+                return
+            self._started.add(chat_id)
+            self._save(chat_id)
+
+    def touch(self, chat_id: int, now: float = None):
+        """Отмечает активность чата."""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._last_seen[chat_id] = now
+            for recency in self._recent.values():
+                recency.touch(chat_id, now)
+            # Время активности сохраняется не чаще раза в persist_interval
+            if now - self._saved_seen.get(chat_id, 0) >= self.persist_interval:
+                self._saved_seen[chat_id] = now
+                self._save(chat_id)
+
+    # --- Запросы ---
+
+    def _members(self, segment: str):
+        if segment == SEGMENT_OWNERS:
+            return self._owners
+        if segment == SEGMENT_CONNECTED:
+            return self._connected
+        if segment == SEGMENT_STARTED:
+            return self._started
+        if segment.startswith(CONNECTION_PREFIX):
+            owner_id = self._connections.get(segment[len(CONNECTION_PREFIX):])
+            return () if owner_id is None else (owner_id,)
+        recency = self._recent.get(segment)
+        if recency is None:
+            raise KeyError(segment)
+        recency.expire(time.time())
+        return recency.chats
+
+    def has_segment(self, segment: str) -> bool:
+        """True, если сегмент с таким именем существует (кроме all)."""
+        return segment in (SEGMENT_OWNERS, SEGMENT_CONNECTED, SEGMENT_STARTED) \
+            or segment in self._recent or segment.startswith(CONNECTION_PREFIX)
+
+    def size(self, segment: str) -> int:
+        with self._lock:
+            return len(self._members(segment))
+
+    def members(self, segment: str) -> set:
+        with self._lock:
+            members = self._members(segment)
+            recency = self._recent.get(segment)
+            if recency is None:
+                return set(members)
+            # Дочитанные из backend чаты могут стоять не по порядку времени
+            deadline = time.time() - recency.window
+            return {chat_id for chat_id, seen_at in members.items() if seen_at > deadline}
+
+    def segments(self) -> list:
+        """[(сегмент, размер), ...] для меню рассылки."""
+        names = [SEGMENT_OWNERS, SEGMENT_CONNECTED, SEGMENT_STARTED, *self._recent]
+        with self._lock:
+            return [(name, len(self._members(name))) for name in names]
+
+
+def segment_title(segment: str) -> str:
+    titles = {
+        SEGMENT_ALL: "Все пользователи",
+        SEGMENT_OWNERS: "Владельцы бизнес-ботов",
+        SEGMENT_CONNECTED: "С активным подключением",
+        SEGMENT_STARTED: "Нажимали /start",
+    }
+    if segment in titles:
+        return titles[segment]
+    if segment.startswith(CONNECTION_PREFIX):
+        return f"Соединение {segment[len(CONNECTION_PREFIX):]}"
+    if segment.startswith("active_") and segment.endswith("d"):
+        return f"Активные за {segment[len('active_'):-1]} дн."
+    return segment
@@ -0,0 +1,90 @@
+"""
+Контроль нагрузки при всплесках обновлений.
+
+Очереди (обработчики, исходящие сообщения, запись в базу) ограничены по
+размеру, а LoadShedder по их заполненности выбирает уровень деградации:
+сначала придерживается рассылка, затем медиа в уведомлениях об удалении
+заменяются текстом. Когда исходящая очередь заполнена целиком, новые
+отправки отклоняются с Overloaded, а не копятся в памяти.
+"""
+import threading
+import time
+
+NORMAL = 0
+SHED_BROADCAST = 1
+DEGRADE_MEDIA = 2
+OVERLOADED = 3
+LEVEL_NAMES = ("normal", "shed_broadcast", "degrade_media", "overloaded")
+
+
+class Overloaded(Exception):
+    """Задача отклонена: очередь заполнена."""
+
+
+class LoadShedder:
+    """
+    Уровень нагрузки по самой заполненной из наблюдаемых очередей.
+    broadcast_at и degrade_media_at — доли заполнения, с которых включаются
+    соответствующие политики; 1.0 и выше — перегрузка.
+    """
+
+    def __init__(self, broadcast_at: float = 0.5, degrade_media_at: float = 0.8):
+        self.broadcast_at = broadcast_at
+        self.degrade_media_at = degrade_media_at
+        self._probes = {}
+        self._shed = {}
+        self._lock = threading.Lock()
+
+    def watch(self, name: str, depth, limit: int):
+        """Наблюдает очередь: depth() — текущий размер, limit — граница (0 — не ограничена)."""
+        if limit:
+            self._probes[name] = (depth, limit)
+
+    def saturation(self) -> dict:
+        """{очередь: доля заполнения}."""
+        return {name: depth() / limit for name, (depth, limit) in self._probes.items()}
+
+    def level(self) -> int:
+        pressure = max(self.saturation().values(), default=0.0)
+        if pressure >= 1.0:
+            return OVERLOADED
+        if pressure >= self.degrade_media_at:
+            return DEGRADE_MEDIA
+        if pressure >= self.broadcast_at:
+            return SHED_BROADCAST
+        return NORMAL
+
+    def shed_broadcast(self) -> bool:
+        return self.level() >= SHED_BROADCAST
+
+    def degrade_media(self) -> bool:
+        return self.level() >= DEGRADE_MEDIA
+
+    def record(self, policy: str, amount: int = 1):
+        """Учитывает сработавшую политику (для метрик и /healthz)."""
+        with self._lock:
+            self._shed[policy] = self._shed.get(policy, 0) + amount
+
+    def shed_counts(self) -> dict:
+        with self._lock:
+            return dict(self._shed)
+
+    def wait_for_broadcast(self, job=None, poll: float = 0.5):
+        """
+        Придерживает поток рассылки, пока включена политика сброса рассылки.
+        Если рассылку job ставят на паузу или отменяют, ожидание прерывается.
+        """
+        if not self.shed_broadcast():
+            return
+        self.record("broadcast_deferred")
+        while self.shed_broadcast() and (job is None or job.active):
+            time.sleep(poll)
+
+    def health(self) -> dict:
+        level = self.level()
+        return {
+            'status': "ok" if level == NORMAL else ("overloaded" if level == OVERLOADED else "degraded"),
+            'level': LEVEL_NAMES[level],
+            'saturation': {name: round(value, 3) for name, value in self.saturation().items()},
+            'shed': self.shed_counts(),
+        }
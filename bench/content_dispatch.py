@@ -0,0 +1,131 @@
+"""
+Микробенчмарк диспетчеризации по типу контента.
+
+Сравнивает прежнюю схему (словарь конфигурации с лямбдами, getattr на каждую
+отправку и проверки «тип в списке») с реестром content_types на тех же
+операциях, что выполняются для каждого обновления: извлечение данных из
+сообщения и вызов метода отправки. Сеть не участвует — клиент-заглушка
+сразу возвращает результат.
+
+    python bench/content_dispatch.py --iterations 100000 --repeat 7
+"""
+import argparse
+import os
+import sys
+import timeit
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from content_types import ContentRegistry, DEFAULT_CONTENT_TYPES  # noqa: E402
+
+# Прежняя конфигурация (фрагмент), как она выглядела в main.py
+LEGACY_CONFIG = {
+    'text': {
+        'get_content': lambda msg: msg.text,
+        'send_method': 'send_message',
+        'has_caption': False
+    },
+    'photo': {
+        'get_content': lambda msg: msg.photo[-1].file_id,
+        'get_file': lambda msg: msg.photo[-1],
+        'send_method': 'send_photo',
+        'has_caption': True
+    },
+    'voice': {
+        'get_content': lambda msg: msg.voice.file_id,
+        'get_file': lambda msg: msg.voice,
+        'send_method': 'send_voice',
+        'has_caption': False
+    },
+}
+
+
+def legacy_extract(message) -> dict:
+    config = LEGACY_CONFIG.get(message.content_type)
+    if not config:
+        return None
+    data = {
+        "type": message.content_type,
+        "chat_id": message.chat.id,
+        "business_connection_id": message.business_connection_id,
+        "content": config['get_content'](message)
+    }
+    if config['has_caption'] and message.caption:
+        data["caption"] = message.caption
+    if 'get_file' in config:
+        media = config['get_file'](message)
+        data["file_unique_id"] = media.file_unique_id
+        data["file_size"] = media.file_size
+    return data
+
+
+def legacy_send(client, chat_id, content_type, content, caption="", **kwargs):
+    config = LEGACY_CONFIG[content_type]
+    send_method = getattr(client, config['send_method'])
+    if content_type in ['text', 'location', 'contact']:
+        return send_method(chat_id, content, **kwargs)
+    elif config['has_caption']:
+        return send_method(chat_id, content, caption=caption, **kwargs)
+    else:
+        return send_method(chat_id, content, **kwargs)
+
+
+def registry_extract(registry: ContentRegistry, message) -> dict:
+    # То же, что main.extract_message_data
+    content_config = registry.get(message.content_type)
+    if not content_config:
+        return None
+    return content_config.extract_data(message)
+
+
+class StubClient:
+    """Клиент с методами отправки, которые ничего не делают."""
+
+    def _send(self, chat_id, content, **kwargs):
+        return chat_id
+
+    send_message = send_photo = send_voice = send_video = send_document = _send
+    send_animation = send_audio = send_sticker = send_video_note = _send
+
+
+def sample_messages() -> list:
+    chat = SimpleNamespace(id=42)
+    file = SimpleNamespace(file_id="AgACAgIAAxkBAAIB", file_unique_id="AQAD", file_size=1024)
+    return [
+        SimpleNamespace(content_type='text', chat=chat, business_connection_id="c", text="hello", caption=None),
+        SimpleNamespace(content_type='photo', chat=chat, business_connection_id="c", photo=[file, file],
+                        caption="caption"),
+        SimpleNamespace(content_type='voice', chat=chat, business_connection_id="c", voice=file, caption=None),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    client = StubClient()
+    registry = ContentRegistry(client, DEFAULT_CONTENT_TYPES)
+    messages = sample_messages()
+    sends = [(m.content_type, "content", "caption") for m in messages]
+
+    cases = {
+        "extract (словарь)": lambda: [legacy_extract(m) for m in messages],
+        "extract (реестр)": lambda: [registry_extract(registry, m) for m in messages],
+        "send (словарь)": lambda: [legacy_send(client, 1, t, c, cap) for t, c, cap in sends],
+        "send (реестр)": lambda: [registry.send(1, t, c, cap) for t, c, cap in sends],
+    }
+    # Варианты чередуются, чтобы фоновая нагрузка влияла на них одинаково
+    best = dict.fromkeys(cases, float("inf"))
+    for _ in range(args.repeat):
+        for name, case in cases.items():
+            best[name] = min(best[name], timeit.timeit(case, number=args.iterations))
+    per_call = len(messages) * args.iterations
+    for name, seconds in best.items():
+        print(f"{name:<20} {seconds / per_call * 1e9:7.1f} нс на сообщение")
+
+
+if __name__ == "__main__":
+    main()
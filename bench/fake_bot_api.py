@@ -0,0 +1,142 @@
+"""
+Локальная заглушка Telegram Bot API для бенчмарков.
+
+Отвечает успешным ответом на любой метод, считает вызовы по методам и может
+добавлять искусственную задержку ответа. Сеть не нужна.
+"""
+import itertools
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+OWNER_USER = {"id": 100, "is_bot": False, "first_name": "Owner"}
+
+
+class FakeBotAPI:
+    """HTTP-сервер, имитирующий api.telegram.org."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._message_ids = itertools.count(1)
+
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                api._handle(self)
+
+            def do_POST(self):
+                api._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def api_url(self) -> str:
+        """Шаблон для telebot.apihelper.API_URL."""
+        return self.url + "/bot{0}/{1}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-bot-api", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def total_calls(self) -> int:
+        with self._lock:
+            return sum(self.calls.values())
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+
+    def _handle(self, request: BaseHTTPRequestHandler):
+        parsed = urlparse(request.path)
+        method = parsed.path.rsplit("/", 1)[-1]
+        params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        params.update(self._read_body(request))
+
+        with self._lock:
+            self.calls[method] += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        body = json.dumps({"ok": True, "result": self._result(method, params)}).encode()
+        request.send_response(200)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    @staticmethod
+    def _read_body(request: BaseHTTPRequestHandler) -> dict:
+        length = int(request.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        raw = request.rfile.read(length)
+        content_type = request.headers.get("Content-Type", "")
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            return {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+        if content_type.startswith("application/json"):
+            return json.loads(raw)
+        if content_type.startswith("multipart/form-data"):
+            # Содержимое файлов не важно, нужен только chat_id
+            boundary = content_type.partition("boundary=")[2].strip('"').encode()
+            for part in raw.split(b"--" + boundary):
+                if b'name="chat_id"' in part:
+                    return {"chat_id": part.split(b"\r\n\r\n", 1)[-1].strip().decode()}
+        return {}
+
+    def _message(self, params: dict) -> dict:
+        try:
+            chat_id = int(params.get("chat_id", 0))
+        except ValueError:
+            chat_id = 0
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": "Chat"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+
+    def _result(self, method: str, params: dict):
+        if method == "getMe":
+            return BOT_USER
+        if method == "getBusinessConnection":
+            return {
+                "id": params.get("business_connection_id", "bench"),
+                "user": OWNER_USER,
+                "user_chat_id": OWNER_USER["id"],
+                "date": int(time.time()),
+                "can_reply": True,
+                "is_enabled": True,
+            }
+        if method == "sendMediaGroup":
+            media = params.get("media", "[]")
+            count = len(json.loads(media)) if isinstance(media, str) else len(media)
+            return [self._message(params) for _ in range(count)]
+        if method.startswith("send") or method == "editMessageText":
+            return self._message(params)
+        return True
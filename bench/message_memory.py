@@ -0,0 +1,113 @@
+"""
+Бенчмарк памяти на одно залогированное сообщение.
+
+Сравнивает прежнее представление (объект StoredMessage со своими строками
+соединения и отправителя в OrderedDict) с упакованными записями MessageStore
+на одном и том же синтетическом потоке: короткие и длинные тексты на русском
+и английском, медиа с подписями, несколько десятков соединений и тысячи
+отправителей. Строки создаются заново для каждого сообщения, как при разборе
+JSON обновления. Объем считается через tracemalloc; отдельно показан объем
+самих записей без индекса хранилища.
+
+    python bench/message_memory.py --messages 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from message_codec import MessageCodec  # noqa: E402
+from message_store import MessageStore, StoredMessage  # noqa: E402
+
+PHRASES = (
+    "привет", "как дела?", "сегодня вечером", "созвонимся завтра", "спасибо большое",
+    "хорошо, договорились", "можно уточнить", "когда будет готово?", "отправлю документы",
+    "я уже на месте", "ok", "thanks!", "see you tomorrow", "please check the invoice",
+    "what time works for you?", "sounds good", "давай в 7", "не забудь", "👍", "😂",
+)
+
+
+def synthetic_records(messages: int, connections: int, senders: int, seed: int = 1):
+    """Поток (chat_id, message_id, StoredMessage), похожий на реальные бизнес-чаты."""
+    rnd = random.Random(seed)
+    now = time.time()
+    for message_id in range(1, messages + 1):
+        sender = rnd.randrange(senders)
+        chat_id = 100_000_000 + sender
+        # Новые объекты строк, как после json.loads каждого обновления
+        connection = "".join(("BQAAAG", str(sender % connections).zfill(6), "AAAxyz"))
+        sender_info = "".join(("Пользователь ", str(sender), " (@user", str(sender), ")"))
+        if rnd.random() < 0.8:
+            words = [rnd.choice(PHRASES) for _ in range(rnd.choice((1, 1, 2, 3, 5, 12)))]
+            record = StoredMessage('text', " ".join(words), "", connection, sender_info, chat_id,
+                                   stored_at=now)
+        else:
+            caption = rnd.choice(("", "", "фото с вечера", "see attached, please sign"))
+            record = StoredMessage('photo', "AgACAgIAAxkBAAI" + "%040x" % rnd.getrandbits(160), caption,
+                                   connection, sender_info, chat_id, stored_at=now,
+                                   file_unique_id="AQAD" + "%012x" % rnd.getrandbits(48))
+        yield chat_id, message_id, record
+
+
+def measure(fill) -> int:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    keep = fill()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del keep
+    return after - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--connections", type=int, default=50)
+    parser.add_argument("--senders", type=int, default=5_000)
+    parser.add_argument("--threshold", type=int, default=48, help="порог сжатия текста, байт")
+    args = parser.parse_args()
+
+    def records():
+        return synthetic_records(args.messages, args.connections, args.senders)
+
+    def legacy():
+        # Прежняя схема: запись-объект в двух OrderedDict (LRU и по соединению)
+        items, by_connection = OrderedDict(), {}
+        for chat_id, message_id, record in records():
+            items[(chat_id, message_id)] = record
+            by_connection.setdefault(record.business_connection_id, OrderedDict())[(chat_id, message_id)] = None
+        return items, by_connection
+
+    def packed_records():
+        codec = MessageCodec(compress_threshold=args.threshold)
+        return codec, [codec.encode(record) for _, _, record in records()]
+
+    def legacy_records():
+        return [record for _, _, record in records()]
+
+    def store():
+        message_store = MessageStore(max_messages=args.messages, max_per_connection=args.messages, ttl=0,
+                                     codec=MessageCodec(compress_threshold=args.threshold))
+        for chat_id, message_id, record in records():
+            message_store.put(chat_id, message_id, record)
+        return message_store
+
+    results = {
+        "записи (объекты)": measure(legacy_records),
+        "записи (упакованные)": measure(packed_records),
+        "хранилище (прежнее)": measure(legacy),
+        "хранилище (MessageStore)": measure(store),
+    }
+    for name, grown in results.items():
+        print(f"{name:<26} {grown / args.messages:8.1f} байт на сообщение")
+    print(f"сокращение записей:   {results['записи (объекты)'] / results['записи (упакованные)']:.1f}x")
+    print(f"сокращение хранилища: {results['хранилище (прежнее)'] / results['хранилище (MessageStore)']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
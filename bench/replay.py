@@ -0,0 +1,260 @@
+"""
+Бенчмарк обработчиков бизнес-сообщений на синтетическом или записанном потоке.
+
+Запускает локальную заглушку Bot API, направляет в нее бота из main.py и
+прогоняет через handle_business_message, handle_edited_business_message,
+handle_deleted_business_messages и broadcast_message поток обновлений.
+Отчет: обновлений в секунду, p50/p99 задержки обработчиков, исходящих
+вызовов API на обновление и рост памяти на 100k залогированных сообщений.
+
+    python bench/replay.py --messages 50000 --edits 5000 --deletes 5000
+    python bench/replay.py --updates recorded_updates.jsonl
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Бот должен импортироваться с тестовым токеном и без сохранения на диск
+os.environ.setdefault("TELEGRAM_TOKEN", "123456:BENCH")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("METRICS_PORT", "0")
+os.environ.setdefault("BROADCAST_STATE_PATH", "")
+
+import telebot  # noqa: E402
+
+from fake_bot_api import FakeBotAPI  # noqa: E402
+from message_store import MessageStore  # noqa: E402
+
+
+@contextlib.contextmanager
+def quiet():
+    """
+    Глушит логи обработчиков ниже ERROR, чтобы не смешивать их с отчетом
+    и не измерять стоимость их вывода.
+    """
+    logging.disable(logging.WARNING)
+    try:
+        yield
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def synthetic_updates(messages: int, edits: int, deletes: int, connections: int, chats: int,
+                      delete_batch: int, seed: int = 1):
+    """Генерирует поток обновлений в формате Bot API (словари Update)."""
+    rnd = random.Random(seed)
+    update_id = 0
+    sent = []
+
+    def chat(chat_id: int) -> dict:
+        return {"id": chat_id, "type": "private", "first_name": f"User{chat_id}"}
+
+    for i in range(messages):
+        chat_id = 1000 + rnd.randrange(chats)
+        message = {
+            "message_id": i + 1,
+            "date": int(time.time()),
+            "chat": chat(chat_id),
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"User{chat_id}"},
+            "business_connection_id": f"conn{chat_id % connections}",
+            "text": f"message {i} " + "x" * rnd.randrange(10, 200),
+        }
+        update_id += 1
+        sent.append(message)
+        yield {"update_id": update_id, "business_message": message}
+
+    for message in rnd.sample(sent, min(edits, len(sent))):
+        edited = dict(message, text=message["text"] + " (edited)", edit_date=int(time.time()))
+        update_id += 1
+        yield {"update_id": update_id, "edited_business_message": edited}
+
+    by_chat = defaultdict(list)
+    for message in sent:
+        by_chat[message["chat"]["id"]].append(message)
+
+    remaining = deletes
+    for chat_id, chat_messages in by_chat.items():
+        while chat_messages and remaining > 0:
+            batch = chat_messages[:min(delete_batch, remaining)]
+            del chat_messages[:len(batch)]
+            remaining -= len(batch)
+            update_id += 1
+            yield {"update_id": update_id, "deleted_business_messages": {
+                "business_connection_id": batch[0]["business_connection_id"],
+                "chat": chat(chat_id),
+                "message_ids": [m["message_id"] for m in batch],
+            }}
+        if remaining <= 0:
+            break
+
+
+def recorded_updates(path: str):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def wait_for_outbox(core, timeout: float = 120.0):
+    """Ждет, пока все отложенные уведомления будут отправлены."""
+    time.sleep(core.DELETE_COALESCE_WINDOW + 0.2)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        metrics = core.outbox.metrics()
+        if not metrics['queue_depth'] and not metrics['in_flight']:
+            return
+        time.sleep(0.05)
+
+
+def run_replay(core, updates) -> dict:
+    handlers = {
+        "business_message": (telebot.types.Message, core.handle_business_message),
+        "edited_business_message": (telebot.types.Message, core.handle_edited_business_message),
+        "deleted_business_messages": (telebot.types.BusinessMessagesDeleted,
+                                      core.handle_deleted_business_messages),
+    }
+    latencies = defaultdict(list)
+    count = 0
+
+    started = time.perf_counter()
+    for update in updates:
+        for kind, (cls, handler) in handlers.items():
+            payload = update.get(kind)
+            if payload is None:
+                continue
+            obj = cls.de_json(payload)
+            t0 = time.perf_counter()
+            handler(obj)
+            latencies[kind].append(time.perf_counter() - t0)
+            count += 1
+    handled = time.perf_counter() - started
+    wait_for_outbox(core)
+    drained = time.perf_counter() - started
+
+    return {"updates": count, "handled": handled, "drained": drained, "latencies": latencies}
+
+
+def run_memory(core, messages: int) -> float:
+    """
+    Рост памяти (байт) на 100k залогированных сообщений. Хранилище собирается
+    как в main.py (тот же кодек и TTL), только лимиты подняты, чтобы замер
+    не искажало вытеснение.
+    """
+    core.message_store = MessageStore(
+        max_messages=max(messages, core.MESSAGE_STORE_MAX),
+        max_per_connection=max(messages, core.MESSAGE_STORE_MAX_PER_CONNECTION),
+        ttl=core.MESSAGE_STORE_TTL,
+        backend=core.storage,
+        codec=core.message_store.codec
+    )
+    stream = [telebot.types.Message.de_json(u["business_message"])
+              for u in synthetic_updates(messages, 0, 0, 10, 1000, 1)]
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for message in stream:
+        core.handle_business_message(message)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    grown = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return grown * 100_000 / messages
+
+
+def run_broadcast(core, chats: int) -> dict:
+    for chat_id in range(10_000, 10_000 + chats):
+        core.active_chats.add(chat_id)
+    started = time.perf_counter()
+    job = core.broadcast_message('text', "bench broadcast")
+    job.done.wait()
+    elapsed = time.perf_counter() - started
+    return {"chats": job.total, "success": job.success_count, "seconds": elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", help="JSONL-файл с записанными обновлениями (по одному Update в строке)")
+    parser.add_argument("--messages", type=int, default=20_000)
+    parser.add_argument("--edits", type=int, default=2_000)
+    parser.add_argument("--deletes", type=int, default=2_000)
+    parser.add_argument("--delete-batch", type=int, default=20)
+    parser.add_argument("--connections", type=int, default=50)
+    parser.add_argument("--chats", type=int, default=2_000)
+    parser.add_argument("--broadcast-chats", type=int, default=2_000)
+    parser.add_argument("--memory-messages", type=int, default=100_000)
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа заглушки, сек")
+    parser.add_argument("--send-rate", type=float, default=1e9,
+                        help="глобальный лимит отправок (по умолчанию не ограничен)")
+    args = parser.parse_args()
+
+    api = FakeBotAPI(latency=args.api_latency).start()
+    telebot.apihelper.API_URL = api.api_url
+
+    import main as core
+    from ratelimit import TokenBucket
+
+    # Лимиты Telegram в бенчмарке не нужны: измеряем стоимость самого кода
+    core.outbox.limiter = TokenBucket(args.send_rate)
+    core.outbox.chat_interval = 0
+    core.bot_identity.refresh()
+    api.reset()
+
+    if args.updates:
+        updates = list(recorded_updates(args.updates))
+    else:
+        updates = list(synthetic_updates(args.messages, args.edits, args.deletes,
+                                         args.connections, args.chats, args.delete_batch))
+    with quiet():
+        replay = run_replay(core, updates)
+    outbound = api.total_calls()
+
+    print("=== Replay ===")
+    print(f"Обновлений:              {replay['updates']}")
+    print(f"Обработка, обн/с:        {replay['updates'] / replay['handled']:.0f}")
+    print(f"С учетом отправки, обн/с: {replay['updates'] / replay['drained']:.0f}")
+    for kind, values in replay["latencies"].items():
+        print(f"{kind:<28} n={len(values):<7} p50={percentile(values, 0.5) * 1e6:8.1f} мкс"
+              f"  p99={percentile(values, 0.99) * 1e6:8.1f} мкс")
+    print(f"Исходящих вызовов API:   {outbound} ({outbound / max(replay['updates'], 1):.3f} на обновление)")
+    for method, calls in api.calls.most_common():
+        print(f"  {method:<24} {calls}")
+
+    if args.broadcast_chats:
+        api.reset()
+        with quiet():
+            result = run_broadcast(core, args.broadcast_chats)
+        print("=== Broadcast ===")
+        print(f"Чатов: {result['chats']}, успешно: {result['success']}, "
+              f"{result['chats'] / result['seconds']:.0f} сообщений/с, вызовов API: {api.total_calls()}")
+
+    if args.memory_messages:
+        with quiet():
+            per_100k = run_memory(core, args.memory_messages)
+        print("=== Memory ===")
+        print(f"Рост памяти на 100k сообщений: {per_100k / 1024 / 1024:.1f} МиБ")
+
+    api.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from ratelimit import TokenBucket, get_retry_after
+
+log = logging.getLogger(__name__)
+
+
+# Состояния рассылки
+RUNNING = "running"
+PAUSED = "paused"
+CANCELLED = "cancelled"
+FINISHED = "finished"
+
+
+class BroadcastJob:
+    """
+    Состояние одной рассылки: снимок получателей, курсор, счетчики и
+    неудачные чаты. Все чаты до cursor уже обработаны; обработанные после
+    курсора (потоки завершают отправки не по порядку) лежат в _ahead.
+    """
+
+    def __init__(self, chat_ids: list, job_id: str = None, payload: dict = None, status: tuple = None):
+        self.job_id = job_id or uuid.uuid4().hex[:12]
+        self.chat_ids = chat_ids
+        self.total = len(chat_ids)
+        # Что рассылается (тип, содержимое, подпись) и где показывать прогресс
+        self.payload = payload or {}
+        self.status = status
+        self.success_count = 0
+        self.fail_count = 0
+        self.failed = []
+        self.cursor = 0
+        self.state = RUNNING
+        self.started_at = time.time()
+        self.finished_at = None
+        self.done = threading.Event()
+        self._ahead = set()
+        self._next = 0
+        self._running = threading.Event()
+        self._running.set()
+        self._lock = threading.Lock()
+
+    @property
+    def processed(self) -> int:
+        return self.success_count + self.fail_count
+
+    @property
+    def active(self) -> bool:
+        """Рассылка выполняется: не на паузе и не отменена."""
+        return self.state == RUNNING
+
+    def next_chat(self) -> tuple:
+        """
+        Выдает следующий необработанный (index, chat_id). На паузе ждет;
+        после отмены или когда чаты закончились, возвращает None.
+        """
+        while True:
+            self._running.wait()
+            with self._lock:
+                if self.state == CANCELLED:
+                    return None
+                if self.state != RUNNING:
+                    continue
+                while self._next < self.total and self._next in self._ahead:
+                    self._next += 1
+                if self._next >= self.total:
+                    return None
+                index = self._next
+                self._next += 1
+                return index, self.chat_ids[index]
+
+    def record(self, ok: bool, chat_id: int = None, index: int = None):
+        with self._lock:
+            if ok:
+                self.success_count += 1
+            else:
+                self.fail_count += 1
+                if chat_id is not None:
+                    self.failed.append(chat_id)
+            if index is None:
+                return
+            self._ahead.add(index)
+            while self.cursor in self._ahead:
+                self._ahead.discard(self.cursor)
+                self.cursor += 1
+
+    def pause(self) -> bool:
+        with self._lock:
+            if self.state != RUNNING:
+                return False
+            self.state = PAUSED
+            self._running.clear()
+            return True
+
+    def resume(self) -> bool:
+        with self._lock:
+            if self.state != PAUSED:
+                return False
+            self.state = RUNNING
+            self._running.set()
+            return True
+
+    def cancel(self) -> bool:
+        with self._lock:
+            if self.state not in (RUNNING, PAUSED):
+                return False
+            self.state = CANCELLED
+            self._running.set()
+            return True
+
+    def finish(self):
+        with self._lock:
+            if self.state != CANCELLED:
+                self.state = FINISHED
+        self.finished_at = time.time()
+        self.done.set()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "job_id": self.job_id,
+                "payload": self.payload,
+                "status": self.status,
+                "state": self.state,
+                "cursor": self.cursor,
+                "ahead": sorted(self._ahead),
+                "success_count": self.success_count,
+                "fail_count": self.fail_count,
+                "failed": self.failed,
+                "started_at": self.started_at,
+            }
+
+    @classmethod
+    def from_dict(cls, data: dict, chat_ids: list) -> "BroadcastJob":
+        job = cls(chat_ids, data["job_id"], data["payload"],
+                  tuple(data["status"]) if data.get("status") else None)
+        job.cursor = job._next = data["cursor"]
+        job._ahead = set(data["ahead"])
+        job.success_count = data["success_count"]
+        job.fail_count = data["fail_count"]
+        job.failed = data["failed"]
+        job.started_at = data["started_at"]
+        if data["state"] == PAUSED:
+            job.pause()
+        elif data["state"] == CANCELLED:
+            job.cancel()
+        return job
+
+
+class BroadcastJournal:
+    """
+    Контрольные точки рассылок в JSON-файлах. Снимок получателей пишется один
+    раз при создании (<id>.chats.json), а прогресс (<id>.json) перезаписывается
+    атомарно через временный файл. После завершения оба файла удаляются.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id: str, suffix: str = "") -> str:
+        return os.path.join(self.directory, f"{job_id}{suffix}.json")
+
+    @staticmethod
+    def _write(path: str, data):
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    def create(self, job: BroadcastJob):
+        self._write(self._path(job.job_id, ".chats"), job.chat_ids)
+        self.save(job)
+
+    def save(self, job: BroadcastJob):
+        self._write(self._path(job.job_id), job.to_dict())
+
+    def remove(self, job_id: str):
+        for suffix in ("", ".chats"):
+            try:
+                os.remove(self._path(job_id, suffix))
+            except FileNotFoundError:
+                pass
+
+    def load_all(self) -> list:
+        """Незавершенные рассылки, от старых к новым."""
+        jobs = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json") or name.endswith(".chats.json"):
+                continue
+            job_id = name[:-len(".json")]
+            try:
+                with open(self._path(job_id), encoding="utf-8") as f:
+                    progress = json.load(f)
+                with open(self._path(job_id, ".chats"), encoding="utf-8") as f:
+                    chat_ids = json.load(f)
+                job = BroadcastJob.from_dict(progress, chat_ids)
+            except (OSError, ValueError, KeyError) as e:
+                log.error("❌ Не удалось прочитать контрольную точку рассылки %s: %s", name, e)
+                continue
+            # Отмену сохранили, но процесс остановился до удаления журнала
+            if job.state == CANCELLED:
+                log.info("🗑 Рассылка %s была отменена, контрольная точка удалена", job_id)
+                self.remove(job_id)
+                continue
+            jobs.append(job)
+        return sorted(jobs, key=lambda job: job.started_at)
+
+
+class BroadcastEngine:
+    """
+    Фоновая рассылка: пул потоков, общий лимитер скорости и учет retry_after.
+    Обработчики обновлений не ждут окончания рассылки.
+    Если limiter равен None, ограничение скорости и повторы остаются
+    на стороне send_one (например, когда отправка идет через Outbox).
+    throttle(job), если задан, вызывается перед выдачей каждого чата и может
+    придержать рассылку (например, пока сбрасывается нагрузка).
+    """
+
+    def __init__(self, limiter: TokenBucket, workers: int = 8, max_attempts: int = 3,
+                 progress_interval: float = 3.0, journal: BroadcastJournal = None,
+                 checkpoint_interval: float = 1.0, throttle=None):
+        self.limiter = limiter
+        self.throttle = throttle
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.progress_interval = progress_interval
+        # Без журнала рассылка не переживает перезапуск процесса
+        self.journal = journal
+        self.checkpoint_interval = checkpoint_interval
+        self._journal_lock = threading.Lock()
+        self.current = None
+
+    @property
+    def busy(self) -> bool:
+        return self.current is not None and not self.current.done.is_set()
+
+    def start(self, chat_ids, send_one, on_progress=None, on_done=None,
+              payload: dict = None, status: tuple = None, job: BroadcastJob = None) -> BroadcastJob:
+        """
+        Запускает рассылку в фоне. send_one(chat_id) должна отправлять сообщение
+        и выбрасывать исключение при ошибке. payload и status сохраняются в
+        контрольной точке, чтобы после перезапуска продолжить ту же рассылку.
+        Чтобы возобновить рассылку из журнала, передайте ее в job.
+        """
+        if job is None:
+            job = BroadcastJob(list(chat_ids), payload=payload, status=status)
+            if self.journal is not None:
+                self.journal.create(job)
+        self.current = job
+        threading.Thread(
+            target=self._run,
+            args=(job, send_one, on_progress, on_done),
+            name="broadcast",
+            daemon=True
+        ).start()
+        return job
+
+    def _run(self, job: BroadcastJob, send_one, on_progress, on_done):
+        workers_count = min(self.workers, job.total) or 1
+        remaining = [workers_count]
+        remaining_lock = threading.Lock()
+        all_done = threading.Event()
+
+        def worker():
+            try:
+                while True:
+                    if self.throttle is not None:
+                        self.throttle(job)
+                    item = job.next_chat()
+                    if item is None:
+                        return
+                    index, chat_id = item
+                    job.record(self._deliver(chat_id, send_one), chat_id, index)
+            finally:
+                with remaining_lock:
+                    remaining[0] -= 1
+                    if not remaining[0]:
+                        all_done.set()
+
+        for i in range(workers_count):
+            threading.Thread(target=worker, name=f"broadcast-{i}", daemon=True).start()
+
+        interval = self.checkpoint_interval if self.journal is not None else self.progress_interval
+        last_progress = time.monotonic()
+        reported = job.processed
+        while not all_done.wait(interval):
+            self.checkpoint(job)
+            # На паузе счетчики не меняются — не обновляем статус впустую
+            if on_progress and job.processed != reported and \
+                    time.monotonic() - last_progress >= self.progress_interval:
+                last_progress = time.monotonic()
+                reported = job.processed
+                self._notify(on_progress, job)
+
+        with self._journal_lock:
+            if self.journal is not None:
+                self.journal.remove(job.job_id)
+            job.finish()
+        if on_done:
+            self._notify(on_done, job)
+
+    def _deliver(self, chat_id: int, send_one) -> bool:
+        attempt = 0
+        while attempt < self.max_attempts:
+            if self.limiter is not None:
+                self.limiter.acquire()
+            try:
+                send_one(chat_id)
+                return True
+            except Exception as e:
+                retry_after = get_retry_after(e)
+                if retry_after is not None and self.limiter is not None:
+                    # Flood control: приостанавливаем всю рассылку, попытка не засчитывается
+                    log.warning("⏳ Flood control, пауза рассылки на %s сек.", retry_after)
+                    self.limiter.pause(retry_after)
+                    continue
+                attempt += 1
+                log.warning("❌ Ошибка рассылки в чат %s, попытка %s/%s: %s", chat_id, attempt, self.max_attempts, e)
+                if attempt < self.max_attempts:
+                    time.sleep(2 ** (attempt - 1))
+        return False
+
+    def checkpoint(self, job: BroadcastJob):
+        """Сохраняет контрольную точку рассылки (если журнал включен)."""
+        if self.journal is None:
+            return
+        try:
+            with self._journal_lock:
+                if not job.done.is_set():
+                    self.journal.save(job)
+        except OSError as e:
+            log.error("❌ Ошибка сохранения контрольной точки рассылки %s: %s", job.job_id, e)
+
+    @staticmethod
+    def _notify(callback, job: BroadcastJob):
+        try:
+            callback(job)
+        except Exception as e:
+            log.error("❌ Ошибка обработчика прогресса рассылки: %s", e)
@@ -0,0 +1,95 @@
+import logging
+import re
+import threading
+
+log = logging.getLogger(__name__)
+
+_TAG = re.compile(r"<(/?)([a-z]+)[^>]*>")
+
+
+class Coalescer:
+    """
+    Собирает элементы по ключу в течение короткого окна и отдает их
+    одной пачкой в callback(key, items). Окно отсчитывается от первого элемента.
+    """
+
+    def __init__(self, window: float, callback):
+        self.window = window
+        self.callback = callback
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, item):
+        with self._lock:
+            items = self._pending.get(key)
+            if items is None:
+                self._pending[key] = items = []
+                timer = threading.Timer(self.window, self.flush, args=(key,))
+                timer.daemon = True
+                timer.start()
+            items.append(item)
+
+    def flush(self, key):
+        with self._lock:
+            items = self._pending.pop(key, None)
+        if not items:
+            return
+        try:
+            self.callback(key, items)
+        except Exception as e:
+            log.exception("❌ Ошибка отправки пачки уведомлений для %s: %s", key, e)
+
+
+def truncate_html(text: str, limit: int) -> str:
+    """
+    Обрезает HTML-текст до limit символов, не разрезая теги и сущности (&amp;)
+    и закрывая оставшиеся открытыми теги.
+    """
+    if len(text) <= limit:
+        return text
+    cut = limit - 1
+    while cut > 0:
+        head = text[:cut]
+        # Не оставляем половину тега или сущности
+        if head.rfind("<") > head.rfind(">"):
+            head = head[:head.rfind("<")]
+        if head.rfind("&") > head.rfind(";"):
+            head = head[:head.rfind("&")]
+        opened = []
+        for match in _TAG.finditer(head):
+            if match.group(1):
+                if opened and opened[-1] == match.group(2):
+                    opened.pop()
+            else:
+                opened.append(match.group(2))
+        result = head + "…" + "".join(f"</{tag}>" for tag in reversed(opened))
+        if len(result) <= limit:
+            return result
+        cut -= len(result) - limit
+    return "…"
+
+
+def split_text(parts: list, limit: int, header: str = "") -> list:
+    """
+    Склеивает строки (HTML) в сообщения не длиннее limit символов.
+    Заголовок добавляется только к первому сообщению; слишком длинная строка
+    обрезается без разрыва разметки. Заголовок не отправляется отдельным
+    сообщением: первая строка при необходимости обрезается, чтобы уместиться
+    рядом с ним.
+    """
+    chunks = []
+    current = header
+    for part in parts:
+        if len(part) > limit:
+            part = truncate_html(part, limit)
+        candidate = f"{current}\n\n{part}" if current else part
+        if len(candidate) <= limit:
+            current = candidate
+        elif current == header:
+            current = f"{header}\n\n{truncate_html(part, limit - len(header) - 2)}"
+        else:
+            chunks.append(current)
+            current = part
+    if current:
+        chunks.append(current)
+    return chunks
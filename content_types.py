@@ -0,0 +1,178 @@
+"""
+Реестр поддерживаемых типов контента.
+
+Каждый тип описывается объектом ContentType, в котором заранее выбраны
+функции извлечения, отображения и отправки, поэтому на горячем пути нет
+поиска по словарям конфигурации и проверок вида «тип в списке».
+Реестр неизменяем; новый тип добавляется через ContentRegistry.extend().
+"""
+from operator import attrgetter
+from types import MappingProxyType
+
+
+class ContentType:
+    """Описание одного типа контента."""
+
+    __slots__ = (
+        'type',
+        'emoji',
+        'name',
+        'send_method',
+        'has_caption',
+        'is_text',
+        'extract',
+        'get_file',
+        'display_name',
+        'extract_data',
+    )
+
+    def __init__(self, type: str, emoji: str, name: str, send_method: str, extract,
+                 get_file=None, has_caption: bool = False, is_text: bool = False):
+        self.type = type
+        self.emoji = emoji
+        self.name = name
+        self.send_method = send_method
+        self.has_caption = has_caption
+        # Текстовые типы пересылаются и показываются как обычное сообщение
+        self.is_text = is_text
+        # extract(message) -> содержимое для хранения; get_file(message) -> объект файла
+        self.extract = extract
+        self.get_file = get_file
+        self.display_name = f"{emoji} {name}"
+        self.extract_data = _compile_extract(type, extract, get_file, has_caption)
+
+    def format(self, content, caption: str = "") -> str:
+        """Текст для отображения контента в уведомлениях."""
+        if self.is_text:
+            return content
+        if self.has_caption and caption:
+            return f"{self.display_name}\n\nПодпись: {caption}"
+        return self.display_name
+
+
+
+def _compile_extract(content_type: str, extract, get_file, has_caption: bool):
+    """
+    Собирает функцию message -> dict для типа: ветвления по подписи и файлу
+    выбираются один раз здесь, а не для каждого сообщения. Для медиа объект
+    файла достается один раз и дает и file_id, и file_unique_id.
+    """
+    if get_file is None:
+        def extract_data(message) -> dict:
+            return {
+                "type": content_type,
+                "chat_id": message.chat.id,
+                "business_connection_id": message.business_connection_id,
+                "content": extract(message)
+            }
+        return extract_data
+
+    def extract_data(message) -> dict:
+        media = get_file(message)
+        data = {
+            "type": content_type,
+            "chat_id": message.chat.id,
+            "business_connection_id": message.business_connection_id,
+            "content": media.file_id,
+            "file_unique_id": media.file_unique_id,
+            "file_size": media.file_size
+        }
+        if has_caption and message.caption:
+            data["caption"] = message.caption
+        return data
+    return extract_data
+
+
+class ContentRegistry:
+    """Неизменяемый набор типов контента с предвычисленными функциями отправки для бота."""
+
+    def __init__(self, client, content_types):
+        self.client = client
+        # Внутренние словари не изменяются после сборки; наружу отдается только
+        # MappingProxyType, а горячий путь обращается к dict напрямую
+        by_type = {ct.type: ct for ct in content_types}
+        self._types = MappingProxyType(by_type)
+        # Методы клиента связываются один раз, а не через getattr на каждую отправку
+        self._senders = {ct.type: (getattr(client, ct.send_method), ct.has_caption) for ct in by_type.values()}
+        self.get = by_type.get
+
+    def __getitem__(self, content_type: str) -> ContentType:
+        return self._types[content_type]
+
+    def __contains__(self, content_type: str) -> bool:
+        return content_type in self._types
+
+    def __iter__(self):
+        return iter(self._types)
+
+    def __len__(self) -> int:
+        return len(self._types)
+
+    def items(self):
+        return self._types.items()
+
+    def send(self, chat_id: int, content_type: str, content, caption: str = "", **kwargs):
+        """Отправка через бота, для которого собран реестр."""
+        send_method, has_caption = self._senders[content_type]
+        if has_caption:
+            return send_method(chat_id, content, caption=caption, **kwargs)
+        return send_method(chat_id, content, **kwargs)
+
+    def for_client(self, client) -> "ContentRegistry":
+        """Тот же набор типов с функциями отправки через другого клиента (например, AsyncTeleBot)."""
+        return ContentRegistry(client, self._types.values())
+
+    def extend(self, *content_types) -> "ContentRegistry":
+        """Новый реестр с добавленными (или замененными) типами."""
+        merged = dict(self._types)
+        merged.update((ct.type, ct) for ct in content_types)
+        return ContentRegistry(self.client, merged.values())
+
+
+def _photo(message):
+    # Самый крупный размер фото
+    return message.photo[-1]
+
+
+def _photo_file_id(message):
+    return message.photo[-1].file_id
+
+
+def _media_type(type: str, emoji: str, name: str, send_method: str,
+                has_caption: bool = False) -> ContentType:
+    # attrgetter выполняется на C и быстрее эквивалентной лямбды
+    return ContentType(type, emoji, name, send_method, attrgetter(f"{type}.file_id"),
+                       get_file=attrgetter(type), has_caption=has_caption)
+
+
+DEFAULT_CONTENT_TYPES = (
+    ContentType('text', '📝', 'Сообщение', 'send_message', attrgetter('text'), is_text=True),
+    ContentType('photo', '🖼️', 'Фото', 'send_photo', _photo_file_id, get_file=_photo, has_caption=True),
+    _media_type('video', '🎥', 'Видео', 'send_video', has_caption=True),
+    _media_type('document', '📄', 'Документ', 'send_document', has_caption=True),
+    _media_type('animation', '🎬', 'GIF/Анимация', 'send_animation', has_caption=True),
+    _media_type('voice', '🎤', 'Голосовое', 'send_voice'),
+    _media_type('audio', '🎵', 'Аудио', 'send_audio'),
+    _media_type('sticker', '🩷', 'Стикер', 'send_sticker'),
+    _media_type('video_note', '⏺️', 'Видеосообщение', 'send_video_note'),
+    ContentType(
+        'location', '📍', 'Локация', 'send_message',
+        lambda msg: f"[location] lat={msg.location.latitude}, lon={msg.location.longitude}",
+        is_text=True
+    ),
+    ContentType(
+        'contact', '👤', 'Контакт', 'send_message',
+        lambda msg: f"[contact] {msg.contact.first_name} {msg.contact.last_name or ''}, tel={msg.contact.phone_number}",
+        is_text=True
+    ),
+    ContentType(
+        'poll', '📊', 'Опрос', 'send_message',
+        lambda msg: f"[poll] {msg.poll.question}: " + " / ".join(option.text for option in msg.poll.options),
+        is_text=True
+    ),
+    ContentType(
+        'dice', '🎲', 'Кубик', 'send_message',
+        lambda msg: f"[dice] {msg.dice.emoji} = {msg.dice.value}",
+        is_text=True
+    ),
+)
@@ -0,0 +1,145 @@
+"""
+Классификация ошибок отправки и учет «мертвых» чатов.
+
+Чаты, которые заблокировали бота или удалены, помечаются и исключаются из
+рассылок. Раз в recheck_interval секунд такие чаты проверяются заново: если
+отправка снова проходит, чат возвращается в рассылку.
+"""
+import logging
+import threading
+import time
+
+from ratelimit import get_retry_after
+
+log = logging.getLogger(__name__)
+
+# Виды ошибок отправки
+FORBIDDEN = "forbidden"            # бот заблокирован, пользователь удален
+CHAT_NOT_FOUND = "chat_not_found"  # чата не существует или он недоступен боту
+FLOOD = "flood"                    # 429, нужно подождать retry_after
+BAD_REQUEST = "bad_request"        # ошибка в самом запросе, повтор не поможет
+TRANSIENT = "transient"            # сеть, 5xx — можно повторить
+
+# Ошибки, после которых чат считается мертвым
+DEAD_CHAT_ERRORS = (FORBIDDEN, CHAT_NOT_FOUND)
+
+_CHAT_NOT_FOUND_MARKERS = ("chat not found", "user not found", "peer_id_invalid", "bot was kicked")
+
+
+def classify_error(error: Exception) -> str:
+    """Определяет вид ошибки отправки по коду и описанию ответа Telegram."""
+    if isinstance(error, FileNotFoundError):
+        # Локальный файл для отправки отсутствует — повтор не поможет
+        return BAD_REQUEST
+    code = getattr(error, 'error_code', None)
+    if code == 429 or get_retry_after(error) is not None:
+        return FLOOD
+    if code == 403:
+        return FORBIDDEN
+    if code == 400:
+        description = (getattr(error, 'description', None) or str(error)).lower()
+        if any(marker in description for marker in _CHAT_NOT_FOUND_MARKERS):
+            return CHAT_NOT_FOUND
+        return BAD_REQUEST
+    return TRANSIENT
+
+
+def is_retryable(error: Exception) -> bool:
+    """Имеет ли смысл повторять отправку после такой ошибки."""
+    return classify_error(error) in (FLOOD, TRANSIENT)
+
+
+class SendFailure:
+    """
+    Результат неудачной отправки. Ложен в логическом контексте, поэтому
+    проверки вида `if not safe_send(...)` продолжают работать.
+    """
+
+    __slots__ = ('kind', 'error')
+
+    def __init__(self, kind: str, error: Exception = None):
+        self.kind = kind
+        self.error = error
+
+    def __bool__(self) -> bool:
+        return False
+
+    def __repr__(self) -> str:
+        return f"SendFailure({self.kind!r}, {self.error!r})"
+
+    @classmethod
+    def from_error(cls, error: Exception) -> "SendFailure":
+        return cls(classify_error(error), error)
+
+
+class DeadChats:
+    """
+    Чаты, отправка в которые завершилась ошибкой FORBIDDEN или CHAT_NOT_FOUND.
+    Хранит {chat_id: [reason, marked_at, checked_at]} и дублирует его в backend.
+    """
+
+    def __init__(self, backend, recheck_interval: float = 24 * 3600):
+        self.backend = backend
+        self.recheck_interval = recheck_interval
+        self._chats = backend.load_dead_chats()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    def __contains__(self, chat_id: int) -> bool:
+        return chat_id in self._chats
+
+    def reload(self):
+        """Перечитывает список из backend (его могли изменить другие процессы)."""
+        chats = self.backend.load_dead_chats()
+        with self._lock:
+            self._chats = chats
+
+    def snapshot(self) -> set:
+        with self._lock:
+            return set(self._chats)
+
+    def mark(self, chat_id: int, reason: str) -> bool:
+        """Помечает чат мертвым. Возвращает True, если раньше он считался живым."""
+        now = time.time()
+        with self._lock:
+            entry = self._chats.get(chat_id)
+            if entry is None:
+                entry = self._chats[chat_id] = [reason, now, now]
+                new = True
+            else:
+                entry[0] = reason
+                entry[2] = now
+                new = False
+        self.backend.save_dead_chat(chat_id, *entry)
+        if new:
+            log.info("🪦 Чат %s исключен из рассылки: %s", chat_id, reason)
+        return new
+
+    def revive(self, chat_id: int) -> bool:
+        """Возвращает чат в рассылку (например, после успешной отправки)."""
+        if chat_id not in self._chats:
+            return False
+        with self._lock:
+            removed = self._chats.pop(chat_id, None) is not None
+        if removed:
+            self.backend.delete_dead_chat(chat_id)
+            log.info("♻️ Чат %s снова доступен", chat_id)
+        return removed
+
+    def due_for_recheck(self) -> list:
+        """Чаты, которые давно не проверялись."""
+        deadline = time.time() - self.recheck_interval
+        with self._lock:
+            return [chat_id for chat_id, (_, _, checked_at) in self._chats.items() if checked_at <= deadline]
+
+    def handle_result(self, chat_id: int, error: Exception = None):
+        """Учитывает результат отправки в чат: ошибка помечает его, успех возвращает."""
+        if error is None:
+            if chat_id in self._chats:
+                self.revive(chat_id)
+            return
+        kind = classify_error(error)
+        if kind in DEAD_CHAT_ERRORS:
+            self.mark(chat_id, kind)
@@ -0,0 +1,181 @@
+"""
+Дайджест уведомлений для владельцев с большим потоком правок и удалений.
+
+Владелец выбирает режим доставки: мгновенно (каждое событие — отдельное
+сообщение) или дайджестом раз в N секунд. События дайджеста копятся по
+владельцу и собеседнику и отправляются одним сообщением на собеседника,
+когда истекает интервал или набирается max_events событий. Таймеры всех
+владельцев обслуживает одно колесо времени с одним потоком.
+"""
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+STATE_PREFIX = "digest:"
+INSTANT = 0
+
+
+class _Timer:
+    __slots__ = ('rounds', 'callback', 'args', 'cancelled')
+
+    def __init__(self, rounds: int, callback, args: tuple):
+        self.rounds = rounds
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimeWheel:
+    """
+    Колесо времени: slots корзин по tick секунд. Постановка и отмена таймера —
+    O(1), поток просыпается раз в tick и запускает только таймеры текущей
+    корзины, поэтому тысячи ожидающих дайджестов не создают тысячи потоков.
+    Точность срабатывания — до одного tick.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 512, name: str = "time-wheel"):
+        self.tick = tick
+        self._slots = [[] for _ in range(slots)]
+        self._cursor = 0
+        self._lock = threading.Lock()
+        threading.Thread(target=self._run, name=name, daemon=True).start()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(not timer.cancelled for slot in self._slots for timer in slot)
+
+    def schedule(self, delay: float, callback, *args) -> _Timer:
+        """Вызывает callback(*args) через delay секунд. Возвращает таймер с методом cancel()."""
+        ticks = max(1, int(-(-delay // self.tick)))
+        size = len(self._slots)
+        with self._lock:
+            timer = _Timer((ticks - 1) // size, callback, args)
+            self._slots[(self._cursor + ticks) % size].append(timer)
+        return timer
+
+    def _advance(self) -> list:
+        with self._lock:
+            self._cursor = (self._cursor + 1) % len(self._slots)
+            slot = self._slots[self._cursor]
+            due, waiting = [], []
+            for timer in slot:
+                if timer.cancelled:
+                    continue
+                if timer.rounds:
+                    timer.rounds -= 1
+                    waiting.append(timer)
+                else:
+                    due.append(timer)
+            self._slots[self._cursor] = waiting
+        return due
+
+    def _run(self):
+        next_tick = time.monotonic() + self.tick
+        while True:
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            next_tick += self.tick
+            for timer in self._advance():
+                try:
+                    timer.callback(*timer.args)
+                except Exception as e:
+                    log.exception("❌ Ошибка в таймере %s: %s", timer.callback, e)
+
+
+class DigestSettings:
+    """
+    Режим доставки владельца: интервал дайджеста в секундах (INSTANT — мгновенно).
+    Значения кэшируются; remember() обновляет кэш без записи в backend, когда
+    настройку уже сохранил другой процесс.
+    """
+
+    def __init__(self, backend, default: float = INSTANT):
+        self.backend = backend
+        self.default = default
+        self._intervals = {}
+        self._lock = threading.Lock()
+
+    def get(self, owner_id: int) -> float:
+        interval = self._intervals.get(owner_id)
+        if interval is None:
+            value = self.backend.load_state(STATE_PREFIX + str(owner_id))
+            interval = float(value) if value is not None else self.default
+            with self._lock:
+                self._intervals[owner_id] = interval
+        return interval
+
+    def remember(self, owner_id: int, interval: float):
+        with self._lock:
+            self._intervals[owner_id] = interval
+
+    def set(self, owner_id: int, interval: float):
+        self.remember(owner_id, interval)
+        self.backend.save_state(STATE_PREFIX + str(owner_id), str(interval))
+
+
+class _Pending:
+    __slots__ = ('chats', 'events', 'timer')
+
+    def __init__(self):
+        # chat_id -> события в порядке поступления
+        self.chats = {}
+        self.events = 0
+        self.timer = None
+
+
+class DigestBuffer:
+    """
+    Копит события по владельцу и отдает их в flush(owner_id, chats), где
+    chats — {chat_id: [событие, ...]}. Интервал отсчитывается от первого
+    события; при max_events событиях дайджест отправляется сразу.
+    """
+
+    def __init__(self, wheel: TimeWheel, flush, max_events: int = 50):
+        self.wheel = wheel
+        self._flush = flush
+        self.max_events = max_events
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.flushed = 0
+
+    def __len__(self) -> int:
+        """Число событий, ожидающих отправки."""
+        with self._lock:
+            return sum(pending.events for pending in self._pending.values())
+
+    def add(self, owner_id: int, chat_id: int, event, interval: float):
+        with self._lock:
+            pending = self._pending.get(owner_id)
+            if pending is None:
+                pending = self._pending[owner_id] = _Pending()
+                pending.timer = self.wheel.schedule(interval, self.flush, owner_id)
+            pending.chats.setdefault(chat_id, []).append(event)
+            pending.events += 1
+            full = pending.events >= self.max_events
+        if full:
+            self.flush(owner_id)
+
+    def flush(self, owner_id: int):
+        with self._lock:
+            pending = self._pending.pop(owner_id, None)
+        if pending is None:
+            return
+        pending.timer.cancel()
+        self.flushed += 1
+        try:
+            self._flush(owner_id, pending.chats)
+        except Exception as e:
+            log.exception("❌ Ошибка отправки дайджеста владельцу %s: %s", owner_id, e)
+
+    def flush_all(self):
+        """Отправляет все накопленные дайджесты (например, при остановке)."""
+        with self._lock:
+            owners = list(self._pending)
+        for owner_id in owners:
+            self.flush(owner_id)
@@ -0,0 +1,129 @@
+"""
+Параллельная обработка обновлений с сохранением порядка внутри чата.
+
+Обновления с одинаковым ключом (бизнес-соединение, чат) выполняются строго
+по очереди, а разные ключи — параллельно на пуле потоков. После каждой задачи
+ключ уходит в конец очереди готовности, поэтому массовое удаление в одном
+чате не задерживает уведомления других владельцев.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+
+def update_key(payload: dict):
+    """
+    Ключ упорядочивания обновления (словарь из Bot API) или None, если
+    порядок для него не важен.
+    """
+    for kind in ("business_message", "edited_business_message", "deleted_business_messages"):
+        body = payload.get(kind)
+        if body is not None:
+            return body.get("business_connection_id"), body["chat"]["id"]
+    message = payload.get("message")
+    if message is not None:
+        return None, message["chat"]["id"]
+    callback = payload.get("callback_query")
+    if callback is not None:
+        # Кнопки нажимаются в личном чате, его id совпадает с id пользователя
+        return None, callback["from"]["id"]
+    connection = payload.get("business_connection")
+    if connection is not None:
+        return connection["id"], None
+    return None
+
+
+class OrderedDispatcher:
+    """
+    Пул потоков, выполняющий задачи с одинаковым ключом по одной и в порядке поступления.
+    Если ожидает max_pending задач (0 — без ограничения), submit блокируется, пока
+    очередь не разгрузится: получение обновлений притормаживает, и они остаются
+    на стороне Telegram. Задачи, поставленные из самих обработчиков, не ждут.
+    """
+
+    def __init__(self, workers: int = 8, name: str = "dispatch", max_pending: int = 0):
+        self.max_pending = max_pending
+        # Ключ присутствует здесь, пока у него есть задачи (ожидающие или выполняемая)
+        self._queues = {}
+        self._ready = deque()
+        self._cond = threading.Condition()
+        # Ожидание освобождения очереди (submit при переполнении и drain) на той же блокировке
+        self._space = threading.Condition(self._cond)
+        self._local = threading.local()
+        self.pending = 0
+        self.throttled = 0
+        self.processed = 0
+        self.failed = 0
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"{name}-{i}", daemon=True).start()
+
+    def submit(self, key, func, *args):
+        """Ставит func(*args) в очередь ключа; key=None — без упорядочивания."""
+        if key is None:
+            key = object()
+        with self._cond:
+            if self.max_pending and self.pending >= self.max_pending and \
+                    not getattr(self._local, 'worker', False):
+                self.throttled += 1
+                while self.pending >= self.max_pending:
+                    self._space.wait()
+            tasks = self._queues.get(key)
+            if tasks is None:
+                tasks = self._queues[key] = deque()
+                self._ready.append(key)
+                self._cond.notify()
+            tasks.append((func, args))
+            self.pending += 1
+
+    def _worker(self):
+        self._local.worker = True
+        while True:
+            with self._cond:
+                while not self._ready:
+                    self._cond.wait()
+                key = self._ready.popleft()
+                # Задача остается в очереди до завершения: так submit видит, что ключ занят
+                func, args = self._queues[key][0]
+            try:
+                func(*args)
+                failed = False
+            except Exception as e:
+                failed = True
+                log.exception("❌ Ошибка обработки обновления: %s", e)
+            with self._cond:
+                tasks = self._queues[key]
+                tasks.popleft()
+                self.pending -= 1
+                self.processed += 1
+                self.failed += failed
+                if tasks:
+                    self._ready.append(key)
+                    self._cond.notify()
+                else:
+                    del self._queues[key]
+                if not self.pending or self.pending == self.max_pending - 1:
+                    self._space.notify_all()
+
+    def drain(self, timeout: float = None) -> bool:
+        """Ждет выполнения всех поставленных задач. Возвращает False по таймауту."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self.pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._space.wait(remaining)
+            return True
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'pending': self.pending,
+                'keys': len(self._queues),
+                'processed': self.processed,
+                'failed': self.failed,
+                'throttled': self.throttled,
+            }
@@ -0,0 +1,134 @@
+"""
+История правок сообщения.
+
+Исходная версия хранится целиком, а каждая правка — как дельта относительно
+исходной версии: список замен (начало, конец, новый текст). Дельты не зависят
+друг от друга, поэтому старые правки можно выбрасывать, а любую версию
+восстановить за одно применение дельты.
+"""
+import json
+import sys
+import time
+from difflib import SequenceMatcher
+
+
+def make_delta(base, new) -> tuple:
+    """Дельта, превращающая base в new: кортеж замен (i1, i2, текст)."""
+    if new == base:
+        return ()
+    if not isinstance(base, str) or not isinstance(new, str) or not base:
+        return ((0, len(base) if isinstance(base, str) else 0, new),)
+    matcher = SequenceMatcher(None, base, new, autojunk=False)
+    ops = tuple(
+        (i1, i2, new[j1:j2])
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != 'equal'
+    )
+    # Если дельта не короче самого текста, хранить ее нет смысла
+    if sum(len(text) + 8 for _, _, text in ops) >= len(new):
+        return ((0, len(base), new),)
+    return ops
+
+
+def apply_delta(base, delta: tuple):
+    if not delta:
+        return base
+    if not isinstance(base, str):
+        return delta[0][2]
+    parts = []
+    position = 0
+    for i1, i2, text in delta:
+        parts.append(base[position:i1])
+        parts.append(text)
+        position = i2
+    parts.append(base[position:])
+    return "".join(parts)
+
+
+class EditHistory:
+    """
+    Исходная версия сообщения и до max_versions последних правок.
+    Версия правки: (edited_at, type, дельта содержимого, дельта подписи).
+    """
+
+    __slots__ = ('type', 'content', 'caption', 'created_at', 'versions', 'dropped')
+
+    def __init__(self, type: str, content, caption: str = "", created_at: float = None,
+                 versions: list = None, dropped: int = 0):
+        self.type = type
+        self.content = content
+        self.caption = caption or ""
+        self.created_at = created_at if created_at is not None else time.time()
+        self.versions = versions if versions is not None else []
+        # Сколько промежуточных правок было выброшено из-за лимита
+        self.dropped = dropped
+
+    def __len__(self) -> int:
+        """Число сохраненных правок (без исходной версии)."""
+        return len(self.versions)
+
+    @property
+    def edits(self) -> int:
+        """Всего правок, включая выброшенные."""
+        return len(self.versions) + self.dropped
+
+    def with_edit(self, type: str, content, caption: str = "", max_versions: int = 10,
+                  edited_at: float = None) -> "EditHistory":
+        """
+        Новая история с добавленной правкой. Текущий объект не меняется, поэтому
+        размер уже сохраненной записи в хранилище остается прежним.
+        """
+        versions = self.versions + [(
+            edited_at if edited_at is not None else time.time(),
+            type,
+            make_delta(self.content, content),
+            make_delta(self.caption, caption or ""),
+        )]
+        dropped = self.dropped
+        if len(versions) > max_versions:
+            dropped += len(versions) - max_versions
+            versions = versions[len(versions) - max_versions:]
+        return EditHistory(self.type, self.content, self.caption, self.created_at, versions, dropped)
+
+    def revisions(self) -> list:
+        """Все сохраненные версии по порядку: [(time, type, content, caption), ...], первая — исходная."""
+        result = [(self.created_at, self.type, self.content, self.caption)]
+        for edited_at, type, content_delta, caption_delta in self.versions:
+            result.append((
+                edited_at,
+                type,
+                apply_delta(self.content, content_delta),
+                apply_delta(self.caption, caption_delta),
+            ))
+        return result
+
+    def size(self) -> int:
+        """Примерный объем памяти в байтах."""
+        total = sys.getsizeof(self) + sys.getsizeof(self.versions)
+        for value in (self.content, self.caption):
+            if value:
+                total += sys.getsizeof(value)
+        for version in self.versions:
+            total += sys.getsizeof(version)
+            for delta in version[2:]:
+                total += sys.getsizeof(delta) + sum(sys.getsizeof(op) + sys.getsizeof(op[2]) for op in delta)
+        return total
+
+    def to_json(self) -> str:
+        return json.dumps(
+            [self.type, self.content, self.caption, self.created_at, self.dropped, self.versions],
+            ensure_ascii=False, separators=(",", ":")
+        )
+
+    @classmethod
+    def from_json(cls, value: str):
+        if not value:
+            return None
+        type, content, caption, created_at, dropped, versions = json.loads(value)
+        versions = [
+            (edited_at, version_type,
+             tuple(tuple(op) for op in content_delta),
+             tuple(tuple(op) for op in caption_delta))
+            for edited_at, version_type, content_delta, caption_delta in versions
+        ]
+        return cls(type, content, caption, created_at, versions, dropped)
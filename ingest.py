@@ -0,0 +1,249 @@
+"""
+Прием обновлений: отсев повторов и восстановление порядка.
+
+UpdateFilter отбрасывает уже обработанные update_id (окно последних
+идентификаторов плюс сохраненный в хранилище offset), поэтому переподключение
+или перезапуск не приводят к повторной обработке, а long polling продолжается
+с места остановки. Опрос идет со следующего после последнего принятого
+update_id, чтобы одно медленное обновление не задерживало прием остальных, а
+в хранилище сохраняется только граница завершенных обработчиков (done()):
+все обновления до нее обработаны.
+
+ReorderBuffer придерживает правки и удаления сообщения, оригинал которого еще
+не сохранен: правка, пришедшая раньше business_message, иначе показала бы «?»
+вместо старого текста. Придержанные обновления передаются дальше после
+release() для этого сообщения или по истечении delay секунд.
+
+Обновления обрабатываются в виде словарей, как их присылает Telegram.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+OFFSET_KEY = "updates_offset"
+
+
+class UpdateFilter:
+    """
+    Окно последних window идентификаторов обновлений и сохраняемый offset.
+    floor=False отключает отсев по offset: вебхук доставляет обновления
+    параллельно, и меньший update_id может прийти позже большего.
+    Обновление, не завершенное за inflight_timeout секунд, считается
+    потерянным (например, упал воркер) и больше не задерживает сохраняемую
+    границу.
+    """
+
+    def __init__(self, backend, window: int = 10000, key: str = OFFSET_KEY, floor: bool = True,
+                 inflight_timeout: float = 300):
+        self.backend = backend
+        self.key = key
+        self.window = window
+        self.floor = floor
+        self.inflight_timeout = inflight_timeout
+        self.duplicates = 0
+        value = backend.load_state(key)
+        # Следующий ожидаемый update_id; все, что меньше, уже обработано
+        self._offset = int(value) if value else None
+        self._committed = self._offset
+        self._seen = set()
+        self._order = deque()
+        # update_id -> время приема для обновлений, обработка которых не завершена
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    @property
+    def offset(self) -> int:
+        """
+        Offset для getUpdates (следующий после последнего принятого update_id)
+        или None, если обновления еще не принимались. Незавершенные обновления
+        не запрашиваются заново: getUpdates отдает не больше 100 обновлений,
+        и одно придержанное обновление остановило бы прием во всех чатах.
+        """
+        with self._lock:
+            return self._offset
+
+    @property
+    def watermark(self) -> int:
+        """Граница для перезапуска: все обновления с меньшим update_id обработаны."""
+        with self._lock:
+            return self._watermark()
+
+    def _watermark(self) -> int:
+        if not self._inflight:
+            return self._offset
+        deadline = time.monotonic() - self.inflight_timeout
+        expired = [update_id for update_id, accepted_at in self._inflight.items() if accepted_at < deadline]
+        if expired:
+            log.warning("⚠️ Обновления не обработаны за %s сек и пропускаются: %s",
+                        self.inflight_timeout, sorted(expired))
+            for update_id in expired:
+                del self._inflight[update_id]
+        return min(self._inflight, default=self._offset)
+
+    def accept(self, payloads: list) -> list:
+        """Возвращает обновления, которые еще не обрабатывались, и запоминает их."""
+        fresh = []
+        with self._lock:
+            floor = self._committed
+            for payload in payloads:
+                update_id = payload.get("update_id")
+                if update_id is None:
+                    fresh.append(payload)
+                    continue
+                if update_id in self._seen or (self.floor and floor is not None and update_id < floor):
+                    self.duplicates += 1
+                    continue
+                self._seen.add(update_id)
+                self._order.append(update_id)
+                if len(self._order) > self.window:
+                    self._seen.discard(self._order.popleft())
+                if self._offset is None or update_id >= self._offset:
+                    self._offset = update_id + 1
+                self._inflight[update_id] = time.monotonic()
+                fresh.append(payload)
+        if len(fresh) < len(payloads):
+            log.debug("♻️ Пропущено повторных обновлений: %s", len(payloads) - len(fresh))
+        return fresh
+
+    def done(self, update_id: int):
+        """Отмечает, что обработка обновления завершена."""
+        with self._lock:
+            self._inflight.pop(update_id, None)
+
+    def commit(self):
+        """Сохраняет границу завершенных обработчиков (watermark)."""
+        with self._lock:
+            offset = self._watermark()
+            if offset is None or offset == self._committed:
+                return
+            self._committed = offset
+        self.backend.save_state(self.key, str(offset))
+
+
+def update_keys(payload: dict) -> tuple:
+    """Вид обновления и ключи (chat_id, message_id) сообщений, которых оно касается."""
+    for kind in ("business_message", "edited_business_message"):
+        message = payload.get(kind)
+        if message is not None:
+            return kind, ((message["chat"]["id"], message["message_id"]),)
+    deleted = payload.get("deleted_business_messages")
+    if deleted is not None:
+        chat_id = deleted["chat"]["id"]
+        return "deleted_business_messages", tuple((chat_id, message_id) for message_id in deleted["message_ids"])
+    return None, ()
+
+
+class _Held:
+    __slots__ = ('payload', 'waiting', 'deadline')
+
+    def __init__(self, payload: dict, waiting: set, deadline: float):
+        self.payload = payload
+        self.waiting = waiting
+        self.deadline = deadline
+
+
+class ReorderBuffer:
+    """
+    Короткий буфер переупорядочивания по ключу (chat_id, message_id).
+    process(payloads) — обработка обновлений; known(chat_id, message_id) — сохранен ли оригинал.
+    """
+
+    def __init__(self, process, known, delay: float = 2.0):
+        self.process = process
+        self.known = known
+        self.delay = delay
+        self.held_total = 0
+        self.expired = 0
+        # Оригиналы, переданные обработчикам, но еще не сохраненные: ключ -> срок ожидания
+        self._inflight = {}
+        # Придержанные обновления по ключу в порядке поступления
+        self._held = {}
+        self._lock = threading.Lock()
+        if delay > 0:
+            threading.Thread(target=self._expire_loop, name="reorder-buffer", daemon=True).start()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len({id(entry) for entries in self._held.values() for entry in entries})
+
+    def submit(self, payloads: list):
+        """Передает обновления обработчикам, придерживая те, что пришли раньше оригинала."""
+        if not payloads:
+            return
+        if self.delay <= 0:
+            self.process(payloads)
+            return
+        ready = []
+        now = time.monotonic()
+        with self._lock:
+            for payload in payloads:
+                kind, keys = update_keys(payload)
+                if kind == "business_message":
+                    self._inflight[keys[0]] = now + self.delay
+                    ready.append(payload)
+                    continue
+                waiting = {key for key in keys if self._must_wait(kind, key)}
+                if not waiting:
+                    ready.append(payload)
+                    continue
+                entry = _Held(payload, waiting, now + self.delay)
+                for key in waiting:
+                    self._held.setdefault(key, []).append(entry)
+                self.held_total += 1
+        if ready:
+            self.process(ready)
+
+    def _must_wait(self, kind: str, key: tuple) -> bool:
+        # Порядок по ключу сохраняется: если что-то уже ждет, ждут и следующие
+        if key in self._held or key in self._inflight:
+            return True
+        # Правка без оригинала: возможно, оригинал придет следом
+        return kind == "edited_business_message" and not self.known(*key)
+
+    def release(self, chat_id: int, message_id: int):
+        """Оригинал сообщения сохранен: передает дальше ожидавшие его обновления."""
+        key = (chat_id, message_id)
+        with self._lock:
+            self._inflight.pop(key, None)
+            ready = self._release_key(key)
+        if ready:
+            self.process(ready)
+
+    def _release_key(self, key: tuple) -> list:
+        ready = []
+        for entry in self._held.pop(key, ()):
+            entry.waiting.discard(key)
+            if not entry.waiting:
+                ready.append(entry.payload)
+        return ready
+
+    def flush(self, now: float = None) -> int:
+        """Передает дальше обновления, которые ждут дольше delay. Возвращает их число."""
+        now = time.monotonic() if now is None else now
+        ready = []
+        with self._lock:
+            for key in [key for key, deadline in self._inflight.items() if deadline <= now]:
+                del self._inflight[key]
+            expired = [
+                key for key, entries in self._held.items()
+                if entries[0].deadline <= now and key not in self._inflight
+            ]
+            # Оригинал не пришел: обновления по ключу передаются без него
+            for key in expired:
+                ready.extend(self._release_key(key))
+            self.expired += len(ready)
+        if ready:
+            log.debug("⏱️ Оригинал не получен, передано обновлений без него: %s", len(ready))
+            self.process(ready)
+        return len(ready)
+
+    def _expire_loop(self):
+        while True:
+            time.sleep(max(self.delay / 2, 0.05))
+            try:
+                self.flush()
+            except Exception as e:
+                log.exception("❌ Ошибка буфера переупорядочивания: %s", e)
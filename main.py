@@ -1,118 +1,315 @@
 import telebot
 from telebot import types
 import time
-import traceback
+import logging
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import os
+import atexit
+import threading
+from html import escape
+
+from message_store import MessageStore, StoredMessage
+from message_codec import MessageCodec
+from edit_history import EditHistory
+from storage import create_storage
+from owners import OwnerCache
+from media_archive import MediaArchive
+from assets import AssetCache
+from content_types import ContentRegistry, DEFAULT_CONTENT_TYPES
+from ratelimit import TokenBucket
+from ingest import UpdateFilter, ReorderBuffer
+from dispatch import OrderedDispatcher, update_key
+from audience import AudienceIndex, SEGMENT_ALL, segment_title
+from backpressure import LoadShedder
+from delivery import DeadChats, SendFailure, BAD_REQUEST, DEAD_CHAT_ERRORS
+from broadcast import BroadcastEngine, BroadcastJournal, PAUSED, CANCELLED
+from outbox import Outbox, PRIORITY_ALERT, PRIORITY_BROADCAST
+from coalesce import Coalescer, split_text, truncate_html
+from digest import TimeWheel, DigestSettings, DigestBuffer, INSTANT
+from stats import LiveStats, merge_snapshots
+from webhook_server import WebhookServer
+from metrics import GaugeCallback, MetricsServer, track_update
 
 # 1. Ваши токены и ID
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 
+# Логирование: уровень DEBUG включает подробный вывод по каждому сообщению
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(
+    level=LOG_LEVEL,
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+log = logging.getLogger(__name__)
+
+# Эндпоинт метрик Prometheus (порт 0 — отключен)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Параметры HTTP-клиента: общие для синхронного и асинхронного режимов
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+HTTP_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+HTTP_RETRY_STATUSES = (500, 502, 504)
+
 # Настраиваем сессию с повторными попытками и увеличенными таймаутами
 session = requests.Session()
 retry = Retry(
-    total=3,
-    read=3,
-    connect=3,
-    backoff_factor=0.5,
-    status_forcelist=(500, 502, 504)
+    total=HTTP_RETRIES,
+    read=HTTP_RETRIES,
+    connect=HTTP_RETRIES,
+    backoff_factor=HTTP_BACKOFF_FACTOR,
+    status_forcelist=HTTP_RETRY_STATUSES
 )
-adapter = HTTPAdapter(max_retries=retry, pool_connections=10, pool_maxsize=10)
+adapter = HTTPAdapter(max_retries=retry, pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
 session.mount('http://', adapter)
 session.mount('https://', adapter)
 
+# Передаем сессию telebot, иначе пул соединений и повторы не используются
+telebot.apihelper.session = session
+
+# Способ получения обновлений: "polling" или "webhook"
+RUN_MODE = os.getenv("RUN_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+# Потоки обработчиков: обновления одного чата выполняются по очереди, разных — параллельно
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "8"))
+# Ограничения очередей при всплесках обновлений (0 — без ограничения)
+DISPATCH_MAX_PENDING = int(os.getenv("DISPATCH_MAX_PENDING", "5000"))
+OUTBOX_MAX_DEPTH = int(os.getenv("OUTBOX_MAX_DEPTH", "10000"))
+STORAGE_MAX_QUEUE = int(os.getenv("STORAGE_MAX_QUEUE", "50000"))
+# Доля заполнения самой загруженной очереди, с которой рассылка придерживается,
+# а медиа в уведомлениях об удалении заменяются текстом
+SHED_BROADCAST_AT = float(os.getenv("SHED_BROADCAST_AT", "0.5"))
+DEGRADE_MEDIA_AT = float(os.getenv("DEGRADE_MEDIA_AT", "0.8"))
+
+ALLOWED_UPDATES = [
+    "message", 
+    "callback_query", 
+    "business_connection",
+    "business_message", 
+    "edited_business_message", 
+    "deleted_business_messages"
+]
+
+# Прием обновлений: сколько последних update_id помнить для отсева повторов и
+# сколько секунд придерживать правку или удаление, пока не сохранен оригинал (0 — не ждать)
+UPDATE_DEDUP_WINDOW = int(os.getenv("UPDATE_DEDUP_WINDOW", "10000"))
+UPDATE_REORDER_DELAY = float(os.getenv("UPDATE_REORDER_DELAY", "2"))
+
 # Создаем бота
-bot = telebot.TeleBot(TELEGRAM_TOKEN, parse_mode="HTML")
+# Обработчики запускает OrderedDispatcher, поэтому собственный пул telebot
+# отключен: process_new_updates выполняет обработчик в потоке диспетчера
+bot = telebot.TeleBot(TELEGRAM_TOKEN, parse_mode="HTML", threaded=False)
+
+class BotIdentity:
+    """Кэш данных бота из get_me(): запрашивается при запуске и при переподключении."""
+    
+    def __init__(self, bot: telebot.TeleBot):
+        self._bot = bot
+        self._me = None
+        self._lock = threading.Lock()
+    
+    def refresh(self) -> telebot.types.User:
+        """Заново запрашивает данные бота у API."""
+        me = self._bot.get_me()
+        with self._lock:
+            self._me = me
+        return me
+    
+    def set(self, me: telebot.types.User):
+        """Сохраняет уже полученные данные бота (например, из асинхронного клиента)."""
+        with self._lock:
+            self._me = me
+    
+    @property
+    def me(self) -> telebot.types.User:
+        with self._lock:
+            me = self._me
+        return me if me is not None else self.refresh()
+    
+    @property
+    def username(self) -> str:
+        return self.me.username
+
+bot_identity = BotIdentity(bot)
 
 # 2. Хранилища для логов сообщений
-messages_log = {}
-message_senders = {}
-business_connection_owners = {}
-active_chats = set()
+# Лимиты хранилища: всего сообщений, на одно бизнес-соединение и время жизни записи (сек)
+MESSAGE_STORE_MAX = int(os.getenv("MESSAGE_STORE_MAX", "200000"))
+MESSAGE_STORE_MAX_PER_CONNECTION = int(os.getenv("MESSAGE_STORE_MAX_PER_CONNECTION", "20000"))
+MESSAGE_STORE_TTL = int(os.getenv("MESSAGE_STORE_TTL", str(7 * 24 * 3600)))
+# Сколько последних правок хранить для каждого сообщения (исходная версия хранится всегда)
+EDIT_HISTORY_MAX = int(os.getenv("EDIT_HISTORY_MAX", "10"))
+# Тексты длиннее порога (в байтах UTF-8) хранятся в памяти сжатыми (0 — не сжимать)
+MESSAGE_COMPRESS_THRESHOLD = int(os.getenv("MESSAGE_COMPRESS_THRESHOLD", "48"))
+
+# Бэкенд для сохранения данных между перезапусками: "memory" или "sqlite"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "memory")
+STORAGE_PATH = os.getenv("STORAGE_PATH", "bot_data.sqlite3")
+
+storage = create_storage(STORAGE_BACKEND, STORAGE_PATH, retention=MESSAGE_STORE_TTL,
+                         max_queue=STORAGE_MAX_QUEUE)
+atexit.register(storage.close)
+
+message_store = MessageStore(
+    max_messages=MESSAGE_STORE_MAX,
+    max_per_connection=MESSAGE_STORE_MAX_PER_CONNECTION,
+    ttl=MESSAGE_STORE_TTL,
+    backend=storage,
+    codec=MessageCodec(compress_threshold=MESSAGE_COMPRESS_THRESHOLD)
+)
+# Владельцы соединений загружаются из хранилища; неудачные запросы к API
+# повторяются не чаще раза в OWNER_NEGATIVE_TTL секунд
+OWNER_NEGATIVE_TTL = float(os.getenv("OWNER_NEGATIVE_TTL", "300"))
+owner_cache = OwnerCache(storage, negative_ttl=OWNER_NEGATIVE_TTL)
+active_chats = storage.load_active_chats()
+# Обработчики работают в нескольких потоках: составные операции с active_chats под блокировкой
+active_chats_lock = threading.Lock()
 business_connections = {}
+# Счетчики для команды /stats обновляются в обработчиках
+live_stats = LiveStats()
+
+dispatcher = OrderedDispatcher(workers=DISPATCH_WORKERS, max_pending=DISPATCH_MAX_PENDING)
+
+def handle_update(payload: dict):
+    try:
+        bot.process_new_updates([telebot.types.Update.de_json(payload)])
+    finally:
+        update_id = payload.get("update_id")
+        if update_id is not None:
+            mark_update_done(update_id)
+
+def mark_update_done(update_id: int):
+    """Обработчик обновления завершился; воркеры шардов подменяют эту функцию."""
+    update_filter.done(update_id)
+
+def process_updates(payloads: list):
+    """Передает обновления (словари из API) обработчикам бота через пул диспетчера."""
+    for payload in payloads:
+        dispatcher.submit(update_key(payload), handle_update, payload)
+
+def is_message_stored(chat_id: int, message_id: int) -> bool:
+    return message_store.get(chat_id, message_id) is not None
+
+# Offset long polling хранится вместе с остальными данными и продвигается только
+# после завершения обработчиков, поэтому после перезапуска обновления не
+# обрабатываются повторно. Сам опрос не ждет медленных обработчиков. Вебхук доставляет обновления
+# параллельно, поэтому там повторы отсеиваются только окном.
+update_filter = UpdateFilter(storage, window=UPDATE_DEDUP_WINDOW, floor=RUN_MODE != "webhook")
+reorder_buffer = ReorderBuffer(process_updates, is_message_stored, delay=UPDATE_REORDER_DELAY)
+atexit.register(update_filter.commit)
+
+def ingest_updates(payloads: list) -> list:
+    """
+    Отсеивает повторы, восстанавливает порядок и передает обновления обработчикам.
+    Возвращает принятые (не повторные) обновления.
+    """
+    fresh = update_filter.accept(payloads)
+    reorder_buffer.submit(fresh)
+    update_filter.commit()
+    return fresh
+
+# Чаты, заблокировавшие бота или удаленные, исключаются из рассылок и
+# проверяются заново раз в DEAD_CHAT_RECHECK_INTERVAL секунд (0 — не проверять)
+DEAD_CHAT_RECHECK_INTERVAL = float(os.getenv("DEAD_CHAT_RECHECK_INTERVAL", str(24 * 3600)))
+dead_chats = DeadChats(storage, recheck_interval=DEAD_CHAT_RECHECK_INTERVAL)
+
+# Сегменты аудитории для рассылок; AUDIENCE_ACTIVE_DAYS — окна «активные за N дней»
+AUDIENCE_ACTIVE_DAYS = tuple(int(days) for days in os.getenv("AUDIENCE_ACTIVE_DAYS", "7,30").split(",") if days.strip())
+audience = AudienceIndex(storage, active_days=AUDIENCE_ACTIVE_DAYS)
 
 # Список администраторов для рассылки
 ADMIN_IDS = [1007477341]
+BROADCAST_COMMAND = "304041GHK"
 
 # Состояния для рассылки
 user_states = {}
 broadcast_data = {}
 
-# Конфигурация типов контента
-CONTENT_TYPE_CONFIG = {
-    'text': {
-        'emoji': '📝',
-        'name': 'Сообщение',
-        'get_content': lambda msg: msg.text,
-        'send_method': 'send_message',
-        'has_caption': False
-    },
-    'photo': {
-        'emoji': '🖼️',
-        'name': 'Фото',
-        'get_content': lambda msg: msg.photo[-1].file_id,
-        'send_method': 'send_photo',
-        'has_caption': True
-    },
-    'video': {
-        'emoji': '🎥',
-        'name': 'Видео',
-        'get_content': lambda msg: msg.video.file_id,
-        'send_method': 'send_video',
-        'has_caption': True
-    },
-    'document': {
-        'emoji': '📄',
-        'name': 'Документ',
-        'get_content': lambda msg: msg.document.file_id,
-        'send_method': 'send_document',
-        'has_caption': True
-    },
-    'animation': {
-        'emoji': '🎬',
-        'name': 'GIF/Анимация',
-        'get_content': lambda msg: msg.animation.file_id,
-        'send_method': 'send_animation',
-        'has_caption': True
-    },
-    'voice': {
-        'emoji': '🎤',
-        'name': 'Голосовое',
-        'get_content': lambda msg: msg.voice.file_id,
-        'send_method': 'send_voice',
-        'has_caption': False
-    },
-    'audio': {
-        'emoji': '🎵',
-        'name': 'Аудио',
-        'get_content': lambda msg: msg.audio.file_id,
-        'send_method': 'send_audio',
-        'has_caption': False
-    },
-    'sticker': {
-        'emoji': '🩷',
-        'name': 'Стикер',
-        'get_content': lambda msg: msg.sticker.file_id,
-        'send_method': 'send_sticker',
-        'has_caption': False
-    },
-    'location': {
-        'emoji': '📍',
-        'name': 'Локация',
-        'get_content': lambda msg: f"[location] lat={msg.location.latitude}, lon={msg.location.longitude}",
-        'send_method': 'send_message',
-        'has_caption': False
-    },
-    'contact': {
-        'emoji': '👤',
-        'name': 'Контакт',
-        'get_content': lambda msg: f"[contact] {msg.contact.first_name} {msg.contact.last_name or ''}, tel={msg.contact.phone_number}",
-        'send_method': 'send_message',
-        'has_caption': False
-    }
-}
+# Исходящие сообщения: общий лимит Telegram (~30 сообщений в секунду),
+# не чаще одного сообщения в секунду в один чат и число потоков отправки
+SEND_RATE = float(os.getenv("SEND_RATE", "30"))
+SEND_CHAT_INTERVAL = float(os.getenv("SEND_CHAT_INTERVAL", "1"))
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", "8"))
+
+outbox = Outbox(
+    TokenBucket(SEND_RATE),
+    chat_interval=SEND_CHAT_INTERVAL,
+    workers=SEND_WORKERS,
+    max_depth=OUTBOX_MAX_DEPTH
+)
+
+load_shedder = LoadShedder(broadcast_at=SHED_BROADCAST_AT, degrade_media_at=DEGRADE_MEDIA_AT)
+load_shedder.watch("dispatch", lambda: dispatcher.pending, DISPATCH_MAX_PENDING)
+load_shedder.watch("outbox", outbox.depth, OUTBOX_MAX_DEPTH)
+load_shedder.watch("storage", storage.pending, STORAGE_MAX_QUEUE if STORAGE_BACKEND == "sqlite" else 0)
+
+# Параметры рассылки: сколько сообщений рассылки одновременно стоит в очереди отправки
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "16"))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "3"))
+# Каталог контрольных точек рассылок (пустая строка — рассылки не переживают перезапуск)
+BROADCAST_STATE_PATH = os.getenv("BROADCAST_STATE_PATH", "broadcasts")
+
+# Скорость и повторы рассылки контролирует outbox; при нагрузке рассылка ждет
+# первой, освобождая очередь для уведомлений
+broadcast_engine = BroadcastEngine(
+    None,
+    workers=BROADCAST_WORKERS,
+    max_attempts=1,
+    progress_interval=BROADCAST_PROGRESS_INTERVAL,
+    journal=BroadcastJournal(BROADCAST_STATE_PATH) if BROADCAST_STATE_PATH else None,
+    throttle=load_shedder.wait_for_broadcast
+)
+
+# Объединение уведомлений об удалении: окно сбора (сек) и лимиты Telegram
+DELETE_COALESCE = os.getenv("DELETE_COALESCE", "1") == "1"
+DELETE_COALESCE_WINDOW = float(os.getenv("DELETE_COALESCE_WINDOW", "1.5"))
+MESSAGE_TEXT_LIMIT = 4096
+CAPTION_LIMIT = 1024
+MEDIA_GROUP_LIMIT = 10
+
+# Режим дайджеста: владелец выбирает интервал командой /digest (0 — мгновенно).
+# Дайджест отправляется по истечении интервала или при DIGEST_MAX_EVENTS событиях.
+DIGEST_DEFAULT_INTERVAL = float(os.getenv("DIGEST_DEFAULT_INTERVAL", "0"))
+DIGEST_INTERVALS = tuple(int(seconds) for seconds in os.getenv("DIGEST_INTERVALS", "300,900,3600").split(",")
+                         if seconds.strip())
+DIGEST_MAX_EVENTS = int(os.getenv("DIGEST_MAX_EVENTS", "50"))
+
+# Архив медиафайлов на диске на случай, если file_id удаленного сообщения устареет.
+# Bot API отдает боту файлы не больше 20 МБ.
+MEDIA_ARCHIVE = os.getenv("MEDIA_ARCHIVE", "0") == "1"
+MEDIA_ARCHIVE_PATH = os.getenv("MEDIA_ARCHIVE_PATH", "media_archive")
+MEDIA_ARCHIVE_QUOTA_MB = int(os.getenv("MEDIA_ARCHIVE_QUOTA_MB", "1024"))
+MEDIA_ARCHIVE_WORKERS = int(os.getenv("MEDIA_ARCHIVE_WORKERS", "2"))
+MEDIA_DOWNLOAD_LIMIT = 20 * 1024 * 1024
+MEDIA_CHUNK_SIZE = 64 * 1024
+
+def download_media(file_id: str):
+    """Скачивает файл по file_id потоком, отдавая его кусками."""
+    file_info = bot.get_file(file_id)
+    file_url = telebot.apihelper.FILE_URL or "https://api.telegram.org/file/bot{0}/{1}"
+    with session.get(file_url.format(TELEGRAM_TOKEN, file_info.file_path), stream=True, timeout=60) as response:
+        response.raise_for_status()
+        yield from response.iter_content(MEDIA_CHUNK_SIZE)
+
+media_archive = MediaArchive(
+    MEDIA_ARCHIVE_PATH,
+    download_media,
+    quota_bytes=MEDIA_ARCHIVE_QUOTA_MB * 1024 * 1024,
+    max_file_size=MEDIA_DOWNLOAD_LIMIT,
+    workers=MEDIA_ARCHIVE_WORKERS
+) if MEDIA_ARCHIVE else None
+
+# Реестр типов контента: извлечение, отображение и отправка для каждого типа
+CONTENT_TYPES = ContentRegistry(bot, DEFAULT_CONTENT_TYPES)
+BUSINESS_CONTENT_TYPES = list(CONTENT_TYPES)
+BROADCAST_CONTENT_TYPES = ['text', 'photo', 'video', 'document', 'animation']
 
 def get_chat_title(chat: telebot.types.Chat) -> str:
     """Возвращает удобочитаемое название чата."""
@@ -141,187 +338,649 @@ def get_user_info(user: telebot.types.User) -> str:
 
 def get_bot_owner_id(business_connection_id: str) -> int:
     """Определяет ID владельца бота для данного бизнес-соединения."""
-    return business_connection_owners.get(business_connection_id)
+    return owner_cache.get(business_connection_id)
 
-def safe_send(chat_id: int, content_type: str, content, caption: str = "", **kwargs):
+def register_owner(business_connection_id: str, owner_id: int):
+    """Запоминает владельца бизнес-соединения и сохраняет его в хранилище."""
+    owner_cache.register(business_connection_id, owner_id)
+
+def remember_business_connection(connection: telebot.types.BusinessConnection) -> bool:
     """
-    Универсальная функция для безопасной отправки любого типа контента.
+    Регистрирует бизнес-соединение. Возвращает True, если владелец добавлен в активные чаты.
+    Отключенное соединение (is_enabled=False) удаляется из кэша владельцев.
     """
-    max_retries = 3
-    config = CONTENT_TYPE_CONFIG.get(content_type)
-    
-    if not config:
-        print(f"❌ Неизвестный тип контента: {content_type}")
+    if connection.is_enabled is False:
+        owner_cache.evict(connection.id)
+        business_connections.pop(connection.id, None)
+        live_stats.forget_connection(connection.id)
+        audience.disconnect(connection.id)
         return False
+    register_owner(connection.id, connection.user.id)
+    audience.mark_owner(connection.user.id, connection.id)
+    business_connections[connection.id] = connection
+    # Владелец заново подключил бота — значит, он снова доступен
+    dead_chats.revive(connection.user.id)
+    return add_active_chat(connection.user.id)
+
+def fetch_business_connection_owner(business_connection_id: str) -> int:
+    """Запрашивает соединение у API и регистрирует его владельца."""
+    business_connection_info = bot.get_business_connection(business_connection_id)
+    remember_business_connection(business_connection_info)
+    log.info("✅ Зарегистрирован владелец: %s для соединения %s",
+             business_connection_info.user.id, business_connection_id)
+    return owner_cache.get(business_connection_id)
+
+def add_active_chat(chat_id: int) -> bool:
+    """Добавляет чат в список для рассылки. Возвращает True, если чат новый."""
+    with active_chats_lock:
+        if chat_id in active_chats:
+            return False
+        active_chats.add(chat_id)
+    storage.save_active_chat(chat_id)
+    return True
+
+def send_content(chat_id: int, content_type: str, content, caption: str = "", **kwargs):
+    """Отправляет контент одной попыткой, без повторов. Ошибки API пробрасываются."""
+    return CONTENT_TYPES.send(chat_id, content_type, content, caption, **kwargs)
+
+def queue_send(chat_id: int, content_type: str, content, caption: str = "",
+               priority: int = PRIORITY_ALERT, **kwargs):
+    """
+    Ставит отправку в очередь outbox и сразу возвращает Future.
+    Порядок сообщений в одном чате сохраняется.
+    """
+    content_config = CONTENT_TYPES.get(content_type)
+    
+    if not content_config:
+        log.error("❌ Неизвестный тип контента: %s", content_type)
+        return None
     
-    send_method = getattr(bot, config['send_method'])
+    def send():
+        result = send_content(chat_id, content_type, content, caption, **kwargs)
+        log.debug("✅ %s отправлено в чат %s", content_config.name, chat_id)
+        return result
     
-    for attempt in range(max_retries):
+    return outbox.submit(chat_id, track_delivery(chat_id, send), priority, method=content_config.send_method)
+
+def track_delivery(chat_id: int, send):
+    """
+    Оборачивает отправку в чат: ошибка FORBIDDEN или CHAT_NOT_FOUND помечает
+    чат недоступным, успешная отправка возвращает его в рассылку.
+    """
+    def tracked():
         try:
-            # Формируем аргументы для отправки
-            if content_type in ['text', 'location', 'contact']:
-                result = send_method(chat_id, content, **kwargs)
-            elif config['has_caption']:
-                result = send_method(chat_id, content, caption=caption, **kwargs)
-            else:
-                result = send_method(chat_id, content, **kwargs)
-            
-            print(f"✅ {config['name']} отправлено в чат {chat_id}")
-            return result
-            
-        except requests.exceptions.Timeout:
-            print(f"⏱️ Таймаут при отправке в чат {chat_id}, попытка {attempt + 1}/{max_retries}")
-            if attempt < max_retries - 1:
-                time.sleep(2 ** attempt)
-            else:
-                print(f"❌ Превышено количество попыток для чата {chat_id}")
-                return False
-                
+            result = send()
         except Exception as e:
-            print(f"❌ Ошибка отправки в чат {chat_id}: {e}")
-            if attempt < max_retries - 1:
-                time.sleep(2 ** attempt)
-            else:
-                return False
+            dead_chats.handle_result(chat_id, e)
+            raise
+        dead_chats.handle_result(chat_id)
+        return result
+    return tracked
+
+# Статические файлы загружаются в Telegram один раз и дальше отправляются по file_id
+asset_cache = AssetCache(
+    storage,
+    send_content,
+    lambda message: CONTENT_TYPES[message.content_type].extract(message)
+)
+
+def send_asset(chat_id: int, path: str, content_type: str = 'photo', caption: str = "",
+               priority: int = PRIORITY_ALERT):
+    """Ставит в outbox отправку локального файла через кэш file_id. Возвращает Future."""
+    send = lambda: asset_cache.send(chat_id, path, content_type, caption)
+    return outbox.submit(chat_id, track_delivery(chat_id, send), priority,
+                         method=CONTENT_TYPES[content_type].send_method)
+
+def safe_send(chat_id: int, content_type: str, content, caption: str = "", **kwargs):
+    """
+    Универсальная функция для безопасной отправки любого типа контента.
+    Отправляет через outbox и ждет результата. При ошибке возвращает SendFailure
+    (ложный объект с видом ошибки: forbidden, chat_not_found, flood, ...).
+    """
+    future = queue_send(chat_id, content_type, content, caption, **kwargs)
+    if future is None:
+        return SendFailure(BAD_REQUEST)
+    
+    try:
+        return future.result()
+    except Exception as e:
+        failure = SendFailure.from_error(e)
+        if failure.kind in DEAD_CHAT_ERRORS:
+            log.warning("🚫 Чат %s недоступен (%s): %s", chat_id, failure.kind, e)
+        else:
+            log.error("❌ Ошибка отправки в чат %s: %s", chat_id, e)
+        return failure
 
 def validate_business_connection(business_connection_id: str) -> int:
     """
     Проверяет и возвращает ID владельца бизнес-соединения.
-    Если соединение не найдено, пытается получить информацию из API.
+    Если соединение не найдено, один раз запрашивает его у API; одновременные
+    сообщения того же соединения ждут этот запрос.
     """
     if not business_connection_id:
-        print("⚠️ Сообщение без бизнес-соединения")
+        log.warning("⚠️ Сообщение без бизнес-соединения")
         return None
     
-    # Если уже есть в кэше
-    if business_connection_id in business_connection_owners:
-        return business_connection_owners[business_connection_id]
-    
-    # Пытаемся получить из API
     try:
-        business_connection_info = bot.get_business_connection(business_connection_id)
-        owner_id = business_connection_info.user.id
-        business_connection_owners[business_connection_id] = owner_id
-        business_connections[business_connection_id] = business_connection_info
-        
-        if owner_id not in active_chats:
-            active_chats.add(owner_id)
-        
-        print(f"✅ Зарегистрирован владелец: {owner_id} для соединения {business_connection_id}")
-        return owner_id
-        
+        return owner_cache.resolve(business_connection_id, fetch_business_connection_owner)
     except Exception as e:
-        print(f"❌ Ошибка получения бизнес-соединения {business_connection_id}: {e}")
+        log.error("❌ Ошибка получения бизнес-соединения %s: %s", business_connection_id, e)
         return None
 
 def extract_message_data(message: telebot.types.Message) -> dict:
     """
     Извлекает данные из сообщения в универсальном формате.
     """
-    content_type = message.content_type
-    config = CONTENT_TYPE_CONFIG.get(content_type)
+    content_config = CONTENT_TYPES.get(message.content_type)
     
-    if not config:
-        print(f"⚠️ Неизвестный тип сообщения: {content_type}")
+    if not content_config:
+        log.warning("⚠️ Неизвестный тип сообщения: %s", message.content_type)
         return None
     
-    data = {
-        "type": content_type,
-        "chat_id": message.chat.id,
-        "business_connection_id": message.business_connection_id,
-        "content": config['get_content'](message)
-    }
-    
-    # Добавляем caption если поддерживается
-    if config['has_caption'] and message.caption:
-        data["caption"] = message.caption
-    
-    return data
+    # Подпись добавляется для типов, которые ее поддерживают; для медиа
+    # дополнительно сохраняется постоянный идентификатор файла (ключ архива)
+    return content_config.extract_data(message)
 
 def format_content_display(content_type: str, content: str, caption: str = "") -> str:
     """
     Форматирует контент для отображения в уведомлениях.
     """
-    config = CONTENT_TYPE_CONFIG.get(content_type)
-    if not config:
+    content_config = CONTENT_TYPES.get(content_type)
+    if not content_config:
         return f"[{content_type}] {content}"
+    return content_config.format(content, caption)
+
+def broadcast_audience(segment: str = SEGMENT_ALL) -> list:
+    """Получатели рассылки: участники сегмента (по умолчанию все активные чаты) без недоступных."""
+    # При шардированном запуске чаты регистрируют и помечают процессы-воркеры,
+    # поэтому списки дочитываются из общего хранилища
+    dead_chats.reload()
+    dead = dead_chats.snapshot()
+    if segment != SEGMENT_ALL:
+        audience.load()
+        return [chat_id for chat_id in audience.members(segment) if chat_id not in dead]
+    stored = storage.load_active_chats()
+    with active_chats_lock:
+        active_chats.update(stored)
+        return [chat_id for chat_id in active_chats if chat_id not in dead]
+
+def broadcast_sender(payload: dict):
+    """
+    Функция отправки одного сообщения рассылки по сохраненному payload.
+    Локальный файл (payload['asset']) загружается один раз на всю рассылку.
+    """
+    broadcast_type = payload['type']
+    content = payload['content']
+    caption = payload.get('caption', "")
+    asset = payload.get('asset')
     
-    display = f"{config['emoji']} {config['name']}"
-    
-    if content_type in ['text', 'location', 'contact']:
-        display = content
-    elif config['has_caption'] and caption:
-        display += f"\n\nПодпись: {caption}"
-    
-    return display
+    def send_one(chat_id: int):
+        if asset:
+            return send_asset(chat_id, asset, broadcast_type, caption, PRIORITY_BROADCAST).result()
+        return queue_send(chat_id, broadcast_type, content, caption, PRIORITY_BROADCAST).result()
+    return send_one
 
-def broadcast_message(broadcast_type: str, content: str, caption: str = ""):
-    """Функция рассылки сообщения всем пользователям бота."""
-    success_count = 0
-    fail_count = 0
+def broadcast_message(broadcast_type: str, content: str, caption: str = "",
+                      on_progress=None, on_done=None, status: tuple = None, asset: str = None,
+                      segment: str = SEGMENT_ALL):
+    """
+    Запускает фоновую рассылку сообщения пользователям сегмента segment
+    (по умолчанию — всем пользователям бота).
+    status — (chat_id, message_id) сообщения с прогрессом; сохраняется в
+    контрольной точке, чтобы после перезапуска продолжить его обновлять.
+    asset — путь к локальному файлу вместо content (отправляется через кэш file_id).
+    Возвращает объект BroadcastJob со счетчиками отправки.
+    """
+    recipients = broadcast_audience(segment)
+    log.info("🔄 Начало рассылки. Тип: %s, сегмент: %s, получателей: %s",
+             broadcast_type, segment, len(recipients))
     
-    print(f"🔄 Начало рассылки. Тип: {broadcast_type}")
+    payload = {'type': broadcast_type, 'content': content, 'caption': caption}
+    if asset:
+        payload['asset'] = asset
+    return broadcast_engine.start(
+        recipients,
+        broadcast_sender(payload),
+        on_progress=on_progress,
+        on_done=on_done,
+        payload=payload,
+        status=status
+    )
+
+def start_broadcast_with_status(broadcast_type: str, content: str, caption: str, status: tuple,
+                                segment: str = SEGMENT_ALL):
+    """Запускает рассылку, прогресс которой показывается в сообщении status."""
+    return broadcast_message(
+        broadcast_type,
+        content,
+        caption,
+        on_progress=lambda job: update_broadcast_status(*status, job),
+        on_done=lambda job: update_broadcast_status(*status, job, finished=True),
+        status=status,
+        segment=segment
+    )
+
+def resume_broadcasts():
+    """
+    Продолжает рассылки, прерванные перезапуском процесса. Если их несколько,
+    они запускаются по очереди, от самой старой: следующая стартует, когда
+    завершится предыдущая.
+    """
+    journal = broadcast_engine.journal
+    if journal is None:
+        return None
+    jobs = journal.load_all()
+    if not jobs:
+        return None
+    if len(jobs) > 1:
+        log.warning("⚠️ В журнале %s незавершенных рассылок, они будут продолжены по очереди", len(jobs))
+    queue = iter(jobs)
+
+    def resume_next(previous=None):
+        if previous is not None and previous.status:
+            update_broadcast_status(*previous.status, previous, finished=True)
+        job = next(queue, None)
+        if job is None:
+            return None
+        log.info("🔁 Продолжение рассылки %s: обработано %s из %s", job.job_id, job.processed, job.total)
+        status = job.status
+        broadcast_engine.start(
+            job.chat_ids,
+            broadcast_sender(job.payload),
+            on_progress=(lambda j: update_broadcast_status(*status, j)) if status else None,
+            on_done=resume_next,
+            job=job
+        )
+        if status:
+            update_broadcast_status(*status, job)
+        return job
+
+    return resume_next()
+
+def broadcast_status_text(job, finished: bool = False) -> str:
+    """Текст сообщения со статусом или результатами рассылки."""
+    if finished:
+        title = "⛔ <b>Рассылка отменена.</b>" if job.state == CANCELLED else "📊 <b>Результаты рассылки:</b>"
+        return (
+            f"{title}\n\n"
+            f"✅ Успешно отправлено: {job.success_count}\n"
+            f"❌ Не удалось отправить: {job.fail_count}\n"
+            f"📈 Всего пользователей: {job.total}"
+        )
+    title = "⏸ <b>Рассылка на паузе</b>" if job.state == PAUSED else "🔄 <b>Идет рассылка...</b>"
+    return (
+        f"{title}\n\n"
+        f"Обработано: {job.processed} из {job.total}\n"
+        f"✅ Успешно: {job.success_count}\n"
+        f"❌ Ошибок: {job.fail_count}"
+    )
+
+def update_broadcast_status(chat_id: int, message_id: int, job, finished: bool = False):
+    """Обновляет у администратора сообщение со статусом рассылки."""
+    try:
+        bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=message_id,
+            text=broadcast_status_text(job, finished),
+            reply_markup=None if finished else broadcast_controls(job),
+            parse_mode='HTML'
+        )
+    except Exception as e:
+        log.error("❌ Ошибка обновления статуса рассылки: %s", e)
+
+def broadcast_controls(job) -> types.InlineKeyboardMarkup:
+    """Кнопки управления идущей рассылкой."""
+    keyboard = types.InlineKeyboardMarkup(row_width=2)
+    if job.state == PAUSED:
+        toggle = types.InlineKeyboardButton(text="▶️ Продолжить", callback_data=f"bjob:resume:{job.job_id}")
+    else:
+        toggle = types.InlineKeyboardButton(text="⏸ Пауза", callback_data=f"bjob:pause:{job.job_id}")
+    keyboard.add(toggle, types.InlineKeyboardButton(text="⛔ Отменить", callback_data=f"bjob:cancel:{job.job_id}"))
+    return keyboard
+
+def control_broadcast(action: str, job_id: str) -> str:
+    """
+    Пауза, продолжение или отмена текущей рассылки.
+    Возвращает текст ответа на нажатие кнопки.
+    """
+    job = broadcast_engine.current
+    if job is None or job.job_id != job_id or job.done.is_set():
+        return "Рассылка уже завершена"
     
-    for chat_id in active_chats:
-        result = safe_send(chat_id, broadcast_type, content, caption)
-        if result:
-            success_count += 1
-        else:
-            fail_count += 1
-        time.sleep(0.1)
+    changed = {'pause': job.pause, 'resume': job.resume, 'cancel': job.cancel}[action]()
+    if not changed:
+        return "Состояние рассылки не изменилось"
     
-    return success_count, fail_count
+    broadcast_engine.checkpoint(job)
+    log.info("📢 Рассылка %s: %s", job_id, action)
+    if job.status and action != 'cancel':
+        update_broadcast_status(*job.status, job)
+    return {'pause': "⏸ Рассылка приостановлена", 'resume': "▶️ Рассылка продолжена",
+            'cancel': "⛔ Рассылка отменяется"}[action]
 
-# --- Хендлер для рассылки ---
-@bot.message_handler(func=lambda message: message.text == "304041GHK")
-def handle_broadcast_command(message: telebot.types.Message):
-    """Обрабатывает команду для открытия меню рассылки."""
-    if message.from_user.id not in ADMIN_IDS:
-        bot.send_message(message.chat.id, "❌ У вас нет прав для использования этой команды.")
-        return
-    
+def segment_size(segment: str) -> int:
+    """Размер сегмента без учета недоступных чатов (O(1))."""
+    if segment == SEGMENT_ALL:
+        return len(active_chats)
+    return audience.size(segment)
+
+def broadcast_menu(segment: str = SEGMENT_ALL) -> tuple:
+    """Текст и клавиатура меню рассылки."""
     keyboard = types.InlineKeyboardMarkup(row_width=2)
     buttons = [
-        types.InlineKeyboardButton(text=f"{config['emoji']} {config['name']}", 
+        types.InlineKeyboardButton(text=CONTENT_TYPES[ctype].display_name,
                                   callback_data=f"broadcast_{ctype}")
-        for ctype, config in CONTENT_TYPE_CONFIG.items()
-        if ctype in ['text', 'photo', 'video', 'document', 'animation']
+        for ctype in BROADCAST_CONTENT_TYPES
     ]
     
     for i in range(0, len(buttons), 2):
         keyboard.add(*buttons[i:i+2])
     
+    keyboard.add(types.InlineKeyboardButton(
+        text=f"🎯 Аудитория: {segment_title(segment)} ({segment_size(segment)})",
+        callback_data="segment_menu"
+    ))
     keyboard.add(types.InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_broadcast"))
     
-    user_states[message.chat.id] = "broadcast_menu"
-    
-    safe_send(
-        message.chat.id,
-        'text',
+    text = (
         f"📋 <b>Меню рассылки</b>\n\n"
+        f"Аудитория: {segment_title(segment)}\n"
         f"Выберите тип контента для рассылки:\n\n"
         f"Статистика:\n"
         f"• Активных чатов: {len(active_chats)}\n"
-        f"• Владельцев бизнес-ботов: {len(business_connection_owners)}",
-        reply_markup=keyboard
+        f"• Недоступных (пропускаются): {len(dead_chats)}\n"
+        f"• Владельцев бизнес-ботов: {len(owner_cache)}\n\n"
+        f"Подробная статистика: /stats"
+    )
+    return text, keyboard
+
+def segment_menu() -> tuple:
+    """Текст и клавиатура выбора сегмента аудитории."""
+    keyboard = types.InlineKeyboardMarkup()
+    for segment, size in [(SEGMENT_ALL, len(active_chats)), *audience.segments()]:
+        keyboard.add(types.InlineKeyboardButton(
+            text=f"{segment_title(segment)} ({size})",
+            callback_data=f"segment:{segment}"
+        ))
+    keyboard.add(types.InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_broadcast"))
+    return "🎯 <b>Кому отправить рассылку?</b>", keyboard
+
+def broadcast_instruction(broadcast_type: str) -> tuple:
+    """Текст и клавиатура с просьбой прислать контент для рассылки."""
+    content_config = CONTENT_TYPES.get(broadcast_type)
+    if content_config:
+        instruction = f"{content_config.emoji} <b>Отправьте {content_config.name} для рассылки:</b>"
+    else:
+        instruction = "📋 <b>Отправьте контент для рассылки:</b>"
+    
+    keyboard = types.InlineKeyboardMarkup()
+    keyboard.add(types.InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_broadcast"))
+    return instruction, keyboard
+
+def broadcast_preview(content: str, content_type: str, segment: str = SEGMENT_ALL) -> tuple:
+    """Текст и клавиатура предпросмотра рассылки."""
+    keyboard = types.InlineKeyboardMarkup()
+    keyboard.add(types.InlineKeyboardButton(text="✅ Подтвердить рассылку", callback_data="confirm_broadcast"))
+    keyboard.add(types.InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_broadcast"))
+    
+    text = (
+        f"📝 <b>Предпросмотр рассылки:</b>\n\n"
+        f"Тип: {content_type}\n"
+        f"Аудитория: {segment_title(segment)}\n"
+        f"Содержимое:\n{content}\n\n"
+        f"<i>Это сообщение будет отправлено {segment_size(segment)} пользователям "
+        f"(недоступные чаты пропускаются).</i>\n"
+        f"Подтвердите отправку:"
+    )
+    return text, keyboard
+
+def store_broadcast_content(chat_id: int, message: telebot.types.Message) -> tuple:
+    """
+    Сохраняет присланный администратором контент для рассылки.
+    Возвращает (текст, клавиатура) предпросмотра или None.
+    """
+    broadcast_type = user_states[chat_id].replace("waiting_broadcast_", "")
+    
+    data = extract_message_data(message)
+    if not data:
+        return None
+    
+    content = broadcast_data.setdefault(chat_id, {})
+    content['content'] = data['content']
+    content['caption'] = data.get('caption', '')
+    
+    preview_text = format_content_display(broadcast_type, data['content'], data.get('caption', ''))
+    return broadcast_preview(preview_text, CONTENT_TYPES[broadcast_type].name,
+                             content.get('segment', SEGMENT_ALL))
+
+# --- Хендлер для рассылки ---
+@bot.message_handler(func=lambda message: message.text == BROADCAST_COMMAND)
+@track_update("message")
+def handle_broadcast_command(message: telebot.types.Message):
+    """Обрабатывает команду для открытия меню рассылки."""
+    if message.from_user.id not in ADMIN_IDS:
+        bot.send_message(message.chat.id, "❌ У вас нет прав для использования этой команды.")
+        return
+    
+    user_states[message.chat.id] = "broadcast_menu"
+    broadcast_data.pop(message.chat.id, None)
+    
+    text, keyboard = broadcast_menu()
+    safe_send(message.chat.id, 'text', text, reply_markup=keyboard)
+
+def format_percent(part: int, total: int) -> str:
+    return f"{part / total:.0%}" if total else "—"
+
+def format_uptime(seconds: float) -> str:
+    minutes = int(seconds // 60)
+    days, minutes = divmod(minutes, 24 * 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{days} д {hours} ч {minutes} мин" if days else f"{hours} ч {minutes} мин"
+
+def stats_snapshot() -> dict:
+    """Снимок счетчиков этого процесса для /stats."""
+    return {
+        'live': live_stats.snapshot(),
+        'store': message_store.stats(),
+        'sends': outbox.metrics(),
+    }
+
+def shard_stats() -> list:
+    """
+    Снимки воркеров шардов; sharding.py подменяет эту функцию в координаторе,
+    потому что бизнес-обновления обрабатываются и считаются в воркерах.
+    """
+    return []
+
+def stats_text() -> str:
+    """
+    Текст статистики для администратора. Строится из счетчиков, которые
+    ведутся по ходу работы, без обхода хранилища сообщений.
+    """
+    snapshots = [stats_snapshot(), *shard_stats()]
+    live = merge_snapshots([snapshot['live'] for snapshot in snapshots])
+    store = merge_snapshots([snapshot['store'] for snapshot in snapshots])
+    sends = merge_snapshots([snapshot['sends'] for snapshot in snapshots])
+    
+    lines = [
+        "📊 <b>Статистика бота</b>"
+        + (f" (процессов: {len(snapshots)})" if len(snapshots) > 1 else ""),
+        f"⏱️ Работает: {format_uptime(live['uptime'])}",
+        "",
+        "<b>Сообщения</b>",
+        f"• Залогировано: {live['messages']} (за час: {live['messages_hour']})",
+        f"• В памяти: {store['messages']} (~{store['bytes'] / 1024 / 1024:.1f} МБ)",
+        f"• Правок за час: {live['edits_hour']} (всего {live['edits']}, "
+        f"с исходной версией {format_percent(live['edits_found'], live['edits'])})",
+        f"• Удалений за час: {live['deletes_hour']} (всего {live['deletes']})",
+        f"• Удаленные найдены в хранилище: {format_percent(live['deletes_found_hour'], live['deletes_hour'])} "
+        f"за час, {format_percent(live['deletes_found'], live['deletes'])} всего",
+        f"• Попадания в кэш: {format_percent(store['hits'], store['hits'] + store['misses'])}",
+        "",
+        f"<b>Соединения</b> (активных: {live['connections']})",
+    ]
+    for connection_id, total, last_hour in live['top_connections']:
+        lines.append(f"• <code>{connection_id}</code>: {last_hour} за час, {total} всего")
+    lines += [
+        "",
+        "<b>Отправка</b>",
+        f"• Очередь: {sends['queue_depth']} (уведомления {sends['queue_depth_alert']}, "
+        f"рассылка {sends['queue_depth_broadcast']}), в работе: {sends['in_flight']}",
+        f"• Задержка p50/p99: {sends['latency_p50']:.2f} / {sends['latency_p99']:.2f} с",
+        f"• Отправлено: {sends['sent']}, ошибок: {sends['failed']}, "
+        f"повторов: {sends['retries']}, flood wait: {sends['flood_waits']}",
+        "",
+        "<b>Аудитория</b>",
+        f"• Активных чатов: {len(active_chats)}, недоступных: {len(dead_chats)}",
+        f"• Владельцев бизнес-ботов: {len(owner_cache)}",
+    ]
+    return "\n".join(lines)
+
+def stats_keyboard() -> types.InlineKeyboardMarkup:
+    keyboard = types.InlineKeyboardMarkup()
+    keyboard.add(types.InlineKeyboardButton(text="🔄 Обновить", callback_data="stats_refresh"))
+    return keyboard
+
+@bot.message_handler(commands=['stats'])
+@track_update("message")
+def handle_stats_command(message: telebot.types.Message):
+    """Показывает администратору живую статистику."""
+    if message.from_user.id not in ADMIN_IDS:
+        bot.send_message(message.chat.id, "❌ У вас нет прав для использования этой команды.")
+        return
+    
+    safe_send(message.chat.id, 'text', stats_text(), reply_markup=stats_keyboard())
+
+def format_interval(seconds: float) -> str:
+    if seconds % 3600 == 0:
+        return f"{int(seconds // 3600)} ч"
+    if seconds % 60 == 0:
+        return f"{int(seconds // 60)} мин"
+    return f"{seconds:g} сек"
+
+def digest_menu(owner_id: int) -> tuple:
+    """Текст и клавиатура выбора режима доставки уведомлений."""
+    current = digest_settings.get(owner_id)
+    keyboard = types.InlineKeyboardMarkup()
+    for interval in (INSTANT, *DIGEST_INTERVALS):
+        title = "⚡ Мгновенно" if interval == INSTANT else f"🕐 Раз в {format_interval(interval)}"
+        if interval == current:
+            title = f"✅ {title}"
+        keyboard.add(types.InlineKeyboardButton(text=title, callback_data=f"digest:{interval:g}"))
+    
+    mode = "мгновенно" if current == INSTANT else f"дайджестом раз в {format_interval(current)}"
+    text = (
+        f"📬 <b>Доставка уведомлений</b>\n\n"
+        f"Сейчас правки и удаления приходят {mode}.\n\n"
+        f"В режиме дайджеста все правки и удаления за интервал собираются в одно "
+        f"сообщение на собеседника. Дайджест приходит раньше, если накопилось "
+        f"{DIGEST_MAX_EVENTS} событий."
     )
+    return text, keyboard
+
+@bot.message_handler(commands=['digest'])
+@track_update("message")
+def handle_digest_command(message: telebot.types.Message):
+    """Показывает владельцу выбор режима доставки уведомлений."""
+    text, keyboard = digest_menu(message.from_user.id)
+    safe_send(message.chat.id, 'text', text, reply_markup=keyboard)
+
+def set_digest_interval(owner_id: int, value: str) -> str:
+    """Сохраняет выбранный режим доставки. Возвращает текст ответа на нажатие кнопки."""
+    interval = float(value)
+    if interval != INSTANT and interval not in DIGEST_INTERVALS:
+        return "❌ Недоступный интервал"
+    digest_settings.set(owner_id, interval)
+    digest_changed(owner_id, interval)
+    if interval == INSTANT:
+        return "⚡ Уведомления будут приходить сразу"
+    return f"🕐 Дайджест раз в {format_interval(interval)}"
+
+def digest_changed(owner_id: int, interval: float):
+    """
+    Режим доставки владельца изменился: накопленное отправляется сразу.
+    При шардированном запуске события владельца копятся в воркерах, поэтому
+    sharding.py подменяет эту функцию рассылкой команды воркерам.
+    """
+    digest_settings.remember(owner_id, interval)
+    digest_buffer.flush(owner_id)
 
 @bot.callback_query_handler(func=lambda call: True)
+@track_update("callback_query")
 def handle_callback(call):
     """Обрабатывает callback-запросы от кнопок."""
-    if call.data.startswith("broadcast_"):
+    if call.data.startswith("bjob:"):
+        if call.from_user.id not in ADMIN_IDS:
+            bot.answer_callback_query(call.id, "❌ Недостаточно прав")
+            return
+        _, action, job_id = call.data.split(":", 2)
+        bot.answer_callback_query(call.id, control_broadcast(action, job_id))
+    
+    elif call.data == "stats_refresh":
+        if call.from_user.id not in ADMIN_IDS:
+            bot.answer_callback_query(call.id, "❌ Недостаточно прав")
+            return
+        try:
+            bot.edit_message_text(
+                chat_id=call.message.chat.id,
+                message_id=call.message.message_id,
+                text=stats_text(),
+                reply_markup=stats_keyboard(),
+                parse_mode='HTML'
+            )
+        except Exception as e:
+            # Telegram отвечает ошибкой, если текст не изменился
+            log.debug("Статистика не обновлена: %s", e)
+        bot.answer_callback_query(call.id)
+    
+    elif call.data.startswith("digest:"):
+        answer = set_digest_interval(call.from_user.id, call.data.split(":", 1)[1])
+        text, keyboard = digest_menu(call.from_user.id)
+        try:
+            bot.edit_message_text(
+                chat_id=call.message.chat.id,
+                message_id=call.message.message_id,
+                text=text,
+                reply_markup=keyboard,
+                parse_mode='HTML'
+            )
+        except Exception as e:
+            log.debug("Меню дайджеста не обновлено: %s", e)
+        bot.answer_callback_query(call.id, answer)
+    
+    elif call.data == "segment_menu" or call.data.startswith("segment:"):
+        if call.from_user.id not in ADMIN_IDS:
+            bot.answer_callback_query(call.id, "❌ Недостаточно прав")
+            return
+        if call.data == "segment_menu":
+            text, keyboard = segment_menu()
+        else:
+            segment = call.data.split(":", 1)[1]
+            if segment != SEGMENT_ALL and not audience.has_segment(segment):
+                # Кнопка из старого меню (например, изменился AUDIENCE_ACTIVE_DAYS)
+                bot.answer_callback_query(call.id, "❌ Неизвестный сегмент")
+                return
+            broadcast_data.setdefault(call.message.chat.id, {})['segment'] = segment
+            text, keyboard = broadcast_menu(segment)
+        try:
+            bot.edit_message_text(
+                chat_id=call.message.chat.id,
+                message_id=call.message.message_id,
+                text=text,
+                reply_markup=keyboard,
+                parse_mode='HTML'
+            )
+        except Exception as e:
+            log.error("❌ Ошибка редактирования сообщения: %s", e)
+        bot.answer_callback_query(call.id)
+    
+    elif call.data.startswith("broadcast_"):
         broadcast_type = call.data.replace("broadcast_", "")
         user_states[call.message.chat.id] = f"waiting_broadcast_{broadcast_type}"
         
-        if call.message.chat.id not in broadcast_data:
-            broadcast_data[call.message.chat.id] = {}
-        broadcast_data[call.message.chat.id]['type'] = broadcast_type
-        
-        config = CONTENT_TYPE_CONFIG.get(broadcast_type, {})
-        instruction = f"{config.get('emoji', '📋')} <b>Отправьте {config.get('name', 'контент')} для рассылки:</b>"
+        broadcast_data.setdefault(call.message.chat.id, {})['type'] = broadcast_type
         
-        keyboard = types.InlineKeyboardMarkup()
-        keyboard.add(types.InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_broadcast"))
+        instruction, keyboard = broadcast_instruction(broadcast_type)
         
         try:
             bot.edit_message_text(
@@ -332,7 +991,7 @@ def handle_callback(call):
                 parse_mode='HTML'
             )
         except Exception as e:
-            print(f"❌ Ошибка редактирования сообщения: {e}")
+            log.error("❌ Ошибка редактирования сообщения: %s", e)
         
     elif call.data == "cancel_broadcast":
         user_states.pop(call.message.chat.id, None)
@@ -346,18 +1005,23 @@ def handle_callback(call):
                 reply_markup=None
             )
         except Exception as e:
-            print(f"❌ Ошибка отмены рассылки: {e}")
+            log.error("❌ Ошибка отмены рассылки: %s", e)
     
     elif call.data == "confirm_broadcast":
         data = broadcast_data.get(call.message.chat.id, {})
         broadcast_type = data.get('type')
         content = data.get('content')
         caption = data.get('caption', "")
+        segment = data.get('segment', SEGMENT_ALL)
         
         if not content:
             bot.answer_callback_query(call.id, "❌ Контент для рассылки не найден")
             return
         
+        if broadcast_engine.busy:
+            bot.answer_callback_query(call.id, "⏳ Предыдущая рассылка еще не завершена")
+            return
+        
         try:
             bot.edit_message_text(
                 chat_id=call.message.chat.id,
@@ -366,157 +1030,450 @@ def handle_callback(call):
                 parse_mode='HTML'
             )
         except Exception as e:
-            print(f"❌ Ошибка обновления сообщения: {e}")
-        
-        success_count, fail_count = broadcast_message(broadcast_type, content, caption)
+            log.error("❌ Ошибка обновления сообщения: %s", e)
         
         user_states.pop(call.message.chat.id, None)
         broadcast_data.pop(call.message.chat.id, None)
         
-        try:
-            bot.edit_message_text(
-                chat_id=call.message.chat.id,
-                message_id=call.message.message_id,
-                text=f"📊 <b>Результаты рассылки:</b>\n\n"
-                     f"✅ Успешно отправлено: {success_count}\n"
-                     f"❌ Не удалось отправить: {fail_count}\n"
-                     f"📈 Всего пользователей: {len(active_chats)}",
-                parse_mode='HTML'
-            )
-        except Exception as e:
-            print(f"❌ Ошибка отправки результатов: {e}")
+        # Рассылка идет в фоне, обработка обновлений не блокируется
+        start_broadcast_with_status(
+            broadcast_type,
+            content,
+            caption,
+            (call.message.chat.id, call.message.message_id),
+            segment=segment
+        )
 
 # --- Универсальный обработчик для broadcast контента ---
-@bot.message_handler(content_types=['text', 'photo', 'video', 'document', 'animation'],
+@bot.message_handler(content_types=BROADCAST_CONTENT_TYPES,
                     func=lambda msg: user_states.get(msg.chat.id, "").startswith("waiting_broadcast_"))
+@track_update("message")
 def handle_broadcast_content(message: telebot.types.Message):
     """Универсальный обработчик для всех типов контента при рассылке."""
-    broadcast_type = user_states[message.chat.id].replace("waiting_broadcast_", "")
-    
-    data = extract_message_data(message)
-    if not data:
+    preview = store_broadcast_content(message.chat.id, message)
+    if not preview:
         return
     
-    if message.chat.id not in broadcast_data:
-        broadcast_data[message.chat.id] = {}
-    
-    broadcast_data[message.chat.id]['content'] = data['content']
-    broadcast_data[message.chat.id]['caption'] = data.get('caption', '')
-    
-    preview_text = format_content_display(broadcast_type, data['content'], data.get('caption', ''))
-    show_broadcast_preview(message.chat.id, preview_text, CONTENT_TYPE_CONFIG[broadcast_type]['name'])
-
-def show_broadcast_preview(chat_id: int, content: str, content_type: str):
-    """Показывает предпросмотр рассылки и кнопки подтверждения."""
-    keyboard = types.InlineKeyboardMarkup()
-    keyboard.add(types.InlineKeyboardButton(text="✅ Подтвердить рассылку", callback_data="confirm_broadcast"))
-    keyboard.add(types.InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_broadcast"))
-    
-    safe_send(
-        chat_id,
-        'text',
-        f"📝 <b>Предпросмотр рассылки:</b>\n\n"
-        f"Тип: {content_type}\n"
-        f"Содержимое:\n{content}\n\n"
-        f"<i>Это сообщение будет отправлено {len(active_chats)} пользователям.</i>\n"
-        f"Подтвердите отправку:",
-        reply_markup=keyboard
-    )
+    text, keyboard = preview
+    safe_send(message.chat.id, 'text', text, reply_markup=keyboard)
 
 # --- Хендлеры для «Business Mode» ---
 
 @bot.business_connection_handler()
+@track_update("business_connection")
 def handle_business_connection(connection: telebot.types.BusinessConnection):
     """Обрабатывает подключение бизнес-аккаунта."""
-    print(f"🔌 Получено бизнес-соединение: {connection.id}")
-    print(f"   Владелец: {connection.user.id}")
-    print(f"   Активно: {connection.is_enabled}")
-    
-    business_connection_owners[connection.id] = connection.user.id
-    business_connections[connection.id] = connection
+    log.info("🔌 Получено бизнес-соединение: %s", connection.id)
+    log.info("   Владелец: %s", connection.user.id)
+    log.info("   Активно: %s", connection.is_enabled)
     
-    if connection.user.id not in active_chats:
-        active_chats.add(connection.user.id)
-        print(f"✅ Владелец {connection.user.id} добавлен в активные чаты")
+    if remember_business_connection(connection):
+        log.info("✅ Владелец %s добавлен в активные чаты", connection.user.id)
 
-@bot.business_message_handler(content_types=[
-    'text', 'photo', 'video', 'voice', 'document',
-    'animation', 'audio', 'sticker', 'location', 'contact'
-])
+@bot.business_message_handler(content_types=BUSINESS_CONTENT_TYPES)
+@track_update("business_message")
 def handle_business_message(message: telebot.types.Message):
     """Обрабатывает новые бизнес-сообщения и логирует их."""
-    owner_id = validate_business_connection(message.business_connection_id)
-    if not owner_id:
-        return
-    
+    try:
+        owner_id = validate_business_connection(message.business_connection_id)
+        if not owner_id:
+            return
+        
+        audience.touch(owner_id)
+        log_business_message(message)
+    finally:
+        # Правки и удаления, пришедшие раньше оригинала, можно обрабатывать
+        reorder_buffer.release(message.chat.id, message.message_id)
+
+def log_business_message(message: telebot.types.Message) -> dict:
+    """Сохраняет бизнес-сообщение в хранилище. Возвращает извлеченные данные."""
     data = extract_message_data(message)
     if not data:
         return
     
-    # Сохраняем информацию об отправителе
+    # Сохраняем сообщение вместе с информацией об отправителе
+    sender_info = None
+    sender_user_id = None
     if message.from_user:
-        message_senders[(message.chat.id, message.message_id)] = {
-            'info': get_user_info(message.from_user),
-            'user_id': message.from_user.id
-        }
-    
-    messages_log[(message.chat.id, message.message_id)] = data
-    print(f"💾 Сообщение сохранено: чат {message.chat.id}, тип {data['type']}")
-
-@bot.edited_business_message_handler(content_types=[
-    'text', 'photo', 'video', 'voice', 'document', 
-    'animation', 'audio', 'sticker', 'location', 'contact'
-])
+        sender_info = get_user_info(message.from_user)
+        sender_user_id = message.from_user.id
+    
+    message_store.put(
+        message.chat.id,
+        message.message_id,
+        StoredMessage.from_data(data, sender_info, sender_user_id)
+    )
+    if media_archive and data.get('file_unique_id'):
+        media_archive.submit(data['content'], data['file_unique_id'], data.get('file_size'))
+    live_stats.record_message(message.business_connection_id)
+    log.debug("💾 Сообщение сохранено: чат %s, тип %s", message.chat.id, data['type'])
+    return data
+
+@bot.edited_business_message_handler(content_types=BUSINESS_CONTENT_TYPES)
+@track_update("edited_business_message")
 def handle_edited_business_message(message: telebot.types.Message):
     """Обрабатывает отредактированные сообщения."""
     owner_id = validate_business_connection(message.business_connection_id)
     if not owner_id:
         return
     
-    print(f"✏️ Обнаружено редактирование сообщения {message.message_id} в чате {message.chat.id}")
+    event = record_edit(message, owner_id)
+    if not event:
+        return
+    
+    interval = digest_settings.get(owner_id)
+    if interval:
+        digest_buffer.add(owner_id, message.chat.id, ('edit', *event), interval)
+        return
+    
+    log.debug("📤 Отправка уведомления об редактировании владельцу %s", owner_id)
+    queue_send(owner_id, 'text', format_edit_notification(*event), reply_markup=chat_keyboard(message.chat.id))
+
+def chat_keyboard(chat_id: int) -> types.InlineKeyboardMarkup:
+    """Клавиатура с кнопкой перехода в чат собеседника."""
+    keyboard = types.InlineKeyboardMarkup()
+    keyboard.add(types.InlineKeyboardButton(text="Перейти в чат", url=f"tg://user?id={chat_id}"))
+    return keyboard
+
+def record_edit(message: telebot.types.Message, owner_id: int) -> tuple:
+    """
+    Обновляет лог отредактированного сообщения. Возвращает событие правки
+    (msg_id, sender_info, old_content, new_content, edits) или None,
+    если уведомлять не нужно.
+    """
+    log.debug("✏️ Обнаружено редактирование сообщения %s в чате %s", message.message_id, message.chat.id)
     
-    old_data = messages_log.get((message.chat.id, message.message_id), {})
+    old_record = message_store.get(message.chat.id, message.message_id)
     new_data = extract_message_data(message)
     
     if not new_data:
-        return
-    
-    # Обновляем лог
-    messages_log[(message.chat.id, message.message_id)] = new_data
+        return None
+    live_stats.record_edit(old_record is not None)
     
     # Получаем информацию об отправителе
-    sender_data = message_senders.get((message.chat.id, message.message_id), {})
-    sender_info = sender_data.get('info', "Неизвестный отправитель")
-    sender_user_id = sender_data.get('user_id')
+    sender_info = old_record.sender_info if old_record else None
+    sender_user_id = old_record.sender_id if old_record else None
+    
+    # Обновляем лог, сохраняя предыдущие версии дельтами к исходной
+    record = StoredMessage.from_data(new_data, sender_info, sender_user_id)
+    if old_record:
+        history = old_record.history or EditHistory(
+            old_record.type, old_record.content, old_record.caption, old_record.stored_at
+        )
+        record.history = history.with_edit(
+            new_data['type'], new_data['content'], new_data.get('caption', ''), EDIT_HISTORY_MAX
+        )
+    message_store.put(message.chat.id, message.message_id, record)
+    sender_info = sender_info or "Неизвестный отправитель"
     
     # Если отправитель - владелец, не уведомляем
     if sender_user_id == owner_id:
-        print(f"⏩ Сообщение отредактировано владельцем {owner_id}, уведомление не отправляется")
-        return
+        log.debug("⏩ Сообщение отредактировано владельцем %s, уведомление не отправляется", owner_id)
+        return None
     
     # Формируем уведомление
-    old_content = format_content_display(old_data.get('type', 'unknown'), 
-                                        old_data.get('content', '?'),
-                                        old_data.get('caption', ''))
+    if old_record:
+        old_content = format_content_display(old_record.type, old_record.content, old_record.caption)
+    else:
+        old_content = format_content_display('unknown', '?')
     new_content = format_content_display(new_data['type'], 
                                         new_data['content'],
                                         new_data.get('caption', ''))
     
-    keyboard = types.InlineKeyboardMarkup()
-    keyboard.add(types.InlineKeyboardButton(text="Перейти в чат", url=f"tg://user?id={message.chat.id}"))
-    
-    notify_text = (
-        f"✏️ <b>Сообщение отредактировано</b>\n"
-        f"от: {sender_info}\n\n"
-        f"<b>Было:</b> {old_content}\n\n"
-        f"<b>Стало:</b> {new_content}\n\n"
-        f"@{bot.get_me().username}"
+    edits = record.history.edits if record.history else 1
+    return message.message_id, sender_info, old_content, new_content, edits
+
+def format_edit_notification(msg_id: int, sender_info: str, old_content: str, new_content: str,
+                             edits: int) -> str:
+    """Текст уведомления об одной правке."""
+    title = "Сообщение отредактировано" if edits == 1 else f"Сообщение отредактировано (правка {edits})"
+    
+    return (
+        f"✏️ <b>{title}</b>\n"
+        f"от: {escape(sender_info)}\n\n"
+        f"<b>Было:</b> {escape(old_content)}\n\n"
+        f"<b>Стало:</b> {escape(new_content)}\n\n"
+        f"@{bot_identity.username}"
     )
+
+def deleted_message_payload(msg_id: int, data: StoredMessage, sender_info: str, bot_username: str) -> list:
+    """
+    Формирует уведомление об удаленном сообщении в виде списка отправок
+    (content_type, content, caption).
+    """
+    if not data:
+        notify_text = (
+            f"🗑️ Сообщение удалено\n"
+            f"от: {escape(sender_info)}\n\n"
+            f"Сообщение не сохранено (ОШИБКА: ЛОГИ)\n"
+            f"📋 ID сообщения: {msg_id}\n\n"
+            f"@{bot_username}"
+        )
+        return [('text', notify_text, "")]
+    
+    content_type = data.type
+    content = data.content
+    caption = escape(data.caption or "")
+    
+    content_config = CONTENT_TYPES.get(content_type)
+    if not content_config:
+        return []
+    
+    prefix = f"@{bot_username}\n\n🗑️ <b>Удаленное {content_config.name}</b>\nот {escape(sender_info)}"
+    
+    trail = format_edit_history(data.history) if data.history else ""
+    
+    if content_config.is_text:
+        # Локация, контакт, опрос и кубик уходят текстом, как и обычное сообщение
+        text = f"{prefix}:\n\n{escape(content)}"
+        if trail and len(text) + len(trail) + 2 <= MESSAGE_TEXT_LIMIT:
+            return [('text', f"{text}\n\n{trail}", "")]
+        payload = [('text', text, "")]
+    elif content_type in ('sticker', 'video_note'):
+        # Подпись к стикеру и видеосообщению не прикрепить — отправляем ее отдельно
+        payload = [('text', f"{prefix}\n\n", ""), (content_type, content, "")]
+    elif content_config.has_caption:
+        full_caption = prefix
+        if caption:
+            full_caption += f"\nподпись: {caption}"
+        payload = [(content_type, content, full_caption)]
+    else:
+        payload = [(content_type, content, prefix)]
+    
+    if trail:
+        payload.append(('text', truncate_html(trail, MESSAGE_TEXT_LIMIT), ""))
+    return payload
+
+def format_edit_history(history: EditHistory) -> str:
+    """Список предыдущих версий сообщения (без текущей) для уведомлений."""
+    revisions = history.revisions()[:-1]
+    lines = [f"✏️ <b>История правок ({history.edits}):</b>"]
+    for index, (edited_at, content_type, content, caption) in enumerate(revisions):
+        if index == 0:
+            label = "Исходное"
+        else:
+            label = f"Правка {history.dropped + index}"
+        when = time.strftime('%d.%m %H:%M', time.localtime(edited_at))
+        lines.append(f"<b>{label}</b> ({when}): {escape(format_content_display(content_type, content, caption))}")
+        if index == 0 and history.dropped:
+            lines.append(f"… пропущено правок: {history.dropped}")
+    return "\n".join(lines)
+
+def restore_error_text(content_type: str, error: Exception) -> str:
+    """Текст уведомления о неудачном восстановлении сообщения."""
+    return (
+        f"❌ <b>Ошибка при восстановлении сообщения:</b>\n"
+        f"Тип: {content_type}\n"
+        f"Ошибка: {str(error)}"
+    )
+
+def restore_deleted_message(owner_id: int, msg_id: int, data: StoredMessage, sender_info: str,
+                            keyboard: types.InlineKeyboardMarkup, bot_username: str):
+    """Отправляет владельцу уведомление об одном удаленном сообщении."""
+    if data:
+        log.debug("🔄 Восстановление удаленного сообщения типа %s", data.type)
+    
+    if data and not CONTENT_TYPES[data.type].is_text and load_shedder.degrade_media():
+        load_shedder.record("media_degraded")
+        for chunk in degraded_media_text([(msg_id, data, sender_info)], bot_username):
+            queue_send(owner_id, 'text', chunk, reply_markup=keyboard)
+        return
+    
+    try:
+        for content_type, content, caption in deleted_message_payload(msg_id, data, sender_info, bot_username):
+            if content_type == 'sticker':
+                future = queue_send(owner_id, 'sticker', content)
+            else:
+                future = queue_send(owner_id, content_type, content, caption=caption, reply_markup=keyboard)
+            if media_archive and data and data.file_unique_id and content_type == data.type:
+                future.add_done_callback(
+                    lambda f, content_type=content_type, caption=caption: restore_from_archive(
+                        f, owner_id, content_type, data.file_unique_id, caption, keyboard)
+                )
+        
+        if data:
+            log.debug("📤 Уведомление о удалении поставлено в очередь для владельца %s", owner_id)
+        
+    except Exception as e:
+        queue_send(owner_id, 'text', restore_error_text(data.type if data else 'text', e), reply_markup=keyboard)
+
+def degraded_media_text(items: list, bot_username: str) -> list:
+    """Текстовые уведомления вместо медиа удаленных сообщений, когда бот перегружен."""
+    lines = []
+    for msg_id, data, sender_info in items:
+        line = f"🗑️ <b>Удаленное {CONTENT_TYPES[data.type].name}</b> от {escape(sender_info)}"
+        if data.caption:
+            line += f"\nподпись: {escape(data.caption)}"
+        lines.append(line)
+    footer = "<i>⚠️ Бот перегружен, поэтому медиа не отправлено.</i>"
+    return split_text([*lines, footer], MESSAGE_TEXT_LIMIT, f"@{bot_username}")
+
+def restore_from_archive(future, owner_id: int, content_type: str, file_unique_id: str,
+                         caption: str, keyboard: types.InlineKeyboardMarkup):
+    """Если отправка по file_id не удалась, загружает файл заново из архива."""
+    error = future.exception()
+    if error is None or not media_archive.has(file_unique_id):
+        return
+    if load_shedder.degrade_media():
+        # Повторная загрузка файла — самая дорогая отправка, под нагрузкой ее пропускаем
+        load_shedder.record("archive_skipped")
+        log.warning("⚠️ Бот перегружен, %s не восстанавливается из архива", file_unique_id)
+        return
+    log.warning("⚠️ Отправка по file_id не удалась (%s), восстанавливаем %s из архива", error, file_unique_id)
+    
+    def send():
+        # Файл открывается только в момент отправки и закрывается сразу после нее
+        media = media_archive.open(file_unique_id)
+        if media is None:
+            raise FileNotFoundError(f"{file_unique_id} вытеснен из архива")
+        with media:
+            if content_type == 'sticker':
+                return send_content(owner_id, content_type, media)
+            return send_content(owner_id, content_type, media, caption, reply_markup=keyboard)
+    
+    outbox.submit(owner_id, send, method=CONTENT_TYPES[content_type].send_method)
+
+def send_deleted_digest(key: tuple, items: list):
+    """
+    Отправляет накопленные за окно удаления одной пачкой:
+    тексты — дайджестом, фото и видео — альбомами, остальное — по одному.
+    """
+    owner_id, chat_id = key
+    bot_username = bot_identity.username
+    keyboard = chat_keyboard(chat_id)
+    
+    if len(items) == 1:
+        restore_deleted_message(owner_id, *items[0], keyboard, bot_username)
+        return
+    
+    log.debug("📦 Отправка пачки из %s удаленных сообщений владельцу %s", len(items), owner_id)
+    
+    text_parts, media, singles = partition_deleted(items)
+    
+    if text_parts:
+        header = f"@{bot_username}\n\n🗑️ <b>Удалено сообщений: {len(text_parts)}</b>"
+        for chunk in split_text(text_parts, MESSAGE_TEXT_LIMIT, header):
+            queue_send(owner_id, 'text', chunk, reply_markup=keyboard)
     
-    print(f"📤 Отправка уведомления об редактировании владельцу {owner_id}")
-    safe_send(owner_id, 'text', notify_text, reply_markup=keyboard)
+    send_deleted_media(owner_id, media, singles, keyboard, bot_username)
+
+def partition_deleted(items: list) -> tuple:
+    """
+    Делит удаленные сообщения на строки текстового дайджеста, фото и видео
+    для альбомов и остальное, что отправляется по одному.
+    """
+    text_parts = []
+    media = []
+    singles = []
+    for msg_id, data, sender_info in items:
+        if not data:
+            text_parts.append(f"от {escape(sender_info)}: сообщение не сохранено (ОШИБКА: ЛОГИ), ID {msg_id}")
+        elif CONTENT_TYPES[data.type].is_text:
+            part = f"от {escape(sender_info)}:\n{escape(format_content_display(data.type, data.content))}"
+            if data.history:
+                part += f"\n{format_edit_history(data.history)}"
+            text_parts.append(part)
+        elif data.type in ['photo', 'video'] and not data.history:
+            media.append((msg_id, data, sender_info))
+        else:
+            singles.append((msg_id, data, sender_info))
+    return text_parts, media, singles
+
+def send_deleted_media(owner_id: int, media: list, singles: list, keyboard: types.InlineKeyboardMarkup,
+                       bot_username: str):
+    """Отправляет удаленные фото и видео альбомами, остальные медиа — по одному."""
+    if (media or singles) and load_shedder.degrade_media():
+        load_shedder.record("media_degraded", len(media) + len(singles))
+        for chunk in degraded_media_text(media + singles, bot_username):
+            queue_send(owner_id, 'text', chunk, reply_markup=keyboard)
+        return
+    
+    for i in range(0, len(media), MEDIA_GROUP_LIMIT):
+        group = media[i:i + MEDIA_GROUP_LIMIT]
+        if len(group) == 1:
+            restore_deleted_message(owner_id, *group[0], keyboard, bot_username)
+            continue
+        
+        album = []
+        for msg_id, data, sender_info in group:
+            album_caption = f"🗑️ от {escape(sender_info)}"
+            if data.caption:
+                album_caption += f"\nподпись: {escape(data.caption)}"
+            input_media = types.InputMediaPhoto if data.type == 'photo' else types.InputMediaVideo
+            album.append(input_media(data.content, caption=truncate_html(album_caption, CAPTION_LIMIT),
+                                     parse_mode='HTML'))
+        
+        future = outbox.submit(owner_id, lambda album=album: bot.send_media_group(owner_id, album),
+                               method='send_media_group')
+        future.add_done_callback(
+            lambda f, group=group: restore_album_items(f, owner_id, group, keyboard, bot_username)
+        )
+    
+    for item in singles:
+        restore_deleted_message(owner_id, *item, keyboard, bot_username)
+
+def restore_album_items(future, owner_id: int, group: list, keyboard: types.InlineKeyboardMarkup,
+                        bot_username: str):
+    """Если альбом не отправился, восстанавливает его элементы по одному."""
+    error = future.exception()
+    if error is None:
+        return
+    log.error("❌ Ошибка отправки альбома, отправляем по одному: %s", error)
+    for item in group:
+        restore_deleted_message(owner_id, *item, keyboard, bot_username)
+
+delete_coalescer = Coalescer(DELETE_COALESCE_WINDOW, send_deleted_digest)
+
+def send_owner_digest(owner_id: int, chats: dict):
+    """
+    Отправляет накопленные правки и удаления: одно сообщение на собеседника
+    (медиа удаленных сообщений — альбомами). Несколько правок одного сообщения
+    схлопываются в одну строку «было → стало».
+    """
+    bot_username = bot_identity.username
+    for chat_id, events in chats.items():
+        edits = {}
+        deleted = []
+        for kind, msg_id, *event in events:
+            if kind == 'delete':
+                deleted.append((msg_id, *event))
+                continue
+            sender_info, old_content, new_content, count = event
+            edit = edits.get(msg_id)
+            if edit is None:
+                edits[msg_id] = [sender_info, old_content, new_content, count, 1]
+            else:
+                edit[2], edit[3] = new_content, count
+                edit[4] += 1
+        
+        parts = []
+        for sender_info, old_content, new_content, count, merged in edits.values():
+            suffix = f" (правок: {merged})" if merged > 1 else ""
+            parts.append(
+                f"✏️ от {escape(sender_info)}{suffix}:\n"
+                f"<b>Было:</b> {escape(old_content)}\n<b>Стало:</b> {escape(new_content)}"
+            )
+        text_parts, media, singles = partition_deleted(deleted)
+        parts.extend(f"🗑️ {part}" for part in text_parts)
+        
+        keyboard = chat_keyboard(chat_id)
+        log.debug("📬 Дайджест владельцу %s по чату %s: правок %s, удалений %s",
+                  owner_id, chat_id, len(edits), len(deleted))
+        if parts:
+            header = (
+                f"@{bot_username}\n\n📬 <b>Дайджест</b>\n"
+                f"Правок: {len(edits)}, удалений: {len(deleted)}"
+            )
+            for chunk in split_text(parts, MESSAGE_TEXT_LIMIT, header):
+                queue_send(owner_id, 'text', chunk, reply_markup=keyboard)
+        send_deleted_media(owner_id, media, singles, keyboard, bot_username)
+
+digest_settings = DigestSettings(storage, default=DIGEST_DEFAULT_INTERVAL)
+digest_buffer = DigestBuffer(TimeWheel(), send_owner_digest, max_events=DIGEST_MAX_EVENTS)
+atexit.register(digest_buffer.flush_all)
 
 @bot.deleted_business_messages_handler()
+@track_update("deleted_business_messages")
 def handle_deleted_business_messages(deleted: telebot.types.BusinessMessagesDeleted):
     """Обрабатывает удаленные бизнес-сообщения."""
     owner_id = validate_business_connection(deleted.business_connection_id)
@@ -527,146 +1484,267 @@ def handle_deleted_business_messages(deleted: telebot.types.BusinessMessagesDele
     
     # Не уведомляем, если удаление в чате с владельцем
     if chat_id == owner_id:
-        print(f"⏩ Сообщение удалено владельцем {owner_id}, уведомление не отправляется")
+        log.debug("⏩ Сообщение удалено владельцем %s, уведомление не отправляется", owner_id)
         return
     
-    print(f"🔄 Обработка удаленных сообщений: чат {chat_id}, владелец {owner_id}")
+    log.debug("🔄 Обработка удаленных сообщений: чат %s, владелец %s", chat_id, owner_id)
     
-    keyboard = types.InlineKeyboardMarkup()
-    keyboard.add(types.InlineKeyboardButton(text="Перейти в чат", url=f"tg://user?id={chat_id}"))
+    items = pop_deleted_messages(chat_id, owner_id, deleted.message_ids)
     
-    for msg_id in deleted.message_ids:
-        data = messages_log.pop((chat_id, msg_id), None)
-        sender_data = message_senders.pop((chat_id, msg_id), {})
+    interval = digest_settings.get(owner_id)
+    if interval:
+        for item in items:
+            digest_buffer.add(owner_id, chat_id, ('delete', *item), interval)
+        return
+    
+    if DELETE_COALESCE:
+        for item in items:
+            delete_coalescer.add((owner_id, chat_id), item)
+        return
+    
+    keyboard = chat_keyboard(chat_id)
+    bot_username = bot_identity.username
+    for item in items:
+        restore_deleted_message(owner_id, *item, keyboard, bot_username)
+
+def pop_deleted_messages(chat_id: int, owner_id: int, message_ids: list) -> list:
+    """
+    Извлекает удаленные сообщения из хранилища.
+    Возвращает список (msg_id, data, sender_info) без сообщений самого владельца.
+    """
+    items = []
+    for msg_id in message_ids:
+        # Запись может отсутствовать, если сообщение было вытеснено из хранилища
+        data = message_store.pop(chat_id, msg_id)
+        live_stats.record_delete(data is not None)
         
-        sender_info = sender_data.get('info', "Неизвестный отправитель")
-        sender_user_id = sender_data.get('user_id')
+        sender_info = (data.sender_info if data else None) or "Неизвестный отправитель"
+        sender_user_id = data.sender_id if data else None
         
         # Пропускаем, если владелец удалил свое сообщение
         if sender_user_id == owner_id:
-            print(f"⏩ Сообщение удалено владельцем, пропускаем")
+            log.debug("⏩ Сообщение удалено владельцем, пропускаем")
             continue
         
-        if not data:
-            notify_text = (
-                f"🗑️ Сообщение удалено\n"
-                f"от: {sender_info}\n\n"
-                f"Сообщение не сохранено (ОШИБКА: ЛОГИ)\n"
-                f"📋 ID сообщения: {msg_id}\n\n"
-                f"@{bot.get_me().username}"
-            )
-            safe_send(owner_id, 'text', notify_text, reply_markup=keyboard)
-            continue
-        
-        content_type = data.get("type")
-        content = data.get("content")
-        caption = data.get("caption", "")
-        
-        print(f"🔄 Восстановление удаленного сообщения типа {content_type}")
-        
-        try:
-            config = CONTENT_TYPE_CONFIG.get(content_type)
-            if not config:
-                continue
-            
-            prefix = f"@{bot.get_me().username}\n\n🗑️ <b>Удаленное {config['name']}</b>\nот {sender_info}"
-            
-            if content_type == 'text':
-                restored_text = f"{prefix}:\n\n{content}"
-                safe_send(owner_id, 'text', restored_text, reply_markup=keyboard)
-            elif content_type == 'sticker':
-                safe_send(owner_id, 'text', f"{prefix}\n\n", reply_markup=keyboard)
-                bot.send_sticker(owner_id, content)
-            elif config['has_caption']:
-                full_caption = prefix
-                if caption:
-                    full_caption += f"\nподпись: {caption}"
-                safe_send(owner_id, content_type, content, caption=full_caption, reply_markup=keyboard)
-            else:
-                safe_send(owner_id, content_type, content, caption=prefix, reply_markup=keyboard)
-            
-            print(f"✅ Уведомление о удалении отправлено владельцу {owner_id}")
-            
-        except Exception as e:
-            error_text = (
-                f"❌ <b>Ошибка при восстановлении сообщения:</b>\n"
-                f"Тип: {content_type}\n"
-                f"Ошибка: {str(e)}"
-            )
-            safe_send(owner_id, 'text', error_text, reply_markup=keyboard)
+        items.append((msg_id, data, sender_info))
+    return items
 
 # --- Обычные команды ---
-@bot.message_handler(commands=['start', 'help'])
-def handle_start_help(message: telebot.types.Message):
-    active_chats.add(message.chat.id)
-    
+START_TEXT = (
+    "<b>🤖 Добро пожаловать! Этот бот создан для отслеживания удаленных сообщений.</b>\n\n"
+    "Функционал:\n"
+    "• Моментальные уведомления об удаленных сообщениях\n"
+    "(Голосовое, фото и пр.)\n"
+    "• Моментальные уведомления об ОТРЕДАКТИРОВАННЫХ сообщениях\n"
+    "• Дайджест вместо отдельных уведомлений — /digest\n\n"
+    "<i>💡Как подключить бота - смотрите на картинку выше!</i>"
+)
+INSTRUCTION_PHOTO = 'DLM_instruction.png'
+
+def register_start(chat_id: int):
+    """Пользователь запустил бота: чат возвращается в рассылку и сегменты аудитории."""
+    add_active_chat(chat_id)
+    dead_chats.revive(chat_id)
+    audience.mark_started(chat_id)
+    audience.touch(chat_id)
+
+def start_keyboard() -> types.InlineKeyboardMarkup:
     keyboard = types.InlineKeyboardMarkup()
     keyboard.add(types.InlineKeyboardButton(text="Перейти в канал", url="https://t.me/DLmgg"))
-    
-    safe_send(
-        message.chat.id,
-        'text',
-        "<b>🤖 Добро пожаловать! Этот бот создан для отслеживания удаленных сообщений.</b>\n\n"
-        "Функционал:\n"
-        "• Моментальные уведомления об удаленных сообщениях\n"
-        "(Голосовое, фото и пр.)\n"
-        "• Моментальные уведомления об ОТРЕДАКТИРОВАННЫХ сообщениях\n\n"
-        "<i>💡Как подключить бота - смотрите на картинку выше!</i>",
-        reply_markup=keyboard
-    )
-    
-    try:
-        with open('DLM_instruction.png', 'rb') as photo:
-            bot.send_photo(message.chat.id, photo, caption="Инструкция по подключению")
-    except FileNotFoundError:
-        print("❌ Файл с инструкцией не найден")
-    except Exception as e:
-        print(f"❌ Ошибка при отправке фото: {e}")
+    return keyboard
 
-if __name__ == "__main__":
-    print("🚀 Бот запущен и ждёт сообщений...")
-    print(f"📊 Текущая статистика:")
-    print(f"   Активных чатов: {len(active_chats)}")
-    print(f"   Бизнес-соединений: {len(business_connection_owners)}")
+@bot.message_handler(commands=['start', 'help'])
+@track_update("message")
+def handle_start_help(message: telebot.types.Message):
+    register_start(message.chat.id)
     
+    # Обработчик не ждет отправки: outbox сохраняет порядок сообщений в чате,
+    # а поток диспетчера сразу освобождается для других обновлений
+    queue_send(message.chat.id, 'text', START_TEXT, reply_markup=start_keyboard())
+    future = send_asset(message.chat.id, INSTRUCTION_PHOTO, 'photo', "Инструкция по подключению")
+    future.add_done_callback(log_instruction_result)
+
+def log_instruction_result(future):
+    error = future.exception()
+    if isinstance(error, FileNotFoundError):
+        log.error("❌ Файл с инструкцией не найден")
+    elif error is not None:
+        log.error("❌ Ошибка при отправке фото: %s", error)
+
+def run_polling():
+    """
+    Получение обновлений через long polling с перезапуском при ошибках.
+    Offset берется из update_filter и переживает переподключения и перезапуски.
+    """
     while True:
         try:
-            bot_info = bot.get_me()
-            print(f"✅ Бот авторизован: @{bot_info.username}")
+            bot_info = bot_identity.refresh()
+            log.info("✅ Бот авторизован: @%s", bot_info.username)
             
-            bot.polling(
-                none_stop=True,
-                interval=1,
-                timeout=60,
-                allowed_updates=[
-                    "message", 
-                    "callback_query", 
-                    "business_connection",
-                    "business_message", 
-                    "edited_business_message", 
-                    "deleted_business_messages"
-                ]
-            )
+            while True:
+                updates = telebot.apihelper.get_updates(
+                    TELEGRAM_TOKEN,
+                    offset=update_filter.offset,
+                    timeout=60,
+                    allowed_updates=ALLOWED_UPDATES,
+                    long_polling_timeout=60
+                )
+                if updates:
+                    ingest_updates(updates)
             
         except telebot.apihelper.ApiTelegramException as e:
-            print(f"❌ Ошибка Telegram API: {e}")
+            log.error("❌ Ошибка Telegram API: %s", e)
             if "Forbidden" in str(e):
-                print("⚠️ Бот заблокирован пользователем")
-            print("🔄 Переподключение через 10 секунд...")
+                log.warning("⚠️ Бот заблокирован пользователем")
+            log.info("🔄 Переподключение через 10 секунд...")
             time.sleep(10)
             
         except requests.exceptions.Timeout:
-            print("⏱️ Таймаут соединения, переподключение...")
+            log.warning("⏱️ Таймаут соединения, переподключение...")
             time.sleep(5)
             
         except ConnectionError as e:
-            print(f"❌ Ошибка подключения: {e}")
-            print("🔄 Переподключение через 15 секунд...")
+            log.error("❌ Ошибка подключения: %s", e)
+            log.info("🔄 Переподключение через 15 секунд...")
             time.sleep(15)
             
         except Exception as e:
-            print(f"❌ Неизвестная ошибка: {type(e).__name__}: {e}")
-            print("Трассировка ошибки:")
-            traceback.print_exc()
-            print("🔄 Перезапуск через 20 секунд...")
+            log.exception("❌ Неизвестная ошибка: %s: %s", type(e).__name__, e)
+            log.info("🔄 Перезапуск через 20 секунд...")
             time.sleep(20)
+
+def run_webhook(dispatch=None):
+    """
+    Получение обновлений через собственный HTTP-сервер вебхуков.
+    dispatch(payload) — необязательный обработчик сырых обновлений (см. sharding.py).
+    """
+    bot_info = bot_identity.refresh()
+    log.info("✅ Бот авторизован: @%s", bot_info.username)
+    
+    # Без WEBHOOK_URL вебхук не регистрируется — удобно для локальной проверки
+    if WEBHOOK_URL:
+        bot.remove_webhook()
+        bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=ALLOWED_UPDATES
+        )
+        log.info("✅ Вебхук зарегистрирован: %s%s", WEBHOOK_URL.rstrip('/'), WEBHOOK_PATH)
+    
+    server = WebhookServer(
+        bot,
+        WEBHOOK_LISTEN,
+        WEBHOOK_PORT,
+        path=WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET or None,
+        workers=WEBHOOK_WORKERS,
+        dispatch=dispatch or (lambda payload: ingest_updates([payload]))
+    )
+    server.serve_forever()
+
+# --- Метрики ---
+GaugeCallback(
+    "bot_store_messages", "Сообщений в хранилище",
+    lambda: message_store.stats()['messages']
+)
+GaugeCallback(
+    "bot_store_bytes", "Примерный объем хранилища в памяти, байт",
+    lambda: message_store.stats()['bytes']
+)
+def store_evictions() -> dict:
+    stats = message_store.stats()
+    return {(reason,): stats[reason] for reason in ('evicted_global', 'evicted_connection', 'expired')}
+
+GaugeCallback(
+    "bot_store_evictions", "Вытеснено записей из хранилища по причине",
+    store_evictions, labels=("reason",)
+)
+GaugeCallback(
+    "bot_outbox_queue_depth", "Сообщений в очереди отправки",
+    lambda: outbox.metrics()['queue_depth']
+)
+GaugeCallback("bot_active_chats", "Активных чатов", lambda: len(active_chats))
+GaugeCallback("bot_updates_duplicates", "Отброшено повторных обновлений", lambda: update_filter.duplicates)
+GaugeCallback("bot_updates_held", "Обновлений, ждущих оригинал сообщения", lambda: len(reorder_buffer))
+GaugeCallback("bot_dispatch_pending", "Обновлений в очереди обработчиков", lambda: dispatcher.stats()['pending'])
+GaugeCallback("bot_digest_pending", "Событий, ожидающих отправки дайджестом", lambda: len(digest_buffer))
+GaugeCallback("bot_dead_chats", "Недоступных чатов, исключенных из рассылки", lambda: len(dead_chats))
+GaugeCallback("bot_load_level", "Уровень деградации под нагрузкой (0 — норма, 3 — перегрузка)",
+              load_shedder.level)
+GaugeCallback(
+    "bot_queue_saturation", "Доля заполнения ограниченных очередей",
+    lambda: {(queue,): value for queue, value in load_shedder.saturation().items()},
+    labels=("queue",)
+)
+GaugeCallback(
+    "bot_shed_total", "Сработавшие политики сброса нагрузки",
+    lambda: {(policy,): count for policy, count in health()['shed'].items()},
+    labels=("policy",)
+)
+if media_archive:
+    GaugeCallback(
+        "bot_media_archive_bytes", "Объем архива медиафайлов на диске, байт",
+        lambda: media_archive.stats()['bytes']
+    )
+
+def probe_chat(chat_id: int):
+    """Проверка доступности чата: send_chat_action не оставляет сообщений в чате."""
+    try:
+        result = bot.send_chat_action(chat_id, 'typing')
+    except Exception as e:
+        dead_chats.handle_result(chat_id, e)
+        raise
+    dead_chats.handle_result(chat_id)
+    return result
+
+def recheck_dead_chats():
+    """Фоновая перепроверка недоступных чатов с низким приоритетом outbox."""
+    while True:
+        time.sleep(min(DEAD_CHAT_RECHECK_INTERVAL, 3600))
+        due = dead_chats.due_for_recheck()
+        if due:
+            log.info("🔎 Перепроверка недоступных чатов: %s", len(due))
+        for chat_id in due:
+            outbox.submit(chat_id, lambda chat_id=chat_id: probe_chat(chat_id),
+                          PRIORITY_BROADCAST, method="send_chat_action")
+
+def start_dead_chat_recheck():
+    """Запускает перепроверку недоступных чатов, если она включена в конфигурации."""
+    if DEAD_CHAT_RECHECK_INTERVAL <= 0:
+        return None
+    thread = threading.Thread(target=recheck_dead_chats, name="dead-chat-recheck", daemon=True)
+    thread.start()
+    return thread
+
+def health() -> dict:
+    """Отчет для /healthz: уровень деградации, заполнение очередей и сброшенная нагрузка."""
+    report = load_shedder.health()
+    shed = report['shed']
+    shed['outbox_rejected'] = outbox.shed
+    shed['alerts_dropped'] = outbox.shed_alerts
+    shed['dispatch_throttled'] = dispatcher.throttled
+    return report
+
+def start_metrics_server():
+    """Запускает эндпоинты /metrics и /healthz, если они включены в конфигурации."""
+    if not METRICS_PORT:
+        return None
+    server = MetricsServer(METRICS_HOST, METRICS_PORT, health=health).start()
+    log.info("📈 Метрики доступны на http://%s:%s/metrics, состояние — /healthz", METRICS_HOST, METRICS_PORT)
+    return server
+
+if __name__ == "__main__":
+    log.info("🚀 Бот запущен и ждёт сообщений...")
+    log.info("📊 Текущая статистика:")
+    log.info("   Активных чатов: %s", len(active_chats))
+    log.info("   Бизнес-соединений: %s", len(owner_cache))
+    log.info("   Недоступных чатов: %s", len(dead_chats))
+    
+    start_metrics_server()
+    start_dead_chat_recheck()
+    resume_broadcasts()
+    
+    if RUN_MODE == "webhook":
+        run_webhook()
+    else:
+        run_polling()
@@ -0,0 +1,154 @@
+"""
+Локальный архив медиафайлов из бизнес-сообщений.
+
+Файлы скачиваются фоновыми потоками и хранятся по file_unique_id, поэтому
+одно и то же фото из разных сообщений лежит на диске один раз. При
+превышении квоты удаляются файлы, к которым дольше всего не обращались.
+Если file_id устарел, удаленное сообщение восстанавливается из архива.
+"""
+import logging
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+class MediaArchive:
+    """
+    Архив с квотой quota_bytes и LRU-вытеснением.
+    fetch(file_id) должен возвращать итератор по кускам содержимого файла (bytes).
+    """
+
+    def __init__(self, root: str, fetch, quota_bytes: int, max_file_size: int = 20 * 1024 * 1024,
+                 workers: int = 2, queue_size: int = 10000):
+        self.root = root
+        self.fetch = fetch
+        self.quota_bytes = quota_bytes
+        self.max_file_size = max_file_size
+        self.bytes_used = 0
+        self.downloaded = 0
+        self.dropped = 0
+        self.failed = 0
+        self._files = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+
+        os.makedirs(root, exist_ok=True)
+        self._load_index()
+
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"media-archive-{i}", daemon=True).start()
+
+    def _path(self, file_unique_id: str) -> str:
+        # Раскладываем по подкаталогам, чтобы не держать все файлы в одном
+        return os.path.join(self.root, file_unique_id[-2:], file_unique_id)
+
+    def _load_index(self):
+        """Восстанавливает индекс с диска; порядок LRU — по времени последнего доступа."""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if name.endswith(".part"):
+                    os.remove(path)
+                    continue
+                stat = os.stat(path)
+                entries.append((stat.st_atime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._files[name] = size
+            self.bytes_used += size
+        self._evict()
+
+    def _evict(self):
+        while self.bytes_used > self.quota_bytes and self._files:
+            file_unique_id, size = self._files.popitem(last=False)
+            self.bytes_used -= size
+            try:
+                os.remove(self._path(file_unique_id))
+            except OSError as e:
+                log.warning("⚠️ Не удалось удалить %s из архива: %s", file_unique_id, e)
+
+    def submit(self, file_id: str, file_unique_id: str, file_size: int = None):
+        """Ставит файл в очередь на скачивание. Не блокирует: при переполнении файл пропускается."""
+        if not file_unique_id or (file_size and file_size > self.max_file_size):
+            return
+        with self._lock:
+            if file_unique_id in self._files or file_unique_id in self._pending:
+                return
+            self._pending.add(file_unique_id)
+        try:
+            self._queue.put_nowait((file_id, file_unique_id))
+        except queue.Full:
+            with self._lock:
+                self._pending.discard(file_unique_id)
+                self.dropped += 1
+
+    def _worker(self):
+        while True:
+            file_id, file_unique_id = self._queue.get()
+            try:
+                self._download(file_id, file_unique_id)
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                log.warning("⚠️ Не удалось сохранить медиа %s в архив: %s", file_unique_id, e)
+            finally:
+                with self._lock:
+                    self._pending.discard(file_unique_id)
+
+    def _download(self, file_id: str, file_unique_id: str):
+        path = self._path(file_unique_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = path + ".part"
+        size = 0
+        try:
+            with open(partial, "wb") as f:
+                for chunk in self.fetch(file_id):
+                    size += len(chunk)
+                    if size > self.max_file_size:
+                        raise ValueError(f"файл больше {self.max_file_size} байт")
+                    f.write(chunk)
+            os.replace(partial, path)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+
+        with self._lock:
+            self._files[file_unique_id] = size
+            self.bytes_used += size
+            self.downloaded += 1
+            self._evict()
+        log.debug("💾 Медиа %s сохранено в архив (%s байт)", file_unique_id, size)
+
+    def has(self, file_unique_id: str) -> bool:
+        with self._lock:
+            return file_unique_id in self._files
+
+    def open(self, file_unique_id: str):
+        """Открывает файл из архива для чтения или возвращает None. Файл становится самым свежим в LRU."""
+        with self._lock:
+            if file_unique_id not in self._files:
+                return None
+            self._files.move_to_end(file_unique_id)
+            path = self._path(file_unique_id)
+            try:
+                os.utime(path)
+                return open(path, "rb")
+            except OSError:
+                self.bytes_used -= self._files.pop(file_unique_id)
+                return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'files': len(self._files),
+                'bytes': self.bytes_used,
+                'pending': len(self._pending),
+                'downloaded': self.downloaded,
+                'dropped': self.dropped,
+                'failed': self.failed,
+            }
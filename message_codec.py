@@ -0,0 +1,219 @@
+"""
+Компактное представление записей MessageStore в памяти.
+
+Запись упаковывается в один объект bytes: фиксированный заголовок (время,
+отправитель, коды соединения, подписи отправителя и типа, флаги, длины полей)
+и затем содержимое, подпись, file_unique_id и история правок. chat_id и
+message_id в запись не входят — они и так есть в ключе хранилища.
+
+Повторяющиеся строки (business_connection_id, описание отправителя, тип)
+хранятся один раз в таблицах символов, запись держит только их коды. Тексты
+длиннее порога сжимаются zlib с общим словарем: короткие сообщения чата без
+словаря почти не сжимаются. История правок хранится как сжатый JSON.
+"""
+import struct
+import sys
+import threading
+import zlib
+
+from edit_history import EditHistory
+
+# stored_at, sender_id, код соединения, код отправителя, код типа, флаги,
+# длина file_unique_id, длина подписи, длина содержимого
+HEADER = struct.Struct("<dqIIBBBHI")
+
+CONTENT_ZLIB = 1
+CAPTION_ZLIB = 2
+HAS_SENDER_ID = 4
+NO_CONTENT = 8
+
+# Окно 2 КБ и memLevel 4: словарь помещается в окно, а инициализация
+# компрессора для короткого текста в несколько раз дешевле, чем с окном 32 КБ
+WBITS = -11
+MEM_LEVEL = 4
+
+# Общий словарь для сжатия коротких текстов: частые слова и сочетания чатов.
+# zlib ищет совпадения с конца словаря, поэтому самые частые фрагменты — в конце
+ZDICT = (
+    "https://t.me/ http://www. .com .ru "
+    "thanks please sorry today tomorrow yesterday tonight morning evening "
+    "what where when why how ok okay yes no maybe sure good great "
+    "I'm you're it's don't can't will would could should have has had "
+    "the and that this with for you are not but was what your "
+    "спасибо пожалуйста извини извините сегодня завтра вчера вечером утром "
+    "привет здравствуйте добрый день доброе утро хорошо отлично конечно "
+    "когда где почему зачем сколько который можно нужно будет было были "
+    "сейчас потом тоже только уже еще очень просто может надо давай "
+    "что это как так все вот если или есть нет да не на по за из от до "
+    "я ты мы вы он она они мне тебе вам нам меня тебя его ее их "
+).encode()
+
+
+class SymbolTable:
+    """Строки с подсчетом ссылок: запись хранит код, строка хранится один раз."""
+
+    __slots__ = ('_codes', '_values', '_refs', '_free', 'bytes_used')
+
+    def __init__(self):
+        self._codes = {}
+        # Код 0 зарезервирован за None
+        self._values = [None]
+        self._refs = [0]
+        self._free = []
+        self.bytes_used = 0
+
+    def __len__(self) -> int:
+        return len(self._codes)
+
+    def __getitem__(self, code: int):
+        return self._values[code]
+
+    def acquire(self, value) -> int:
+        if value is None:
+            return 0
+        code = self._codes.get(value)
+        if code is None:
+            if self._free:
+                code = self._free.pop()
+                self._values[code] = value
+                self._refs[code] = 0
+            else:
+                code = len(self._values)
+                self._values.append(value)
+                self._refs.append(0)
+            self._codes[value] = code
+            self.bytes_used += sys.getsizeof(value)
+        self._refs[code] += 1
+        return code
+
+    def release(self, code: int):
+        if not code:
+            return
+        self._refs[code] -= 1
+        if self._refs[code] == 0:
+            value = self._values[code]
+            del self._codes[value]
+            self._values[code] = None
+            self._free.append(code)
+            self.bytes_used -= sys.getsizeof(value)
+
+
+class MessageCodec:
+    """
+    Упаковка записи (StoredMessage) в bytes и обратно.
+    compress_threshold — минимальная длина текста в байтах для сжатия (0 — не сжимать).
+    """
+
+    def __init__(self, compress_threshold: int = 48, level: int = 6, zdict: bytes = ZDICT):
+        self.compress_threshold = compress_threshold
+        self.level = level
+        self.zdict = zdict
+        self.connections = SymbolTable()
+        self.senders = SymbolTable()
+        self.types = SymbolTable()
+        self._lock = threading.Lock()
+
+    # --- Тексты ---
+
+    def _pack_text(self, text: str) -> tuple:
+        """(bytes, сжат ли текст)."""
+        data = text.encode("utf-8")
+        if not self.compress_threshold or len(data) < self.compress_threshold:
+            return data, False
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, WBITS, MEM_LEVEL, zdict=self.zdict)
+        packed = compressor.compress(data) + compressor.flush()
+        if len(packed) >= len(data):
+            return data, False
+        return packed, True
+
+    def _unpack_text(self, data: bytes, compressed: bool) -> str:
+        if compressed:
+            decompressor = zlib.decompressobj(WBITS, zdict=self.zdict)
+            data = decompressor.decompress(data) + decompressor.flush()
+        return data.decode("utf-8")
+
+    # --- Записи ---
+
+    def encode(self, record) -> bytes:
+        """Упаковывает запись; коды строк захватываются до release()."""
+        flags = 0
+        if record.content is None:
+            content, flags = b"", NO_CONTENT
+        else:
+            content, compressed = self._pack_text(record.content)
+            if compressed:
+                flags |= CONTENT_ZLIB
+        caption = b""
+        if record.caption:
+            caption, compressed = self._pack_text(record.caption)
+            if compressed:
+                flags |= CAPTION_ZLIB
+        if record.sender_id is not None:
+            flags |= HAS_SENDER_ID
+        file_unique_id = record.file_unique_id.encode() if record.file_unique_id else b""
+        history = b""
+        if record.history is not None:
+            history = zlib.compress(record.history.to_json().encode("utf-8"), self.level)
+
+        with self._lock:
+            header = HEADER.pack(
+                record.stored_at,
+                record.sender_id or 0,
+                self.connections.acquire(record.business_connection_id),
+                self.senders.acquire(record.sender_info),
+                self.types.acquire(record.type),
+                flags,
+                len(file_unique_id),
+                len(caption),
+                len(content),
+            )
+        return b"".join((header, content, caption, file_unique_id, history))
+
+    def decode(self, blob: bytes) -> tuple:
+        """Поля записи в порядке аргументов StoredMessage."""
+        (stored_at, sender_id, connection, sender, type_code, flags,
+         unique_len, caption_len, content_len) = HEADER.unpack_from(blob)
+        with self._lock:
+            business_connection_id = self.connections[connection]
+            sender_info = self.senders[sender]
+            content_type = self.types[type_code]
+
+        position = HEADER.size
+        content = None
+        if not flags & NO_CONTENT:
+            content = self._unpack_text(blob[position:position + content_len], flags & CONTENT_ZLIB)
+        position += content_len
+        caption = self._unpack_text(blob[position:position + caption_len], flags & CAPTION_ZLIB)
+        position += caption_len
+        file_unique_id = blob[position:position + unique_len].decode() or None
+        position += unique_len
+        history = None
+        if position < len(blob):
+            history = EditHistory.from_json(zlib.decompress(blob[position:]).decode("utf-8"))
+
+        return (
+            content_type, content, caption, business_connection_id, sender_info,
+            sender_id if flags & HAS_SENDER_ID else None, stored_at, file_unique_id, history
+        )
+
+    def release(self, blob: bytes):
+        """Освобождает коды строк удаленной записи."""
+        _, _, connection, sender, type_code = HEADER.unpack_from(blob)[:5]
+        with self._lock:
+            self.connections.release(connection)
+            self.senders.release(sender)
+            self.types.release(type_code)
+
+    @staticmethod
+    def stored_at(blob: bytes) -> float:
+        return HEADER.unpack_from(blob)[0]
+
+    def connection(self, blob: bytes) -> str:
+        code = HEADER.unpack_from(blob)[2]
+        with self._lock:
+            return self.connections[code]
+
+    def shared_bytes(self) -> int:
+        """Объем строк в таблицах символов."""
+        with self._lock:
+            return self.connections.bytes_used + self.senders.bytes_used + self.types.bytes_used
@@ -0,0 +1,216 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from edit_history import EditHistory
+from message_codec import MessageCodec
+
+
+class StoredMessage:
+    """Компактная запись о залогированном сообщении (данные + отправитель)."""
+
+    __slots__ = (
+        'type',
+        'content',
+        'caption',
+        'business_connection_id',
+        'sender_info',
+        'sender_id',
+        'stored_at',
+        'file_unique_id',
+        'history',
+    )
+
+    def __init__(self, type: str, content, caption: str = "",
+                 business_connection_id: str = None,
+                 sender_info: str = None, sender_id: int = None,
+                 stored_at: float = None, file_unique_id: str = None,
+                 history: EditHistory = None):
+        self.type = type
+        self.content = content
+        self.caption = caption or ""
+        self.business_connection_id = business_connection_id
+        self.sender_info = sender_info
+        self.sender_id = sender_id
+        self.stored_at = stored_at if stored_at is not None else time.time()
+        self.file_unique_id = file_unique_id
+        # История правок (EditHistory) или None, если сообщение не редактировалось
+        self.history = history
+
+    @classmethod
+    def from_data(cls, data: dict, sender_info: str = None, sender_id: int = None):
+        """Создает запись из словаря, который возвращает extract_message_data."""
+        return cls(
+            data['type'],
+            data['content'],
+            data.get('caption', ""),
+            data.get('business_connection_id'),
+            sender_info,
+            sender_id,
+            file_unique_id=data.get('file_unique_id'),
+        )
+
+    def size(self) -> int:
+        """Примерный объем памяти, занимаемый записью, в байтах."""
+        total = sys.getsizeof(self)
+        for name in ('content', 'caption', 'sender_info', 'file_unique_id'):
+            value = getattr(self, name)
+            if value:
+                total += sys.getsizeof(value)
+        if self.history is not None:
+            total += self.history.size()
+        return total
+
+
+class MessageStore:
+    """
+    Хранилище сообщений с глобальным лимитом, лимитом на бизнес-соединение
+    и вытеснением по LRU/TTL. Ключ записи — (chat_id, message_id).
+    Записи хранятся упакованными (см. message_codec) и распаковываются в
+    StoredMessage при чтении; внутренний ключ — одно целое число из
+    (chat_id, message_id) вместо кортежа.
+    Если передан backend, записи дублируются в него, а промахи по памяти
+    дочитываются из бэкенда (например, после перезапуска процесса).
+    """
+
+    def __init__(self, max_messages: int = 200_000, max_per_connection: int = 20_000,
+                 ttl: float = 7 * 24 * 3600, backend=None, codec: MessageCodec = None):
+        self.max_messages = max_messages
+        self.max_per_connection = max_per_connection
+        self.ttl = ttl
+        self.backend = backend
+        self.codec = codec or MessageCodec()
+
+        self._items = OrderedDict()
+        self._by_connection = {}
+        self._lock = threading.Lock()
+
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted_global = 0
+        self.evicted_connection = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    @staticmethod
+    def _key(chat_id: int, message_id: int) -> int:
+        # message_id в Telegram меньше 2**32, поэтому ключ однозначен и для отрицательных chat_id
+        return (chat_id << 32) | message_id
+
+    def put(self, chat_id: int, message_id: int, record: StoredMessage):
+        """Сохраняет (или заменяет) запись и вытесняет лишнее."""
+        self._insert(self._key(chat_id, message_id), record)
+        if self.backend is not None:
+            self.backend.save_message(chat_id, message_id, record)
+
+    def _insert(self, key, record: StoredMessage):
+        # Сжатие выполняется вне блокировки хранилища
+        blob = self.codec.encode(record)
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+
+            self._items[key] = blob
+            self.bytes_used += sys.getsizeof(blob)
+            conn_keys = self._by_connection.setdefault(record.business_connection_id, OrderedDict())
+            conn_keys[key] = None
+
+            while len(conn_keys) > self.max_per_connection:
+                oldest, _ = conn_keys.popitem(last=False)
+                self._remove(oldest)
+                self.evicted_connection += 1
+
+            self._expire()
+            while len(self._items) > self.max_messages:
+                oldest = next(iter(self._items))
+                self._remove(oldest)
+                self.evicted_global += 1
+
+    def get(self, chat_id: int, message_id: int) -> StoredMessage:
+        """Возвращает запись или None, если она не сохранена или устарела."""
+        key = self._key(chat_id, message_id)
+        with self._lock:
+            blob = self._lookup(key)
+            if blob is not None:
+                record = StoredMessage(*self.codec.decode(blob))
+                self._items.move_to_end(key)
+                self._by_connection[record.business_connection_id].move_to_end(key)
+                return record
+
+        if self.backend is None:
+            return None
+        record = self.backend.load_message(chat_id, message_id)
+        if record is not None:
+            self._insert(key, record)
+        return record
+
+    def pop(self, chat_id: int, message_id: int) -> StoredMessage:
+        """Извлекает запись из хранилища (используется при удалении сообщения)."""
+        key = self._key(chat_id, message_id)
+        record = None
+        with self._lock:
+            blob = self._lookup(key)
+            if blob is not None:
+                record = StoredMessage(*self.codec.decode(blob))
+                self._remove(key)
+
+        if self.backend is not None:
+            if record is None:
+                record = self.backend.load_message(chat_id, message_id)
+            self.backend.delete_message(chat_id, message_id)
+        return record
+
+    def stats(self) -> dict:
+        """Счетчики заполненности, попаданий и вытеснений."""
+        with self._lock:
+            return {
+                'messages': len(self._items),
+                'connections': len(self._by_connection),
+                'bytes': self.bytes_used + self.codec.shared_bytes(),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evicted_global': self.evicted_global,
+                'evicted_connection': self.evicted_connection,
+                'expired': self.expired,
+            }
+
+    def _lookup(self, key) -> bytes:
+        blob = self._items.get(key)
+        if blob is None:
+            self.misses += 1
+            return None
+        if self.ttl and time.time() - self.codec.stored_at(blob) > self.ttl:
+            self._remove(key)
+            self.expired += 1
+            self.misses += 1
+            return None
+        self.hits += 1
+        return blob
+
+    def _remove(self, key):
+        blob = self._items.pop(key)
+        self.bytes_used -= sys.getsizeof(blob)
+        connection = self.codec.connection(blob)
+        conn_keys = self._by_connection.get(connection)
+        if conn_keys is not None:
+            conn_keys.pop(key, None)
+            if not conn_keys:
+                del self._by_connection[connection]
+        self.codec.release(blob)
+
+    def _expire(self):
+        """Удаляет устаревшие записи с начала LRU-очереди."""
+        if not self.ttl:
+            return
+        deadline = time.time() - self.ttl
+        stored_at = self.codec.stored_at
+        while self._items:
+            key = next(iter(self._items))
+            if stored_at(self._items[key]) > deadline:
+                break
+            self._remove(key)
+            self.expired += 1
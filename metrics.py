@@ -0,0 +1,221 @@
+"""
+Метрики в формате Prometheus и HTTP-эндпоинт для их сбора.
+
+Счетчики и гистограммы обновляются под короткой блокировкой без
+форматирования строк, поэтому на горячем пути стоят почти ничего.
+"""
+import bisect
+import functools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Границы гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+    """Набор метрик, которые отдаются эндпоинтом /metrics."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            try:
+                lines.extend(metric.samples())
+            except Exception as e:
+                lines.append(f"# ошибка сбора {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def samples(self) -> list:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_labels(self.label_names, key)} {value}" for key, value in items]
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS,
+                 registry: Registry = REGISTRY):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # [счетчики по корзинам (+Inf последняя), сумма, количество]
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def percentile(self, q: float, *label_values) -> float:
+        """Оценка перцентиля по корзинам (верхняя граница корзины)."""
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None or not series[2]:
+                return 0.0
+            counts, _, total = series[0][:], series[1], series[2]
+        threshold = q * total
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            if cumulative >= threshold:
+                return bound
+        return float("inf")
+
+    def samples(self) -> list:
+        with self._lock:
+            items = [(key, (counts[:], total_sum, count)) for key, (counts, total_sum, count) in self._series.items()]
+        lines = []
+        for key, (counts, total_sum, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {total_sum}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class GaugeCallback:
+    """Значение считывается функцией в момент сбора: число или {значения меток: число}."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, func, labels: tuple = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.label_names = labels
+        registry.register(self)
+
+    def samples(self) -> list:
+        value = self.func()
+        if isinstance(value, dict):
+            return [f"{self.name}{_labels(self.label_names, key)} {v}" for key, v in value.items()]
+        return [f"{self.name} {value}"]
+
+
+# --- Метрики бота ---
+UPDATES = Counter("bot_updates_total", "Полученные обновления по типу", ("type",))
+HANDLER_LATENCY = Histogram("bot_handler_seconds", "Время работы обработчиков", ("type",))
+SENDS = Counter("bot_sends_total", "Запросы на отправку по методу и результату", ("method", "outcome"))
+SEND_LATENCY = Histogram("bot_send_seconds", "Время запроса к API на отправку", ("method",))
+SEND_RETRIES = Counter("bot_send_retries_total", "Повторные попытки отправки")
+FLOOD_WAITS = Counter("bot_flood_waits_total", "Ответы 429 (flood control)")
+
+
+def track_update(update_type: str):
+    """Декоратор обработчика: считает обновления и время обработки."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            UPDATES.inc(update_type)
+            started = time.perf_counter()
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                HANDLER_LATENCY.observe(time.perf_counter() - started, update_type)
+        return wrapper
+    return decorator
+
+
+class MetricsServer:
+    """
+    HTTP-эндпоинты /metrics и /healthz в отдельном потоке.
+    health() возвращает словарь с ключом status; при status == "overloaded"
+    /healthz отвечает 503, чтобы балансировщик или оркестратор видели насыщение.
+    """
+
+    def __init__(self, host: str, port: int, registry: Registry = REGISTRY, health=None):
+        self.registry = registry
+        self.health = health
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                if path == "/healthz" and server.health is not None:
+                    report = server.health()
+                    status = 503 if report.get('status') == "overloaded" else 200
+                    self._reply(status, json.dumps(report, ensure_ascii=False).encode(),
+                                "application/json; charset=utf-8")
+                    return
+                if path != "/metrics":
+                    self.send_error(404)
+                    return
+                self._reply(200, server.registry.render().encode(), "text/plain; version=0.0.4; charset=utf-8")
+
+            def _reply(self, status: int, body: bytes, content_type: str):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name="metrics", daemon=True).start()
+        return self
+
+    def shutdown(self):
+        self.httpd.shutdown()
@@ -0,0 +1,283 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from backpressure import Overloaded
+from delivery import classify_error, is_retryable
+from metrics import FLOOD_WAITS, SEND_LATENCY, SEND_RETRIES, SENDS
+from ratelimit import TokenBucket, get_retry_after
+
+log = logging.getLogger(__name__)
+
+# Приоритеты исходящих сообщений: чем меньше число, тем раньше отправка
+PRIORITY_ALERT = 0
+PRIORITY_BROADCAST = 1
+PRIORITIES = (PRIORITY_ALERT, PRIORITY_BROADCAST)
+
+
+class OutboundTask:
+    """Одна исходящая отправка в очереди чата."""
+
+    __slots__ = ('chat_id', 'priority', 'func', 'method', 'future', 'enqueued_at', 'attempts', 'not_before')
+
+    def __init__(self, chat_id: int, priority: int, func, method: str = "send"):
+        self.chat_id = chat_id
+        self.priority = priority
+        self.func = func
+        self.method = method
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+        self.not_before = 0.0
+
+
+class _ChatQueue:
+    """Очереди одного чата (по приоритетам) и его ограничение скорости."""
+
+    __slots__ = ('queues', 'next_allowed', 'in_flight', 'version')
+
+    def __init__(self):
+        self.queues = tuple(deque() for _ in PRIORITIES)
+        self.next_allowed = 0.0
+        self.in_flight = False
+        self.version = 0
+
+    def head(self) -> OutboundTask:
+        for q in self.queues:
+            if q:
+                return q[0]
+        return None
+
+
+class Outbox:
+    """
+    Центральный планировщик исходящих сообщений.
+
+    У каждого чата своя FIFO-очередь, поэтому порядок сообщений в чате
+    сохраняется; в чат одновременно уходит не больше одного сообщения и не
+    чаще раза в chat_interval секунд. Уведомления (PRIORITY_ALERT) обгоняют
+    рассылку (PRIORITY_BROADCAST). Повторы после ошибок и 429 не блокируют
+    потоки: задача просто откладывается до нужного момента.
+    Если в очередях уже max_depth задач (0 — без ограничения), новые
+    отправки сразу завершаются исключением Overloaded.
+    """
+
+    def __init__(self, limiter: TokenBucket, chat_interval: float = 1.0, workers: int = 8,
+                 max_attempts: int = 3, latency_window: int = 1000, max_depth: int = 0):
+        self.limiter = limiter
+        self.chat_interval = chat_interval
+        self.max_attempts = max_attempts
+        self.max_depth = max_depth
+
+        self._chats = {}
+        self._idle = deque()
+        self._ready = tuple([] for _ in PRIORITIES)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="outbox")
+
+        self._depth = [0 for _ in PRIORITIES]
+        self._in_flight = 0
+        self._latencies = deque(maxlen=latency_window)
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.flood_waits = 0
+        self.shed = 0
+        self.shed_alerts = 0
+
+        self._scheduler = threading.Thread(target=self._schedule_loop, name="outbox-scheduler", daemon=True)
+        self._scheduler.start()
+
+    def submit(self, chat_id: int, func, priority: int = PRIORITY_ALERT, method: str = "send") -> Future:
+        """
+        Ставит отправку в очередь чата. func() выполняет запрос к API,
+        method — имя метода API для метрик.
+        Возвращает Future с результатом func или исключением последней попытки.
+        """
+        task = OutboundTask(chat_id, priority, func, method)
+        with self._cond:
+            if self.max_depth and sum(self._depth) >= self.max_depth:
+                SENDS.inc(method, "shed")
+                self.shed += 1
+                if priority == PRIORITY_ALERT:
+                    # Future уведомлений никто не ждет — без записи в лог потеря незаметна
+                    self.shed_alerts += 1
+                    log.warning("🚫 Очередь отправки заполнена (%s), уведомление в чат %s отброшено",
+                                self.max_depth, chat_id)
+                task.future.set_exception(Overloaded(f"очередь отправки заполнена ({self.max_depth})"))
+                return task.future
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                chat = self._chats[chat_id] = _ChatQueue()
+            chat.queues[priority].append(task)
+            self._depth[priority] += 1
+            if not chat.in_flight and chat.head() is task:
+                self._push_ready(chat_id, chat)
+            self._cond.notify()
+        return task.future
+
+    def depth(self) -> int:
+        """Число задач в очередях (без выполняющихся)."""
+        with self._cond:
+            return sum(self._depth)
+
+    def metrics(self) -> dict:
+        """Глубина очередей, число отправок и задержка от постановки в очередь до отправки."""
+        with self._cond:
+            latencies = sorted(self._latencies)
+            return {
+                'queue_depth': sum(self._depth),
+                'queue_depth_alert': self._depth[PRIORITY_ALERT],
+                'queue_depth_broadcast': self._depth[PRIORITY_BROADCAST],
+                'in_flight': self._in_flight,
+                'chats': len(self._chats),
+                'sent': self.sent,
+                'failed': self.failed,
+                'retries': self.retries,
+                'flood_waits': self.flood_waits,
+                'shed': self.shed,
+                'shed_alerts': self.shed_alerts,
+                'latency_p50': _percentile(latencies, 0.5),
+                'latency_p99': _percentile(latencies, 0.99),
+            }
+
+    # --- Планировщик ---
+
+    def _push_ready(self, chat_id: int, chat: _ChatQueue):
+        """Помещает чат в очередь готовности по приоритету его первой задачи."""
+        task = chat.head()
+        chat.version += 1
+        ready_at = max(chat.next_allowed, task.not_before)
+        heapq.heappush(self._ready[task.priority], (ready_at, next(self._seq), chat_id, chat.version))
+
+    def _next_ready(self, now: float):
+        """Возвращает (chat_id, 0) для готового чата или (None, сколько ждать)."""
+        wait = None
+        for heap in self._ready:
+            while heap:
+                ready_at, _, chat_id, version = heap[0]
+                chat = self._chats.get(chat_id)
+                if chat is None or chat.version != version or chat.in_flight:
+                    heapq.heappop(heap)
+                    continue
+                if ready_at <= now:
+                    return chat_id, 0
+                wait = ready_at - now if wait is None else min(wait, ready_at - now)
+                break
+        return None, wait
+
+    def _forget_idle(self, now: float):
+        """Удаляет опустевшие чаты, у которых истек интервал между сообщениями."""
+        while self._idle and self._idle[0][0] <= now:
+            _, chat_id = self._idle.popleft()
+            chat = self._chats.get(chat_id)
+            if chat is not None and not chat.in_flight and chat.head() is None \
+                    and chat.next_allowed <= now:
+                del self._chats[chat_id]
+
+    def _schedule_loop(self):
+        while True:
+            with self._cond:
+                self._forget_idle(time.monotonic())
+                chat_id, wait = self._next_ready(time.monotonic())
+                if chat_id is None:
+                    self._cond.wait(wait)
+                    continue
+
+                token_wait = self.limiter.try_acquire()
+                if token_wait:
+                    self._cond.wait(token_wait)
+                    continue
+
+                heapq.heappop(self._ready[self._chats[chat_id].head().priority])
+                chat = self._chats[chat_id]
+                task = chat.head()
+                chat.queues[task.priority].popleft()
+                self._depth[task.priority] -= 1
+                chat.in_flight = True
+                self._in_flight += 1
+
+            self._executor.submit(self._execute, chat, task)
+
+    def _execute(self, chat: _ChatQueue, task: OutboundTask):
+        task.attempts += 1
+        started = time.perf_counter()
+        try:
+            result = task.func()
+            error = None
+        except Exception as e:
+            result = None
+            error = e
+        SEND_LATENCY.observe(time.perf_counter() - started, task.method)
+
+        now = time.monotonic()
+        finished = False
+        with self._cond:
+            chat.in_flight = False
+            self._in_flight -= 1
+            chat.next_allowed = now + self.chat_interval
+
+            if error is None:
+                SENDS.inc(task.method, "ok")
+                self.sent += 1
+                self._latencies.append(now - task.enqueued_at)
+                finished = True
+            else:
+                retry_after = get_retry_after(error)
+                if retry_after is not None:
+                    # Flood control: откладываем чат, попытка не засчитывается
+                    SENDS.inc(task.method, "flood")
+                    FLOOD_WAITS.inc()
+                    self.flood_waits += 1
+                    task.attempts -= 1
+                    task.not_before = now + retry_after
+                    self._requeue(chat, task)
+                elif task.attempts < self.max_attempts and is_retryable(error):
+                    SENDS.inc(task.method, "retry")
+                    SEND_RETRIES.inc()
+                    self.retries += 1
+                    log.warning("⚠️ Ошибка отправки в чат %s, попытка %s/%s: %s",
+                                task.chat_id, task.attempts, self.max_attempts, error)
+                    task.not_before = now + 2 ** (task.attempts - 1)
+                    self._requeue(chat, task)
+                elif not is_retryable(error):
+                    # Бот заблокирован, чат удален, неверный запрос — повтор не поможет
+                    SENDS.inc(task.method, "rejected")
+                    self.failed += 1
+                    log.warning("🚫 Отправка в чат %s отклонена (%s): %s",
+                                task.chat_id, classify_error(error), error)
+                    finished = True
+                else:
+                    SENDS.inc(task.method, "failed")
+                    self.failed += 1
+                    log.error("❌ Не удалось отправить в чат %s после %s попыток: %s",
+                              task.chat_id, task.attempts, error)
+                    finished = True
+
+            if chat.head() is not None:
+                self._push_ready(task.chat_id, chat)
+            else:
+                self._idle.append((chat.next_allowed, task.chat_id))
+            self._cond.notify()
+
+        # Результат выставляем вне блокировки: колбэки Future могут ставить новые задачи
+        if finished:
+            if error is None:
+                task.future.set_result(result)
+            else:
+                task.future.set_exception(error)
+
+    def _requeue(self, chat: _ChatQueue, task: OutboundTask):
+        chat.queues[task.priority].appendleft(task)
+        self._depth[task.priority] += 1
+
+
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
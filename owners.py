@@ -0,0 +1,97 @@
+import threading
+import time
+from concurrent.futures import Future
+
+
+class OwnerCache:
+    """
+    Кэш владельцев бизнес-соединений (business_connection_id -> owner_id).
+
+    Загружается из хранилища при запуске. Одновременные запросы одного и того же
+    неизвестного соединения объединяются в один вызов API, а соединения, запрос
+    которых завершился ошибкой, запоминаются на negative_ttl секунд.
+    """
+
+    def __init__(self, backend, negative_ttl: float = 300):
+        self.backend = backend
+        self.negative_ttl = negative_ttl
+        self._owners = backend.load_owners()
+        self._failed = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._owners)
+
+    def get(self, business_connection_id: str) -> int:
+        return self._owners.get(business_connection_id)
+
+    def register(self, business_connection_id: str, owner_id: int) -> bool:
+        """Запоминает владельца и сохраняет его в хранилище. Возвращает True, если запись изменилась."""
+        with self._lock:
+            self._failed.pop(business_connection_id, None)
+            if self._owners.get(business_connection_id) == owner_id:
+                return False
+            self._owners[business_connection_id] = owner_id
+        self.backend.save_owner(business_connection_id, owner_id)
+        return True
+
+    def evict(self, business_connection_id: str) -> bool:
+        """Удаляет соединение из кэша и хранилища (например, после отключения бота)."""
+        with self._lock:
+            removed = self._owners.pop(business_connection_id, None) is not None
+        if removed:
+            self.backend.delete_owner(business_connection_id)
+        return removed
+
+    def is_failed(self, business_connection_id: str) -> bool:
+        """True, если недавний запрос этого соединения завершился ошибкой."""
+        expires = self._failed.get(business_connection_id)
+        if expires is None:
+            return False
+        if time.monotonic() < expires:
+            return True
+        with self._lock:
+            if self._failed.get(business_connection_id) == expires:
+                del self._failed[business_connection_id]
+        return False
+
+    def mark_failed(self, business_connection_id: str):
+        with self._lock:
+            self._failed[business_connection_id] = time.monotonic() + self.negative_ttl
+
+    def resolve(self, business_connection_id: str, fetch) -> int:
+        """
+        Возвращает владельца из кэша или через fetch(business_connection_id) -> owner_id.
+        Пока запрос выполняется, остальные потоки ждут его результата, а не шлют свой.
+        Ошибка fetch пробрасывается только вызвавшему его потоку; остальные получают None.
+        """
+        owner_id = self._owners.get(business_connection_id)
+        if owner_id is not None:
+            return owner_id
+        if self.is_failed(business_connection_id):
+            return None
+
+        with self._lock:
+            owner_id = self._owners.get(business_connection_id)
+            if owner_id is not None:
+                return owner_id
+            future = self._inflight.get(business_connection_id)
+            leader = future is None
+            if leader:
+                future = self._inflight[business_connection_id] = Future()
+
+        if not leader:
+            return future.result()
+
+        try:
+            owner_id = fetch(business_connection_id)
+        except Exception:
+            self.mark_failed(business_connection_id)
+            owner_id = None
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[business_connection_id]
+            future.set_result(owner_id)
+        return owner_id
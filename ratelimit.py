@@ -0,0 +1,56 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Потокобезопасный лимитер «ведро токенов».
+    rate — токенов в секунду, capacity — максимальный размер всплеска.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> float:
+        """Пытается взять токен. Возвращает 0, если удалось, иначе сколько секунд ждать."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """Блокирует поток, пока не появится свободный токен."""
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Приостанавливает выдачу токенов (например, по retry_after из ответа 429)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+
+def get_retry_after(error: Exception) -> float:
+    """Возвращает retry_after из ошибки 429 Telegram API или None для прочих ошибок."""
+    if getattr(error, 'error_code', None) != 429:
+        return None
+    result_json = getattr(error, 'result_json', None) or {}
+    parameters = result_json.get('parameters') or {}
+    return parameters.get('retry_after', 1)
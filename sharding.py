@@ -0,0 +1,287 @@
+"""
+Шардированный запуск бота на несколько процессов.
+
+Процесс-координатор получает обновления (long polling или вебхук) и
+распределяет бизнес-обновления по SHARDS процессам-воркерам по хэшу
+business_connection_id (или chat.id, если соединения нет). Все обновления
+одного соединения попадают в один и тот же воркер, поэтому у каждого воркера
+своя часть хранилища сообщений и кэша владельцев. Команды администратора,
+callback-кнопки и рассылки обрабатывает сам координатор.
+
+Общие между процессами данные (владельцы и активные чаты) живут в SQLite,
+поэтому для шардов нужен STORAGE_BACKEND=sqlite.
+
+Запуск: SHARDS=4 STORAGE_BACKEND=sqlite python sharding.py
+"""
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import zlib
+
+import telebot
+
+log = logging.getLogger(__name__)
+
+SHARDS = int(os.getenv("SHARDS", str(os.cpu_count() or 1)))
+# Размер очереди обновлений одного воркера: при заполнении координатор ждет
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", "10000"))
+# Сколько обновлений воркер передает обработчикам за один вызов
+SHARD_BATCH = int(os.getenv("SHARD_BATCH", "100"))
+# Как часто воркер публикует свою статистику для /stats координатора (сек)
+SHARD_STATS_INTERVAL = float(os.getenv("SHARD_STATS_INTERVAL", "10"))
+STATS_KEY = "stats:shard:"
+
+# Доля глобального лимита отправок, которая остается координатору для рассылок
+SHARD_BROADCAST_SHARE = float(os.getenv("SHARD_BROADCAST_SHARE", "0.5"))
+
+# Ключ служебных сообщений координатора в очереди воркера
+CONTROL = "_control"
+
+# Типы обновлений, которые уходят в воркеры
+BUSINESS_UPDATES = (
+    "business_connection",
+    "business_message",
+    "edited_business_message",
+    "deleted_business_messages",
+)
+
+
+def shard_key(update: dict):
+    """Ключ шардирования обновления или None, если его обрабатывает координатор."""
+    for kind in BUSINESS_UPDATES:
+        payload = update.get(kind)
+        if payload is None:
+            continue
+        if kind == "business_connection":
+            return payload.get("id")
+        return payload.get("business_connection_id") or payload["chat"]["id"]
+    return None
+
+
+def shard_for(key, shards: int) -> int:
+    """Номер воркера для ключа. crc32 не зависит от PYTHONHASHSEED и одинаков во всех процессах."""
+    return zlib.crc32(str(key).encode()) % shards
+
+
+def _publish_stats(core, index: int):
+    """Периодически сохраняет снимок счетчиков воркера в общее хранилище."""
+    while True:
+        time.sleep(SHARD_STATS_INTERVAL)
+        try:
+            snapshot = core.stats_snapshot()
+            snapshot['published_at'] = time.time()
+            core.storage.save_state(STATS_KEY + str(index), json.dumps(snapshot))
+        except Exception as e:
+            log.error("❌ Воркер %s: ошибка публикации статистики: %s", index, e)
+
+
+def load_shard_stats(core, shards: int) -> list:
+    """Снимки статистики воркеров; устаревшие (воркер не отвечает) пропускаются."""
+    snapshots = []
+    for index in range(shards):
+        value = core.storage.load_state(STATS_KEY + str(index))
+        if not value:
+            continue
+        snapshot = json.loads(value)
+        if time.time() - snapshot.pop('published_at', 0) <= SHARD_STATS_INTERVAL * 6:
+            snapshots.append(snapshot)
+    return snapshots
+
+
+def _handle_control(core, payload: dict):
+    """Команда координатора воркеру (не обновление Telegram)."""
+    if payload[CONTROL] == "digest_changed":
+        # Новый режим приходит в команде: запись координатора в хранилище может еще не завершиться
+        core.digest_changed(payload["owner_id"], payload["interval"])
+
+
+def _run_worker(index: int, updates, done, env: dict):
+    """Точка входа процесса-воркера."""
+    # Конфигурация main.py читается при импорте, поэтому окружение задается до него
+    os.environ.update(env)
+    import main as core
+
+    # Offset сохраняет координатор: сообщаем ему о завершенных обновлениях
+    core.mark_update_done = done.put
+
+    core.start_metrics_server()
+    threading.Thread(target=_publish_stats, args=(core, index), name="shard-stats", daemon=True).start()
+    log.info("🧩 Воркер %s запущен (pid %s)", index, os.getpid())
+
+    while True:
+        payload = updates.get()
+        batch = []
+        while payload is not None:
+            if CONTROL in payload:
+                _handle_control(core, payload)
+            else:
+                batch.append(payload)
+            if len(batch) >= SHARD_BATCH:
+                break
+            try:
+                payload = updates.get_nowait()
+            except queue.Empty:
+                break
+
+        if batch:
+            try:
+                # Повторы отсеяны координатором; порядок правок восстанавливается здесь,
+                # где хранится оригинал сообщения
+                core.reorder_buffer.submit(batch)
+            except Exception as e:
+                log.exception("❌ Воркер %s: ошибка обработки обновлений: %s", index, e)
+
+        if payload is None:
+            core.dispatcher.drain(timeout=10)
+            core.storage.close()
+            return
+
+
+class ShardRouter:
+    """Координатор: запускает воркеры и раздает им обновления."""
+
+    def __init__(self, core, shards: int, queue_size: int = SHARD_QUEUE_SIZE):
+        self.core = core
+        self.shards = shards
+        self._context = multiprocessing.get_context("spawn")
+        self.queues = [self._context.Queue(maxsize=queue_size) for _ in range(shards)]
+        self.done = self._context.Queue()
+        self.processes = [None] * shards
+        self._stopping = threading.Event()
+
+    def _worker_env(self, index: int) -> dict:
+        # Telegram ограничивает отправки на весь токен, поэтому лимит делится между процессами
+        worker_rate = self.core.SEND_RATE * (1 - SHARD_BROADCAST_SHARE) / self.shards
+        metrics_port = self.core.METRICS_PORT + 1 + index if self.core.METRICS_PORT else 0
+        return {
+            "SEND_RATE": str(worker_rate),
+            "METRICS_PORT": str(metrics_port),
+        }
+
+    def _spawn(self, index: int):
+        process = self._context.Process(
+            target=_run_worker,
+            args=(index, self.queues[index], self.done, self._worker_env(index)),
+            name=f"shard-{index}",
+            daemon=True
+        )
+        process.start()
+        self.processes[index] = process
+
+    def start(self):
+        for index in range(self.shards):
+            self._spawn(index)
+        threading.Thread(target=self._watch, name="shard-watch", daemon=True).start()
+        threading.Thread(target=self._collect_done, name="shard-done", daemon=True).start()
+        return self
+
+    def _collect_done(self):
+        """Передает update_id, обработанные воркерами, в update_filter координатора."""
+        while True:
+            self.core.update_filter.done(self.done.get())
+
+    def _watch(self):
+        """Перезапускает упавшие воркеры; их очереди при этом сохраняются."""
+        while not self._stopping.wait(1):
+            for index, process in enumerate(self.processes):
+                if not process.is_alive():
+                    log.error("❌ Воркер %s завершился с кодом %s, перезапуск",
+                              index, process.exitcode)
+                    self._spawn(index)
+
+    def dispatch(self, update: dict):
+        key = shard_key(update)
+        if key is None:
+            self.core.process_updates([update])
+            return
+        self.queues[shard_for(key, self.shards)].put(update)
+
+    def control(self, command: str, **fields):
+        """Отправляет служебную команду всем воркерам."""
+        payload = {CONTROL: command, **fields}
+        for updates in self.queues:
+            updates.put(payload)
+
+    def stop(self):
+        self._stopping.set()
+        for updates in self.queues:
+            updates.put(None)
+        for process in self.processes:
+            process.join(timeout=10)
+
+
+def route(router: ShardRouter, updates: list) -> list:
+    """
+    Отсеивает повторы и передает обновления роутеру. Offset сохраняется до
+    самого раннего обновления, которое воркеры еще не обработали.
+    """
+    update_filter = router.core.update_filter
+    fresh = update_filter.accept(updates)
+    for update in fresh:
+        router.dispatch(update)
+    update_filter.commit()
+    return fresh
+
+
+def poll(router: ShardRouter):
+    """Long polling в координаторе: сырые обновления передаются роутеру без разбора."""
+    core = router.core
+    while True:
+        try:
+            updates = telebot.apihelper.get_updates(
+                core.TELEGRAM_TOKEN,
+                offset=core.update_filter.offset,
+                timeout=60,
+                allowed_updates=core.ALLOWED_UPDATES,
+                long_polling_timeout=60
+            )
+            if updates:
+                route(router, updates)
+        except Exception as e:
+            log.error("❌ Ошибка получения обновлений: %s: %s", type(e).__name__, e)
+            log.info("🔄 Переподключение через 10 секунд...")
+            time.sleep(10)
+
+
+def main():
+    import main as core
+    from ratelimit import TokenBucket
+
+    if core.STORAGE_BACKEND != "sqlite":
+        raise SystemExit("Для шардированного запуска нужен STORAGE_BACKEND=sqlite")
+
+    # Координатору остается своя доля лимита для рассылок и ответов администратору
+    core.outbox.limiter = TokenBucket(core.SEND_RATE * SHARD_BROADCAST_SHARE)
+
+    bot_info = core.bot_identity.refresh()
+    log.info("✅ Бот авторизован: @%s", bot_info.username)
+    log.info("🚀 Координатор запущен, воркеров: %s", SHARDS)
+
+    router = ShardRouter(core, SHARDS).start()
+    # /digest обрабатывает координатор, а события владельца копятся в воркерах
+    local_digest_changed = core.digest_changed
+
+    def digest_changed(owner_id: int, interval: float):
+        local_digest_changed(owner_id, interval)
+        router.control("digest_changed", owner_id=owner_id, interval=interval)
+    core.digest_changed = digest_changed
+    # Сообщения, правки и удаления считаются в воркерах: /stats складывает их снимки
+    core.shard_stats = lambda: load_shard_stats(core, SHARDS)
+    core.start_metrics_server()
+    core.start_dead_chat_recheck()
+    core.resume_broadcasts()
+    try:
+        if core.RUN_MODE == "webhook":
+            core.run_webhook(dispatch=lambda update: route(router, [update]))
+        else:
+            poll(router)
+    finally:
+        router.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Живая статистика для администратора.
+
+Все показатели обновляются инкрементально в обработчиках, поэтому отчет
+строится за время, не зависящее от числа сохраненных сообщений: скользящие
+окна хранят фиксированное число корзин, а по соединениям хранятся только
+счетчики.
+"""
+import heapq
+import threading
+import time
+
+
+class RollingCounter:
+    """Сумма событий за последние window секунд с точностью до одной корзины."""
+
+    __slots__ = ('bucket_seconds', '_counts', '_stamps')
+
+    def __init__(self, window: float = 3600, buckets: int = 60):
+        self.bucket_seconds = window / buckets
+        self._counts = [0] * buckets
+        # Номер интервала, которому сейчас принадлежит корзина
+        self._stamps = [-1] * buckets
+
+    def add(self, amount: int = 1, now: float = None):
+        slot = int((time.time() if now is None else now) // self.bucket_seconds)
+        index = slot % len(self._counts)
+        if self._stamps[index] != slot:
+            self._stamps[index] = slot
+            self._counts[index] = 0
+        self._counts[index] += amount
+
+    def total(self, now: float = None) -> int:
+        slot = int((time.time() if now is None else now) // self.bucket_seconds)
+        oldest = slot - len(self._counts)
+        return sum(count for count, stamp in zip(self._counts, self._stamps) if stamp > oldest)
+
+
+class _ConnectionStats:
+    __slots__ = ('messages', 'last_hour')
+
+    def __init__(self):
+        self.messages = 0
+        self.last_hour = RollingCounter()
+
+
+class LiveStats:
+    """Счетчики залогированных сообщений, правок и удалений."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.messages = 0
+        self.edits = 0
+        self.edits_found = 0
+        self.deletes = 0
+        self.deletes_found = 0
+        self.messages_hour = RollingCounter()
+        self.edits_hour = RollingCounter()
+        self.deletes_hour = RollingCounter()
+        self.deletes_found_hour = RollingCounter()
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def record_message(self, business_connection_id: str):
+        with self._lock:
+            self.messages += 1
+            self.messages_hour.add()
+            connection = self._connections.get(business_connection_id)
+            if connection is None:
+                connection = self._connections[business_connection_id] = _ConnectionStats()
+            connection.messages += 1
+            connection.last_hour.add()
+
+    def record_edit(self, found: bool):
+        """Правка сообщения; found — была ли в хранилище предыдущая версия."""
+        with self._lock:
+            self.edits += 1
+            self.edits_found += found
+            self.edits_hour.add()
+
+    def record_delete(self, found: bool):
+        """Удаление сообщения; found — было ли сообщение в хранилище."""
+        with self._lock:
+            self.deletes += 1
+            self.deletes_found += found
+            self.deletes_hour.add()
+            if found:
+                self.deletes_found_hour.add()
+
+    def forget_connection(self, business_connection_id: str):
+        with self._lock:
+            self._connections.pop(business_connection_id, None)
+
+    def snapshot(self, top: int = 5) -> dict:
+        with self._lock:
+            busiest = heapq.nlargest(
+                top, self._connections.items(), key=lambda item: item[1].last_hour.total()
+            )
+            return {
+                'uptime': time.time() - self.started_at,
+                'messages': self.messages,
+                'messages_hour': self.messages_hour.total(),
+                'edits': self.edits,
+                'edits_found': self.edits_found,
+                'edits_hour': self.edits_hour.total(),
+                'deletes': self.deletes,
+                'deletes_found': self.deletes_found,
+                'deletes_hour': self.deletes_hour.total(),
+                'deletes_found_hour': self.deletes_found_hour.total(),
+                'connections': len(self._connections),
+                'top_connections': [
+                    (connection_id, stats.messages, stats.last_hour.total())
+                    for connection_id, stats in busiest
+                ],
+            }
+
+
+# Показатели, которые при объединении процессов не складываются
+_MERGE_MAX = ('uptime', 'latency_p50', 'latency_p99')
+
+
+def merge_snapshots(snapshots: list, top: int = 5) -> dict:
+    """
+    Объединяет снимки статистики нескольких процессов (координатора и
+    воркеров шардов): счетчики складываются, задержки и время работы берутся
+    максимальные, самые активные соединения выбираются из общего списка.
+    """
+    merged = {}
+    connections = []
+    for snapshot in snapshots:
+        for key, value in snapshot.items():
+            if key == 'top_connections':
+                connections.extend(value)
+            elif key in _MERGE_MAX:
+                merged[key] = max(merged.get(key, 0), value)
+            else:
+                merged[key] = merged.get(key, 0) + value
+    if connections or any('top_connections' in snapshot for snapshot in snapshots):
+        # Соединения распределены по шардам без пересечений, поэтому общий топ —
+        # это лучшие из топов отдельных процессов
+        merged['top_connections'] = heapq.nlargest(top, connections, key=lambda item: item[2])
+    return merged
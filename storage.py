@@ -0,0 +1,339 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+from edit_history import EditHistory
+from message_store import StoredMessage
+
+log = logging.getLogger(__name__)
+
+
+class MemoryStorage:
+    """Бэкенд без сохранения на диск: все данные живут только в памяти процесса."""
+
+    def load_owners(self) -> dict:
+        return {}
+
+    def load_active_chats(self) -> set:
+        return set()
+
+    def save_owner(self, business_connection_id: str, owner_id: int):
+        pass
+
+    def delete_owner(self, business_connection_id: str):
+        pass
+
+    def save_active_chat(self, chat_id: int):
+        pass
+
+    def load_audience(self) -> list:
+        return []
+
+    def save_audience(self, chat_id: int, is_owner: bool, started: bool, last_seen: float):
+        pass
+
+    def load_dead_chats(self) -> dict:
+        return {}
+
+    def save_dead_chat(self, chat_id: int, reason: str, marked_at: float, checked_at: float):
+        pass
+
+    def delete_dead_chat(self, chat_id: int):
+        pass
+
+    def load_state(self, key: str) -> str:
+        return None
+
+    def save_state(self, key: str, value: str):
+        pass
+
+    def save_message(self, chat_id: int, message_id: int, record: StoredMessage):
+        pass
+
+    def load_message(self, chat_id: int, message_id: int) -> StoredMessage:
+        return None
+
+    def delete_message(self, chat_id: int, message_id: int):
+        pass
+
+    def pending(self) -> int:
+        """Число изменений, ожидающих записи."""
+        return 0
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteStorage(MemoryStorage):
+    """
+    Локальный бэкенд на SQLite в режиме WAL.
+    Запись идет через очередь и фоновый поток, который фиксирует изменения
+    пачками, поэтому обработчики не ждут fsync на каждое сообщение.
+    Очередь ограничена max_queue изменениями (0 — без ограничения): если диск
+    не успевает, обработчики ждут, а не накапливают изменения в памяти.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS messages ("
+        " chat_id INTEGER NOT NULL,"
+        " message_id INTEGER NOT NULL,"
+        " type TEXT NOT NULL,"
+        " content TEXT,"
+        " caption TEXT,"
+        " business_connection_id TEXT,"
+        " sender_info TEXT,"
+        " sender_id INTEGER,"
+        " stored_at REAL NOT NULL,"
+        " file_unique_id TEXT,"
+        " history TEXT,"
+        " PRIMARY KEY (chat_id, message_id))",
+        "CREATE INDEX IF NOT EXISTS messages_stored_at ON messages (stored_at)",
+        "CREATE TABLE IF NOT EXISTS owners ("
+        " business_connection_id TEXT PRIMARY KEY,"
+        " owner_id INTEGER NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS active_chats ("
+        " chat_id INTEGER PRIMARY KEY,"
+        " is_owner INTEGER NOT NULL DEFAULT 0,"
+        " started INTEGER NOT NULL DEFAULT 0,"
+        " last_seen REAL)",
+        "CREATE TABLE IF NOT EXISTS dead_chats ("
+        " chat_id INTEGER PRIMARY KEY,"
+        " reason TEXT NOT NULL,"
+        " marked_at REAL NOT NULL,"
+        " checked_at REAL NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS state ("
+        " key TEXT PRIMARY KEY,"
+        " value TEXT NOT NULL)",
+    )
+
+    # Колонки, добавленные после первой версии схемы: (таблица, имя, тип)
+    MIGRATIONS = (
+        ("messages", "file_unique_id", "TEXT"),
+        ("messages", "history", "TEXT"),
+        ("active_chats", "is_owner", "INTEGER NOT NULL DEFAULT 0"),
+        ("active_chats", "started", "INTEGER NOT NULL DEFAULT 0"),
+        ("active_chats", "last_seen", "REAL"),
+    )
+
+    SAVE_MESSAGE = "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    DELETE_MESSAGE = "DELETE FROM messages WHERE chat_id = ? AND message_id = ?"
+    SAVE_OWNER = "INSERT OR REPLACE INTO owners VALUES (?, ?)"
+    DELETE_OWNER = "DELETE FROM owners WHERE business_connection_id = ?"
+    SAVE_ACTIVE_CHAT = "INSERT OR IGNORE INTO active_chats (chat_id) VALUES (?)"
+    # Флаги и время активности только накапливаются: процессы-шарды знают каждый свою
+    # часть сегментов и не должны затирать чужие значения своими
+    SAVE_AUDIENCE = (
+        "INSERT INTO active_chats (chat_id, is_owner, started, last_seen) VALUES (?, ?, ?, ?)"
+        " ON CONFLICT (chat_id) DO UPDATE SET"
+        " is_owner = MAX(active_chats.is_owner, excluded.is_owner),"
+        " started = MAX(active_chats.started, excluded.started),"
+        " last_seen = NULLIF(MAX(COALESCE(active_chats.last_seen, 0), COALESCE(excluded.last_seen, 0)), 0)"
+    )
+    SAVE_DEAD_CHAT = "INSERT OR REPLACE INTO dead_chats VALUES (?, ?, ?, ?)"
+    DELETE_DEAD_CHAT = "DELETE FROM dead_chats WHERE chat_id = ?"
+    SAVE_STATE = "INSERT OR REPLACE INTO state VALUES (?, ?)"
+
+    def __init__(self, path: str, batch_size: int = 500, flush_interval: float = 0.2,
+                 retention: float = None, prune_interval: float = 600, max_queue: int = 0):
+        self.path = path
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self.prune_interval = prune_interval
+
+        self._reader = self._connect()
+        self._reader_lock = threading.Lock()
+        with self._reader:
+            for statement in self.SCHEMA:
+                self._reader.execute(statement)
+            for table, name, column_type in self.MIGRATIONS:
+                columns = {row[1] for row in self._reader.execute(f"PRAGMA table_info({table})")}
+                if name not in columns:
+                    self._reader.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._writer = threading.Thread(target=self._write_loop, name="sqlite-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # --- Чтение (выполняется в потоке обработчика) ---
+
+    def load_owners(self) -> dict:
+        with self._reader_lock:
+            return dict(self._reader.execute("SELECT business_connection_id, owner_id FROM owners"))
+
+    def load_active_chats(self) -> set:
+        with self._reader_lock:
+            return {row[0] for row in self._reader.execute("SELECT chat_id FROM active_chats")}
+
+    def load_audience(self) -> list:
+        with self._reader_lock:
+            return self._reader.execute(
+                "SELECT chat_id, is_owner, started, last_seen FROM active_chats"
+                " WHERE is_owner OR started OR last_seen IS NOT NULL"
+            ).fetchall()
+
+    def load_dead_chats(self) -> dict:
+        with self._reader_lock:
+            return {
+                row[0]: list(row[1:])
+                for row in self._reader.execute("SELECT chat_id, reason, marked_at, checked_at FROM dead_chats")
+            }
+
+    def load_state(self, key: str) -> str:
+        with self._reader_lock:
+            row = self._reader.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def load_message(self, chat_id: int, message_id: int) -> StoredMessage:
+        with self._reader_lock:
+            row = self._reader.execute(
+                "SELECT type, content, caption, business_connection_id, sender_info, sender_id, stored_at,"
+                " file_unique_id, history FROM messages WHERE chat_id = ? AND message_id = ?",
+                (chat_id, message_id)
+            ).fetchone()
+        if row is None:
+            return None
+        if self.retention and time.time() - row[6] > self.retention:
+            return None
+        return StoredMessage(*row[:8], history=EditHistory.from_json(row[8]))
+
+    # --- Запись (ставится в очередь фонового потока) ---
+
+    def save_owner(self, business_connection_id: str, owner_id: int):
+        self._queue.put((self.SAVE_OWNER, (business_connection_id, owner_id)))
+
+    def delete_owner(self, business_connection_id: str):
+        self._queue.put((self.DELETE_OWNER, (business_connection_id,)))
+
+    def save_active_chat(self, chat_id: int):
+        self._queue.put((self.SAVE_ACTIVE_CHAT, (chat_id,)))
+
+    def save_audience(self, chat_id: int, is_owner: bool, started: bool, last_seen: float):
+        self._queue.put((self.SAVE_AUDIENCE, (chat_id, int(is_owner), int(started), last_seen)))
+
+    def save_dead_chat(self, chat_id: int, reason: str, marked_at: float, checked_at: float):
+        self._queue.put((self.SAVE_DEAD_CHAT, (chat_id, reason, marked_at, checked_at)))
+
+    def delete_dead_chat(self, chat_id: int):
+        self._queue.put((self.DELETE_DEAD_CHAT, (chat_id,)))
+
+    def save_state(self, key: str, value: str):
+        self._queue.put((self.SAVE_STATE, (key, value)))
+
+    def save_message(self, chat_id: int, message_id: int, record: StoredMessage):
+        self._queue.put((self.SAVE_MESSAGE, (
+            chat_id, message_id, record.type, record.content, record.caption,
+            record.business_connection_id, record.sender_info, record.sender_id,
+            record.stored_at, record.file_unique_id,
+            record.history.to_json() if record.history is not None else None
+        )))
+
+    def delete_message(self, chat_id: int, message_id: int):
+        self._queue.put((self.DELETE_MESSAGE, (chat_id, message_id)))
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def flush(self):
+        """Блокирует до тех пор, пока все поставленные в очередь записи не будут зафиксированы."""
+        done = threading.Event()
+        self._queue.put((None, done))
+        done.wait()
+
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._writer.join()
+        with self._reader_lock:
+            self._reader.close()
+
+    def _write_loop(self):
+        conn = self._connect()
+        last_prune = time.monotonic()
+
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            # Собираем все, что успело накопиться, в одну транзакцию
+            deadline = time.monotonic() + self.flush_interval
+            while item is not None and len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(item)
+
+            waiters = [op[1] for op in batch if op is not None and op[0] is None]
+            writes = [op for op in batch if op is not None and op[0] is not None]
+            try:
+                self._write_batch(conn, writes)
+
+                if self.retention and time.monotonic() - last_prune > self.prune_interval:
+                    last_prune = time.monotonic()
+                    try:
+                        with conn:
+                            conn.execute("DELETE FROM messages WHERE stored_at < ?",
+                                         (time.time() - self.retention,))
+                    except Exception as e:
+                        log.error("❌ Ошибка очистки устаревших сообщений: %s", e)
+            finally:
+                # flush() и close() ждут эти события — они выставляются при любом исходе
+                for waiter in waiters:
+                    waiter.set()
+
+            if batch[-1] is None:
+                conn.close()
+                return
+
+
+    @staticmethod
+    def _write_batch(conn: sqlite3.Connection, writes: list):
+        """
+        Фиксирует пачку одной транзакцией. Если она откатилась (например,
+        "database is locked" при шардированном запуске), операции повторяются
+        по одной, и теряется только та, что не выполняется сама по себе.
+        """
+        if not writes:
+            return
+        try:
+            with conn:
+                for sql, params in writes:
+                    conn.execute(sql, params)
+            return
+        except Exception as e:
+            log.warning("⚠️ Пачка записи в SQLite (%s операций) откатилась: %s; повтор по одной",
+                        len(writes), e)
+        failed = 0
+        for sql, params in writes:
+            try:
+                with conn:
+                    conn.execute(sql, params)
+            except Exception as e:
+                failed += 1
+                log.error("❌ Ошибка записи в SQLite: %s (%s)", e, sql.split(" (", 1)[0])
+        if failed:
+            log.error("❌ Не записано операций: %s из %s", failed, len(writes))
+
+
+def create_storage(backend: str, path: str, retention: float = None, max_queue: int = 0) -> MemoryStorage:
+    """Создает бэкенд хранилища по имени из конфигурации."""
+    if backend == "sqlite":
+        return SQLiteStorage(path, retention=retention, max_queue=max_queue)
+    if backend == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Неизвестный бэкенд хранилища: {backend}")
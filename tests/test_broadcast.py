@@ -0,0 +1,37 @@
+import os
+import threading
+
+from backpressure import LoadShedder
+from broadcast import CANCELLED, PAUSED, BroadcastJob, BroadcastJournal
+
+
+def test_cancelled_checkpoint_is_not_resumed(tmp_path):
+    journal = BroadcastJournal(str(tmp_path))
+    job = BroadcastJob([1, 2, 3], payload={"type": "text", "content": "hi"})
+    journal.create(job)
+    job.record(True, 1, 0)
+    job.cancel()
+    journal.save(job)
+
+    assert journal.load_all() == []
+    assert os.listdir(tmp_path) == []
+
+
+def test_checkpoint_restores_state():
+    job = BroadcastJob([1, 2, 3])
+    job.pause()
+    assert BroadcastJob.from_dict(job.to_dict(), job.chat_ids).state == PAUSED
+    job.cancel()
+    assert BroadcastJob.from_dict(job.to_dict(), job.chat_ids).state == CANCELLED
+
+
+def test_cancel_interrupts_load_shedding_wait():
+    shedder = LoadShedder(broadcast_at=0.5)
+    shedder.watch("outbox", lambda: 10, 10)
+    job = BroadcastJob([1, 2, 3])
+    waiter = threading.Thread(target=shedder.wait_for_broadcast, args=(job, 0.01))
+    waiter.start()
+    job.cancel()
+    waiter.join(timeout=1)
+    assert not waiter.is_alive()
+    assert job.next_chat() is None
@@ -0,0 +1,38 @@
+from coalesce import split_text, truncate_html
+
+
+def test_truncate_html_keeps_short_text():
+    assert truncate_html("<b>hi</b>", 20) == "<b>hi</b>"
+
+
+def test_truncate_html_closes_open_tags():
+    result = truncate_html("<b>" + "x" * 50 + "</b>", 20)
+    assert len(result) <= 20
+    assert result.startswith("<b>x")
+    assert result.endswith("…</b>")
+
+
+def test_truncate_html_does_not_cut_tag_or_entity():
+    assert truncate_html("abc<i>def</i>", 6) == "abc…"
+    assert truncate_html("ab &amp; cd", 6) == "ab …"
+
+
+def test_split_text_packs_parts_under_limit():
+    chunks = split_text(["a" * 10, "b" * 10, "c" * 10], 25, "H")
+    assert chunks == ["H\n\n" + "a" * 10 + "\n\n" + "b" * 10, "c" * 10]
+    assert all(len(chunk) <= 25 for chunk in chunks)
+
+
+def test_split_text_never_sends_header_alone():
+    chunks = split_text(["x" * 50, "y" * 10], 40, "HEADER")
+    assert len(chunks) == 2
+    assert chunks[0].startswith("HEADER\n\nx")
+    assert len(chunks[0]) <= 40
+    assert chunks[1] == "y" * 10
+
+
+def test_split_text_truncates_long_part_without_header():
+    chunks = split_text(["<b>" + "z" * 100 + "</b>"], 30)
+    assert len(chunks) == 1
+    assert len(chunks[0]) <= 30
+    assert chunks[0].endswith("…</b>")
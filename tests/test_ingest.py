@@ -0,0 +1,70 @@
+from ingest import ReorderBuffer, UpdateFilter
+
+
+class StateBackend:
+    def __init__(self, state=None):
+        self.state = dict(state or {})
+
+    def load_state(self, key):
+        return self.state.get(key)
+
+    def save_state(self, key, value):
+        self.state[key] = value
+
+
+def business_message(update_id, chat_id, message_id):
+    return {"update_id": update_id,
+            "business_message": {"chat": {"id": chat_id}, "message_id": message_id}}
+
+
+def edited_message(update_id, chat_id, message_id):
+    return {"update_id": update_id,
+            "edited_business_message": {"chat": {"id": chat_id}, "message_id": message_id}}
+
+
+def test_held_update_does_not_block_other_chats():
+    backend = StateBackend()
+    update_filter = UpdateFilter(backend)
+    processed = []
+    buffer = ReorderBuffer(processed.extend, lambda chat_id, message_id: False, delay=60)
+
+    # Правка в чате 1 ждет оригинал и остается незавершенной
+    batch = [edited_message(1, 1, 10)] + [business_message(i, 2, i) for i in range(2, 101)]
+    buffer.submit(update_filter.accept(batch))
+    for payload in processed:
+        update_filter.done(payload["update_id"])
+    update_filter.commit()
+
+    assert len(buffer) == 1
+    assert update_filter.offset == 101
+    assert backend.state["updates_offset"] == "1"
+
+    # Следующая пачка из другого чата принимается, а не отсеивается как повтор
+    processed.clear()
+    fresh = update_filter.accept([business_message(i, 3, i) for i in range(101, 151)])
+    buffer.submit(fresh)
+    assert [payload["update_id"] for payload in processed] == list(range(101, 151))
+    assert update_filter.duplicates == 0
+    assert update_filter.offset == 151
+
+    for payload in processed:
+        update_filter.done(payload["update_id"])
+    update_filter.done(1)
+    update_filter.commit()
+    assert backend.state["updates_offset"] == "151"
+
+
+def test_restart_resumes_from_watermark():
+    backend = StateBackend()
+    update_filter = UpdateFilter(backend)
+    update_filter.accept([business_message(i, 1, i) for i in (5, 6, 7)])
+    update_filter.done(5)
+    update_filter.done(7)
+    update_filter.commit()
+    assert backend.state["updates_offset"] == "6"
+
+    restarted = UpdateFilter(backend)
+    assert restarted.offset == 6
+    fresh = restarted.accept([business_message(i, 1, i) for i in (5, 6, 7)])
+    assert [payload["update_id"] for payload in fresh] == [6, 7]
+    assert restarted.duplicates == 1
@@ -0,0 +1,113 @@
+"""
+Собственный HTTP-приемник вебхуков Telegram.
+
+Проверяет секретный токен, складывает обновления в очередь и передает их
+обработчикам бота из пула потоков (или в функцию dispatch). Для локальной
+проверки достаточно отправить записанное обновление:
+
+    curl -X POST http://127.0.0.1:8443/webhook \
+         -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" \
+         -H "Content-Type: application/json" \
+         --data @update.json
+"""
+import hmac
+import json
+import logging
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import telebot
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+log = logging.getLogger(__name__)
+
+
+class WebhookServer:
+    """HTTP-сервер, принимающий обновления и раздающий их пулу обработчиков."""
+
+    def __init__(self, bot: telebot.TeleBot, host: str, port: int, path: str = "/webhook",
+                 secret_token: str = None, workers: int = 4, queue_size: int = 1000,
+                 dispatch=None):
+        self.bot = bot
+        # dispatch(payload) получает обновление в виде словаря вместо bot.process_new_updates
+        self.dispatch = dispatch
+        self.path = path
+        self.secret_token = secret_token
+        self.workers = workers
+        self.updates = queue.Queue(maxsize=queue_size)
+        self._threads = []
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                server._handle_post(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    def _handle_post(self, request: BaseHTTPRequestHandler):
+        if request.path != self.path:
+            request.send_error(404)
+            return
+
+        if self.secret_token:
+            received = request.headers.get(SECRET_HEADER, "")
+            if not hmac.compare_digest(received.encode(), self.secret_token.encode()):
+                request.send_error(403)
+                return
+
+        try:
+            length = int(request.headers.get("Content-Length", 0))
+            payload = json.loads(request.rfile.read(length))
+        except (ValueError, UnicodeDecodeError):
+            request.send_error(400)
+            return
+
+        try:
+            self.updates.put_nowait(payload)
+        except queue.Full:
+            # Telegram повторит доставку позже
+            request.send_error(503)
+            return
+
+        request.send_response(200)
+        request.send_header("Content-Length", "0")
+        request.end_headers()
+
+    def _worker(self):
+        while True:
+            payload = self.updates.get()
+            if payload is None:
+                return
+            try:
+                if self.dispatch is not None:
+                    self.dispatch(payload)
+                    continue
+                update = telebot.types.Update.de_json(payload)
+                self.bot.process_new_updates([update])
+            except Exception as e:
+                log.exception("❌ Ошибка обработки обновления из вебхука: %s", e)
+
+    def serve_forever(self):
+        """Запускает пул обработчиков и HTTP-сервер (блокирующий вызов)."""
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"webhook-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        host, port = self.httpd.server_address[:2]
+        log.info("🌐 Вебхук слушает http://%s:%s%s", host, port, self.path)
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.httpd.server_close()
+            for _ in self._threads:
+                self.updates.put(None)
+
+    def shutdown(self):
+        self.httpd.shutdown()